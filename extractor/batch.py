@@ -0,0 +1,80 @@
+"""Headless extraction. Runs the same pipeline as the extractor GUI over a whole directory of tdms files with every detected event
+accepted, writing EVENTS.hdf5, OVERVIEW.hdf5, props.pkl and run_log.jsonl into the directory just like the GUI does.
+Files can be extracted in parallel by several worker processes within a RAM budget; files too big to process whole within the
+budget are streamed through in chunks instead. With --continuous the files are instead treated as one continuous recording and
+streamed through in order, so that events straddling the end of one file and the start of the next are found whole.
+Run from this directory with: python batch.py <directory> [--workers N] [--memory-gb M] [--continuous] [name=value ...] to override settings from cfg.txt."""
+
+import os
+import logging
+import argparse
+import multiprocessing
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from model import Model, extract_file, extract_run, PRESCREEN_REASON
+from extractor_utils.run_log import RunLog
+from extractor_utils.scheduler import plan_files, run_in_order
+from extractor_utils.util_funcs import check_path_existence, default_settings, parse_setting
+
+def extract_directory(dir_path: str, settings: dict | None = None, progress = None, workers: int = 1, memory_budget: float | None = None,
+                      chunk_size: int = 10000000, continuous: bool = False) -> dict:
+    """Extracts every event in dir_path. settings override the defaults from cfg.txt, and progress, if given, is called with
+    (files done, total files, events saved) after each file. With more than one worker files are extracted in parallel, as many
+    at a time as fit in memory_budget /bytes (see plan_files and run_in_order). With continuous the files are streamed through
+    in order as one recording instead (see extract_run), so that detection runs across file boundaries. Returns a summary of the run."""
+    run_settings = default_settings()
+    if settings is not None:
+        run_settings.update(settings)
+    sample_rate = int(run_settings["sample_rate"])
+
+    model = Model()
+    model.open_tdms_dir(dir_path)
+    model.make_output_file(os.path.join(dir_path, 'EVENTS.hdf5'))
+    model.add_group('current_data', attrs = {"sample_rate": sample_rate, "event_berth": int(run_settings["event_berth"])})
+    model.open_overview(os.path.join(dir_path, 'OVERVIEW.hdf5'), sample_rate)
+    log_path = os.path.join(dir_path, "run_log.jsonl")
+    if check_path_existence(log_path):
+        os.remove(log_path)
+    run_log = RunLog(log_path)
+    pool = None
+    if continuous:
+        results = extract_run(dir_path, run_settings, chunk_size=chunk_size)
+    else:
+        plan = plan_files(model.tdms.file_list, run_settings["detector"], memory_budget, chunk_size=chunk_size)
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) if workers > 1 else None
+        results = run_in_order(plan, partial(extract_file, settings=run_settings, chunk_size=chunk_size), pool=pool,
+                               workers=workers, memory_budget=memory_budget)
+    accepted = 0
+    prescreened = 0
+    try:
+        for n, result in enumerate(results):
+            if result["readable"]:
+                accepted += model.add_extracted_file(result, accepted + 1)
+                status = "accepted" if result["reason"] is None else "rejected"
+                prescreened += result["reason"] == PRESCREEN_REASON
+                run_log.record(result["file"], status, result["reason"], **result["log_fields"])
+            else:
+                logging.info(f"Problem reading file '{result['file']}', skipping.")
+            if progress is not None:
+                progress(n + 1, len(model.tdms), accepted)
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+        logging.info(model.timer.summary())
+        model.save_outputs(dir_path)
+        run_log.close()
+    logging.info(f"All done! {len(model.tdms)} tdms files read, {prescreened} skipped by the prescreen, {accepted} events saved.")
+    return {"files": len(model.tdms), "prescreened": prescreened, "events": accepted}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract every event in a directory of tdms files without the GUI.")
+    parser.add_argument("dir")
+    parser.add_argument("settings", nargs="*", help="Settings overriding cfg.txt as name=value")
+    parser.add_argument("--workers", type=int, default=1, help="Files extracted at once")
+    parser.add_argument("--memory-gb", type=float, default=None, help="RAM the workers may use between them /GB")
+    parser.add_argument("--continuous", action="store_true", help="Treat the files as one recording so events can cross file boundaries")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    overrides = {name: parse_setting(val) for name, val in (arg.split("=") for arg in args.settings)}
+    extract_directory(args.dir, overrides, workers=args.workers, memory_budget=None if args.memory_gb is None else args.memory_gb*1e9,
+                      continuous=args.continuous)
@@ -1,18 +1,21 @@
 from PyQt6.QtWidgets import QFileDialog
 from PyQt6.QtCore import QTimer
 from view import ErrorDialog, AllDone
-from model import EventError, ReachedEnd, BadIndex
+from model import EventError, ReachedEnd, BadIndex, PRESCREEN_REASON
 import os
 import logging
 import matplotlib.pyplot as plt
 import numpy as np
 from math import ceil
-from extractor_utils.util_funcs import check_path_existence, is_nan_ignore_None, dir_contains_ext, writeline_in
+from extractor_utils.util_funcs import check_path_existence, is_nan_ignore_None, dir_contains_ext, read_cfg
+from extractor_utils.run_log import RunLog
 from view import MainWindow
 from model import Model
+from extractor_utils.filtering import StreamingFilter
 import glob
-import datetime
 import sys
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 class Controller():
     """This class is the home of all the spaghetti in this program. It ties together the view part of the program(GUI) and the underlying
@@ -26,7 +29,13 @@ class Controller():
         self.n_trace = 0 #Total number of traces to be looked at
         self.accepted_events = 0
         self.rejected_events = 0
+        self.prescreened_files = 0 #Files skipped by the prescreen without a baseline fit
+        self.file_accepted = 0 #Events accepted/rejected in the current file, for the run log
+        self.file_rejected = 0
+        self.run_log = None
+        self.file_open = False #Whether the current file still needs an entry in the run log
         self.plotting = True
+        self.pool = None #Worker process that prepares files ahead of the one on screen
         self._set_initial_state()
         self._get_default_settings()
         try:
@@ -46,11 +55,12 @@ class Controller():
         logging.getLogger().addHandler(self._v.logger)
         logging.getLogger().setLevel(logging.INFO)
         
-    def _create_dump_file(self):
-        self.dump_path = os.path.join(self.dir_path,"dump.txt")
-        if check_path_existence(self.dump_path):
-            logging.info("Dump file already exists. Replacing with new one.")
-            os.remove(self.dump_path)
+    def _create_run_log(self):
+        self.run_log_path = os.path.join(self.dir_path,"run_log.jsonl")
+        if check_path_existence(self.run_log_path):
+            logging.info("Run log already exists. Replacing with new one.")
+            os.remove(self.run_log_path)
+        self.run_log = RunLog(self.run_log_path)
         
     def _set_initial_state(self):
         self._v.lock_all_controls()
@@ -59,22 +69,19 @@ class Controller():
         __location__ = os.path.realpath(
         os.path.join(os.getcwd(), os.path.dirname(__file__)))
         cfg_filename = os.path.join(__location__, 'cfg.txt')
-        with open(cfg_filename) as f:
-            for line in f:
-                if line[0] == "#":
-                    continue
-                no_space = "".join(line.split())
-                split = no_space.split('=')
-                if len(split) > 2:
-                    ErrorDialog("cfg file should have only one setting per line!")
-                    self._v.close()
-                    return None
-                try:
-                    self._v.settings_dict[split[0]].set_val(split[1])
-                except:
-                    ErrorDialog(f"Issue setting {split[0]} to {split[1]}; check setting name is correct (should be one of {self._v.settings_dict.keys()}).")
-                    self._v.close()
-                    return None
+        try:
+            cfg = read_cfg(cfg_filename)
+        except ValueError as e:
+            ErrorDialog(str(e))
+            self._v.close()
+            return None
+        for name, val in cfg.items():
+            try:
+                self._v.settings_dict[name].set_val(val)
+            except:
+                ErrorDialog(f"Issue setting {name} to {val}; check setting name is correct (should be one of {self._v.settings_dict.keys()}).")
+                self._v.close()
+                return None
 
     def _connect_IO_buttons(self):
         self._v.browseButton.clicked.connect(self.open_dir_dialog)
@@ -82,7 +89,7 @@ class Controller():
     def _connect_buttons(self):
         self._v.browseButton.clicked.connect(self.open_dir_dialog)
         self._v.startButton.clicked.connect(self._initialise_data_and_display)
-        self._v.skipButton.clicked.connect(self.next_valid_batch)
+        self._v.skipButton.clicked.connect(self.skip_file)
         self._v.acceptButton.clicked.connect(self.accept_event)
         self._v.rejectButton.clicked.connect(self.reject_event)
         self._v.keepAcceptingButton.clicked.connect(self.start_accepting)
@@ -106,11 +113,19 @@ class Controller():
         except:
             ErrorDialog("Incorrect settings. Please correct and try again.")
             return None
+        if self.settings_dict["filter_type"] != "none":
+            try:
+                StreamingFilter(self.settings_dict["filter_type"], float(self.settings_dict["filter_cutoff"]), float(self.settings_dict["sample_rate"]))
+            except ValueError as e:
+                ErrorDialog(f"Invalid filter settings: {e}")
+                return None
         self.dir_path = data_location
-        self._create_dump_file()
+        self._create_run_log()
+        self.pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn"))
         self._m.open_tdms_dir(self.dir_path)
         self._m.make_output_file(os.path.join(self.dir_path, 'EVENTS.hdf5'))
-        self._m.add_group('current_data', attrs = {"sample_rate":self.settings_dict["sample_rate"]})
+        self._m.add_group('current_data', attrs = {"sample_rate":self.settings_dict["sample_rate"], "event_berth":int(self.settings_dict["event_berth"])})
+        self._m.open_overview(os.path.join(self.dir_path, 'OVERVIEW.hdf5'), float(self.settings_dict["sample_rate"]))
 
         self._v.tracePlot.set_title(f"Trace Plot: {self.current_trace_n}/{len(self._m.tdms)}")
         self._v.lock_IO_panel()
@@ -123,6 +138,15 @@ class Controller():
  
     #DATA PROCESSING FUNCTIONS THAT UPDATE MODEL STATE
 
+    def log_file(self, status: str, reason: str | None = None):
+        """Records the outcome for the current file in the run log."""
+        self.run_log.record(self._m.tdms.get_file_name(), status, reason, **self._m.file_log_fields(self.file_accepted, self.file_rejected))
+        self.file_open = False
+
+    def skip_file(self):
+        self.log_file("skipped", "skipped by user")
+        self.next_valid_batch()
+
     def next_valid_batch(self):
         self.process_next()
         self.update_trace_plot()
@@ -141,6 +165,7 @@ class Controller():
 
         except EventError:
             logging.info(f"Finished file '{self._m.tdms.file_list[self._m.tdms.current_file]}'")
+            self.log_file("accepted")
             self.next_valid_batch()
 
     def process_next(self):
@@ -148,23 +173,19 @@ class Controller():
         the program will stay in this loop until a valid batch is found."""
         while True:
             try:
-                self._m.next_file()
+                reason = self._m.next_prepared_file(self.pool, self.settings_dict)
             except ReachedEnd:
                 self.finish()
             self.current_trace_n += 1
-            logging.debug("Correcting trace slope")
-            try:
-                self._m.slope_fix_average_run_method(self._m.current_data)
-            except:
-                logging.info(f"Slope correction and therefore extraction failed on file {self._m.tdms.get_file_name()}. Skipping.")
-                writeline_in(self.dump_path,f"{datetime.datetime.now()}: Couldn't correct slope or extract events in {self._m.tdms.get_file_name()}")
-                continue
-            self._m.update_event_boundaries(float(self.settings_dict['event_thresh']), int(self.settings_dict["gap_tol"]))
-            if len(self._m.event_boundaries) == 0:
-                logging.debug(f"No events in file {self._m.tdms.get_file_name()}, moving on...")
-                writeline_in(self.dump_path,f"{datetime.datetime.now()}: Found no events in {self._m.tdms.get_file_name()}.")
+            self.file_accepted = 0
+            self.file_rejected = 0
+            self._m.add_file_to_overview()
+            if reason is not None:
+                self.prescreened_files += reason == PRESCREEN_REASON
+                self.log_file("rejected", reason)
                 continue
             break
+        self.file_open = True
         logging.debug(f"{len(self._m.current_data)} samples loaded.")
 
     #EVENT HANDLING FUNCTIONS
@@ -176,15 +197,15 @@ class Controller():
         berth = int(self.settings_dict["event_berth"])
         sample_rate = int(self.settings_dict["sample_rate"])
         ename = f"Event_No_{self.accepted_count}"
-        event_attrs = self._m.gen_event_attrs(ename,berth, sample_rate)
-        self._m.create_dataset('current_data',ename,self._m.event_data)
-        self._m.add_to_df(event_attrs)
+        self._m.save_event(ename, berth, sample_rate)
         self.accepted_events += 1
+        self.file_accepted += 1
         self.next_event()
 
     def reject_event(self):
         logging.info("Rejecting event.")
         self.rejected_events += 1
+        self.file_rejected += 1
         self.next_event()
 
     #EVENT HANDLING LOOP FUNCTIONS
@@ -280,9 +301,13 @@ class Controller():
 
     def finish(self):
         """Closes output file and the window"""
+        if self.file_open:
+            self.log_file("accepted", "finished before end of file")
+        logging.info(self._m.timer.summary())
         self._v.close()
-        self._m.output_df.to_pickle(os.path.join(self.dir_path, "props.pkl"))
-        self._m.output.close()
-        AllDone(f"All done! {len(self._m.tdms.file_list)} tdms files read, {self.accepted_count} events saved.")
+        self._m.save_outputs(self.dir_path)
+        self.pool.shutdown()
+        self.run_log.close()
+        AllDone(f"All done! {len(self._m.tdms.file_list)} tdms files read, {self.prescreened_files} skipped by the prescreen, {self.accepted_count} events saved.")
         sys.exit()
         
\ No newline at end of file
@@ -0,0 +1,156 @@
+import numpy as np
+from scipy.ndimage import uniform_filter1d
+
+DETECTORS = ["threshold", "ksigma", "cusum"]
+
+def get_lims(hits):
+    """Turns an array of sample indices into [left, right] pairs, one for each run of consecutive indices."""
+    runs = np.diff(hits)
+    lims = np.where(runs > 1)[0]
+    limits = []
+    for i in np.arange(len(lims) + 1):
+        if i == 0:
+            left = hits[0]
+        try:
+            right = hits[lims[i]]
+            limits.append([left, right])
+            left = hits[lims[i]+1]
+        except IndexError:
+            right = hits[-1]
+            limits.append([left, right])
+    return limits
+
+def merge_lims(lims, dist = 100):
+    """Merges [left, right] pairs separated by no more than dist samples."""
+    pairs = lims.copy()
+    space = np.array([pairs[i+1][0] - pairs[i][1] for i in np.arange(len(pairs) - 1)])
+    merge_locs = np.where(space > dist)[0].astype(int)
+    if len(merge_locs) == 0:
+        return pairs
+    new_list = []
+    for i, loc in enumerate(merge_locs):
+        if i == 0:
+            left = pairs[0][0]
+        try:
+            right = pairs[loc][1]
+            new_list.append([left, right])
+            left = pairs[loc + 1][0]
+        except IndexError:
+            right = pairs[-1][1]
+            new_list.append([left, right])
+    return new_list
+
+def join_close_lims(pairs: np.ndarray, dist: int) -> list:
+    """Vectorised merge of sorted [left, right] pairs separated by no more than dist samples. Unlike merge_lims, which is kept
+    unchanged so fixed-threshold extractions stay reproducible, every group of pairs (including the last) is returned."""
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    if len(pairs) == 0:
+        return []
+    new_group = np.concatenate(([True], (pairs[1:, 0] - pairs[:-1, 1]) > dist))
+    group_starts = np.flatnonzero(new_group)
+    group_ends = np.append(group_starts[1:], len(pairs)) - 1
+    return np.column_stack((pairs[group_starts, 0], pairs[group_ends, 1])).tolist()
+
+def threshold_boundaries(data: np.ndarray, thresh: float, tol: int) -> list:
+    """Event boundaries from a single fixed threshold below the (corrected) baseline."""
+    hits = np.where(data < thresh)[0]
+    if len(hits) == 0:
+        return []
+    return merge_lims(get_lims(hits), tol)
+
+def rolling_baseline(data: np.ndarray, window: int, clip: float = 3.0, iterations: int = 3) -> tuple[np.ndarray, np.ndarray]:
+    """Local baseline and noise level from running means over a window of samples. After each pass, samples more than clip sigma
+    below the local baseline are excluded from the next so events don't drag the estimate down. Every pass is a fixed number of running sums, so the cost is linear in trace length."""
+    data = np.asarray(data, dtype=float)
+    weights = np.ones(len(data))
+    baseline = noise = None
+    for _ in range(iterations):
+        w_mean = uniform_filter1d(weights, window, mode='reflect')
+        usable = w_mean > 1e-3
+        safe_w_mean = np.where(usable, w_mean, 1)
+        new_baseline = uniform_filter1d(data*weights, window, mode='reflect')/safe_w_mean
+        new_noise = np.sqrt(np.maximum(uniform_filter1d(data**2*weights, window, mode='reflect')/safe_w_mean - new_baseline**2, 0))
+        if baseline is None:
+            baseline, noise = new_baseline, new_noise
+        else:
+            #Where a window is almost entirely event keep the previous estimate
+            baseline = np.where(usable, new_baseline, baseline)
+            noise = np.where(usable, new_noise, noise)
+        weights = (data > baseline - clip*noise).astype(float)
+    return baseline, noise
+
+def ksigma_boundaries(data: np.ndarray, window: int, k: float, tol: int) -> list:
+    """Event boundaries where the trace drops more than k local noise levels below the local baseline."""
+    baseline, noise = rolling_baseline(data, window)
+    hits = data < baseline - k*noise
+    if not np.any(hits):
+        return []
+    edges = np.diff(hits.astype(np.int8), prepend=0, append=0)
+    return join_close_lims(np.column_stack((np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1)), tol)
+
+def cusum_boundaries(data: np.ndarray, window: int, k: float, tol: int, h: float = 5.0) -> list:
+    """Event boundaries from a one-sided CUSUM on the locally standardised trace, tuned to detect drops of k sigma. S is reset
+    whenever the trace comes back above the local baseline, so consecutive events aren't joined by the slow decay of S.
+    The recursion S_t = max(0, S_t-1 + x_t) is evaluated in closed form as C_t - min(0, min C_s) with C the cumulative sum of
+    the increments since the last reset, so no sample loop is needed. An event is a stretch where S is positive and reaches h; it starts after the last
+    sample with S at zero and ends where S peaks."""
+    baseline, noise = rolling_baseline(data, window)
+    z = (baseline - data)/np.where(noise > 0, noise, np.inf)
+    increments = z - k/2
+    reset = z <= 0
+    idx = np.arange(len(z))
+    total = np.cumsum(np.where(reset, 0, increments))
+    last_reset = np.maximum.accumulate(np.where(reset, idx, -1))
+    cumulative = total - np.where(last_reset >= 0, total[last_reset], 0)
+    segment = np.cumsum(reset)
+    #Shift each segment below all earlier ones so a single running minimum restarts at every reset
+    offset = segment*(2*np.max(np.abs(cumulative)) + 1)
+    running_min = np.minimum.accumulate(cumulative - offset) + offset
+    s = cumulative - np.minimum(running_min, 0)
+    positive = s > 0
+    if not np.any(s > h):
+        return []
+    edges = np.diff(positive.astype(np.int8), prepend=0, append=0)
+    starts = np.flatnonzero(edges == 1)
+    peaks = np.maximum.reduceat(s, starts)
+    region = np.cumsum(edges[:-1] == 1) - 1
+    at_peak = np.flatnonzero(positive & (s == peaks[region]))
+    _, first = np.unique(region[at_peak], return_index=True)
+    keep = peaks > h
+    return join_close_lims(np.column_stack((starts[keep], at_peak[first][keep])), tol)
+
+def prescreen_trace(data: np.ndarray, thresh: float, margin: float = 0.02, block: int = 4096, k: float = 3.0) -> dict:
+    """Cheap check of whether the threshold detector could find any events in a raw trace, for skipping empty files before the
+    full baseline fit. The trace is summarised as the min, mean and standard deviation of blocks of samples, and a straight line
+    through the block means (leaving out blocks pulled down by events) stands in for the baseline. The trace is clear of events
+    only if every block minimum stays above the threshold from the line by k standard errors of the line, the most the full
+    baseline fit is likely to differ from it, plus margin*|thresh| to spare. Returns whether it is clear, the line as
+    (slope, intercept) in samples and the rough baseline and noise."""
+    n_blocks = len(data)//block
+    if thresh >= 0 or n_blocks < 3:
+        return {"clear": False}
+    blocks = np.asarray(data[:n_blocks*block]).reshape(n_blocks, block)
+    mins = blocks.min(axis=1)
+    means = blocks.mean(axis=1)
+    centres = (np.arange(n_blocks) + 0.5)*block - 0.5
+    keep = np.ones(n_blocks, dtype=bool)
+    for _ in range(2):
+        slope, intercept = np.polyfit(centres[keep], means[keep], 1)
+        residuals = means - (slope*centres + intercept)
+        keep = residuals > thresh/2
+        if np.count_nonzero(keep) < 3:
+            return {"clear": False}
+    #Standard error of the line where it is least certain, at the ends of the trace
+    fitted = centres[keep]
+    spread = np.sum((fitted - fitted.mean())**2)
+    scatter = np.sqrt(np.sum(residuals[keep]**2)/(len(fitted) - 2))
+    furthest = max(fitted.mean(), len(data) - 1 - fitted.mean())
+    stderr = scatter*np.sqrt(1/len(fitted) + furthest**2/spread)
+    starts = np.arange(n_blocks)*block
+    line_top = np.maximum(slope*starts, slope*(starts + block - 1)) + intercept
+    lowest = np.min(mins - line_top)
+    if n_blocks*block < len(data):
+        tail = np.arange(n_blocks*block, len(data))
+        lowest = min(lowest, np.min(data[tail] - (slope*tail + intercept)))
+    return {"clear": bool(lowest > thresh + k*stderr - margin*thresh), "line": (slope, intercept), "baseline": float(np.mean(means[keep])),
+            "noise": float(np.sqrt(np.mean(blocks.var(axis=1)[keep])))}
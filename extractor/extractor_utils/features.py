@@ -0,0 +1,254 @@
+import os
+import logging
+import numpy as np
+import h5py as h
+
+#Event features that depend only on the event's own data, so they can be recomputed from EVENTS.hdf5 without the raw trace.
+
+def crop_event(event_data: np.ndarray, berth: int) -> np.ndarray:
+    """Removes the berth saved either side of an event, as the extractor does before working out features."""
+    return event_data[berth:-(berth-1)]
+
+class EventBatch():
+    """Many cropped events stored end to end in one array, so features can be worked out for all of them at once with segment
+    reductions rather than a Python loop. Event i is values[offsets[i]:offsets[i + 1]]."""
+    def __init__(self, events: list[np.ndarray]):
+        self.lengths = np.array([len(event) for event in events], dtype=np.int64)
+        self.offsets = np.concatenate(([0], np.cumsum(self.lengths)))
+        self.values = np.concatenate(events) if len(events) > 0 else np.zeros(0)
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def positions(self) -> np.ndarray:
+        """Index of every value within its own event."""
+        return np.arange(len(self.values)) - np.repeat(self.offsets[:-1], self.lengths)
+
+    def _ranges(self, starts: np.ndarray | None, stops: np.ndarray | None) -> tuple[np.ndarray, np.ndarray]:
+        starts = self.offsets[:-1] + (0 if starts is None else starts)
+        stops = self.offsets[:-1] + (self.lengths if stops is None else stops)
+        return starts, np.maximum(stops, starts)
+
+    def segment_sum(self, values: np.ndarray, starts: np.ndarray | None = None, stops: np.ndarray | None = None) -> np.ndarray:
+        """Sum of values (one per sample) over each event, or over samples starts[i]:stops[i] of event i."""
+        starts, stops = self._ranges(starts, stops)
+        if len(self) == 1:
+            #A single event (e.g. one accepted in the GUI) is summed directly, which is much quicker
+            return np.array([np.sum(values[starts[0]:stops[0]])])
+        #Each range is summed on its own rather than as a difference of a cumulative sum over the whole batch, which loses
+        #precision in the later events. A 0 is added at the end so the stop of the last event is a valid index.
+        sums = np.add.reduceat(np.append(values, 0), np.column_stack((starts, stops)).ravel())[::2]
+        return np.where(stops > starts, sums, 0)
+
+    def segment_min(self, empty: float = 0) -> np.ndarray:
+        mins = np.full(len(self), empty, dtype=float)
+        filled = self.lengths > 0
+        if np.any(filled):
+            mins[filled] = np.minimum.reduceat(self.values, self.offsets[:-1][filled])
+        return mins
+
+    def segment_trapz(self, values: np.ndarray, starts: np.ndarray | None = None, stops: np.ndarray | None = None) -> np.ndarray:
+        """Trapezium rule integral (unit spacing, as np.trapz) of values over each event, or over samples starts[i]:stops[i] of event i."""
+        starts, stops = self._ranges(starts, stops)
+        if len(self) == 1:
+            return np.array([np.trapz(values[starts[0]:stops[0]])])
+        total = self.segment_sum(values, starts - self.offsets[:-1], stops - self.offsets[:-1])
+        long_enough = stops - starts > 1
+        ends = np.zeros(len(self))
+        ends[long_enough] = values[starts[long_enough]] + values[stops[long_enough] - 1]
+        return np.where(long_enough, total - ends/2, 0.0)
+
+class FeatureRegistry():
+    """Named event features, each a function working on a whole EventBatch at once. A feature can declare the features it depends
+    on, which are worked out first and passed to it, so shared pieces (like the event area) are only computed once. default marks
+    the features the extractor saves in props.pkl; the rest are only worked out when asked for. Bump version when changing a
+    feature so that cached values of it are recomputed."""
+    def __init__(self):
+        self.features = {}
+        self._orders = {}
+
+    def register(self, name: str, depends: tuple[str, ...] = (), default: bool = True, version: int = 1):
+        """Decorator adding func(batch, deps, sample_rate) -> one value per event as feature name."""
+        def add(func):
+            for dep in depends:
+                if dep not in self.features:
+                    raise ValueError(f"Feature '{name}' depends on unknown feature '{dep}'")
+            self.features[name] = {"func": func, "depends": tuple(depends), "default": default, "version": version}
+            self._orders = {}
+            return func
+        return add
+
+    def version_key(self, name: str) -> str:
+        """Versions of a feature and everything it depends on, so that a cached value is recomputed when any of them change."""
+        return ",".join(f"{dep}:{self.features[dep]['version']}" for dep in self.order([name]))
+
+    def defaults(self) -> list[str]:
+        return [name for name, feature in self.features.items() if feature["default"]]
+
+    def order(self, names: list[str]) -> list[str]:
+        """The given features and everything they depend on, dependencies first."""
+        key = tuple(names)
+        if key in self._orders:
+            return list(self._orders[key])
+        ordered = []
+        def visit(name):
+            if name in ordered:
+                return
+            if name not in self.features:
+                raise ValueError(f"Unknown feature '{name}', should be one of {list(self.features)}")
+            for dep in self.features[name]["depends"]:
+                visit(dep)
+            ordered.append(name)
+        for name in names:
+            visit(name)
+        self._orders[key] = tuple(ordered)
+        return ordered
+
+    def compute(self, batch: EventBatch, names: list[str], sample_rate: float, known: dict[str, np.ndarray] | None = None) -> dict[str, np.ndarray]:
+        """Works out the named features for every event in batch. Values already in known are used instead of being recomputed.
+        Features are worked out with numpy's divide and invalid value warnings off, as empty or flat events give 0/0."""
+        values = {} if known is None else dict(known)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            for name in self.order(names):
+                if name not in values:
+                    feature = self.features[name]
+                    values[name] = feature["func"](batch, {dep: values[dep] for dep in feature["depends"]}, sample_rate)
+        return {name: values[name] for name in names}
+
+REGISTRY = FeatureRegistry()
+
+#The features saved by the extractor, in the order of the columns of props.pkl. They reproduce the original per-event numpy code.
+
+@REGISTRY.register("samples")
+def samples(batch, deps, sample_rate):
+    return batch.lengths.copy()
+
+@REGISTRY.register("duration_s", depends=("samples",))
+def duration_s(batch, deps, sample_rate):
+    return deps["samples"]/sample_rate
+
+@REGISTRY.register("peak")
+def peak(batch, deps, sample_rate):
+    return batch.segment_min(empty=0)
+
+@REGISTRY.register("area", default=False)
+def area(batch, deps, sample_rate):
+    """Integral of the event in nA samples."""
+    return batch.segment_trapz(batch.values)
+
+@REGISTRY.register("ecd", depends=("area",))
+def ecd(batch, deps, sample_rate):
+    """Event charge deficit."""
+    return deps["area"]/sample_rate
+
+@REGISTRY.register("mean", depends=("samples",))
+def mean(batch, deps, sample_rate):
+    return batch.segment_sum(batch.values)/deps["samples"]
+
+@REGISTRY.register("ffap", depends=("area",))
+def ffap(batch, deps, sample_rate):
+    """Fraction of the event area in its first fifth."""
+    return batch.segment_trapz(batch.values, stops=batch.lengths//5)/deps["area"]
+
+@REGISTRY.register("lfap", depends=("area",))
+def lfap(batch, deps, sample_rate):
+    """Fraction of the event area in its last fifth."""
+    return batch.segment_trapz(batch.values, starts=batch.lengths + (-batch.lengths)//5)/deps["area"]
+
+@REGISTRY.register("skew")
+def skew(batch, deps, sample_rate):
+    """Ratio of the event area weighted towards its end to that weighted towards its start."""
+    spans = np.repeat(np.maximum(batch.lengths - 1, 1), batch.lengths)
+    rising = batch.positions()/spans
+    return batch.segment_trapz(batch.values*rising)/batch.segment_trapz(batch.values*(1 - rising))
+
+#Extra features, only worked out when asked for (e.g. by plotting them in multi_filter).
+
+@REGISTRY.register("std", depends=("mean", "samples"), default=False)
+def std(batch, deps, sample_rate):
+    """Standard deviation of the current within the event."""
+    deviations = batch.values - np.repeat(deps["mean"], batch.lengths)
+    return np.sqrt(batch.segment_sum(deviations**2)/deps["samples"])
+
+@REGISTRY.register("peak_position", default=False)
+def peak_position(batch, deps, sample_rate):
+    """Where the peak falls in the event, from 0 at its start to 1 at its end."""
+    owners = np.repeat(np.arange(len(batch)), batch.lengths)
+    order = np.lexsort((batch.values, owners))
+    positions = np.full(len(batch), np.nan)
+    filled = batch.lengths > 0
+    positions[filled] = batch.positions()[order[batch.offsets[:-1][filled]]]/np.maximum(batch.lengths[filled] - 1, 1)
+    return positions
+
+def event_features(event: np.ndarray, sample_rate: float, names: list[str] | None = None) -> dict:
+    """Works out the named features (the registry defaults if not given) of one cropped event."""
+    names = REGISTRY.defaults() if names is None else names
+    return {name: values[0] for name, values in REGISTRY.compute(EventBatch([event]), names, sample_rate).items()}
+
+def batch_features(events: list[np.ndarray], sample_rate: float, names: list[str] | None = None) -> list[dict]:
+    """Works out the named features (the registry defaults if not given) of many cropped events at once, which is much quicker
+    than event_features on each in turn. Returns one dict of features per event."""
+    names = REGISTRY.defaults() if names is None else names
+    values = REGISTRY.compute(EventBatch(events), names, sample_rate)
+    return [{name: values[name][i] for name in names} for i in range(len(events))]
+
+class FeatureStore():
+    """Cache of registry features for the events in an EVENTS.hdf5 file, kept as one column per feature in a side file next to it
+    (EVENTS.features.hdf5). A feature is only worked out, in batches of events, the first time it is asked for. The cache is thrown
+    away if the events file changes, and a feature is recomputed if its registered version, or that of any feature it depends on, changes."""
+    def __init__(self, events_path: str, berth: int | None = None, registry: FeatureRegistry = REGISTRY, batch_size: int = 2000):
+        self.events_path = events_path
+        self.registry = registry
+        self.batch_size = batch_size
+        self.path = os.path.splitext(events_path)[0] + ".features.hdf5"
+        with h.File(events_path, 'r') as f:
+            attrs = f["current_data"].attrs
+            self.sample_rate = float(attrs["sample_rate"])
+            if berth is None:
+                if "event_berth" not in attrs:
+                    raise ValueError(f"{events_path} doesn't record the event berth, it has to be given")
+                berth = int(attrs["event_berth"])
+            self.names = list(f["current_data"].keys())
+        self.berth = berth
+        self.source = f"{os.path.getsize(events_path)}:{os.path.getmtime(events_path)}:{berth}"
+        if os.path.exists(self.path):
+            with h.File(self.path, 'r') as cache:
+                stale = cache.attrs.get("source") != self.source
+            if stale:
+                logging.info(f"{events_path} has changed since its features were cached, clearing {self.path}.")
+                os.remove(self.path)
+
+    def cached(self) -> list[str]:
+        if not os.path.exists(self.path):
+            return []
+        with h.File(self.path, 'r') as cache:
+            return [name for name in cache if name in self.registry.features and cache[name].attrs["version"] == self.registry.version_key(name)]
+
+    def get(self, names: list[str]) -> dict[str, np.ndarray]:
+        """Values of the named features for every event, in the order of self.names, computing and caching any that aren't cached."""
+        cached = self.cached()
+        values = {}
+        if len(cached) > 0:
+            with h.File(self.path, 'r') as cache:
+                values = {name: cache[name][:] for name in self.registry.order(names) if name in cached}
+        missing = [name for name in self.registry.order(names) if name not in values]
+        if len(missing) > 0:
+            logging.info(f"Computing features {missing} for {len(self.names)} events...")
+            new = {name: [] for name in missing}
+            with h.File(self.events_path, 'r') as f:
+                group = f["current_data"]
+                for start in range(0, len(self.names), self.batch_size):
+                    batch_names = self.names[start:start + self.batch_size]
+                    batch = EventBatch([crop_event(group[name][:], self.berth) for name in batch_names])
+                    known = {name: vals[start:start + self.batch_size] for name, vals in values.items()}
+                    for name, vals in self.registry.compute(batch, missing, self.sample_rate, known).items():
+                        new[name].append(vals)
+            with h.File(self.path, 'a') as cache:
+                cache.attrs["source"] = self.source
+                for name, parts in new.items():
+                    values[name] = np.concatenate(parts) if len(parts) > 0 else np.zeros(0)
+                    if name in cache:
+                        del cache[name]
+                    cache.create_dataset(name, data=values[name])
+                    cache[name].attrs["version"] = self.registry.version_key(name)
+        return {name: values[name] for name in names}
@@ -0,0 +1,73 @@
+import numpy as np
+from scipy import signal
+
+FILTER_TYPES = ["none", "bessel", "butterworth", "gaussian"]
+
+class StreamingFilter():
+    """Low-pass filter that is applied to a trace chunk by chunk. The filter state (IIR delay line or FIR history) is carried
+    from one chunk to the next, so the output is the same as filtering the whole trace in one go and chunks can come straight from a streaming read."""
+    def __init__(self, filter_type: str, cutoff: float, sample_rate: float, order: int = 4):
+        if filter_type not in FILTER_TYPES[1:]:
+            raise ValueError(f"Invalid filter type '{filter_type}', should be one of {FILTER_TYPES[1:]}")
+        if not 0 < cutoff < sample_rate/2:
+            raise ValueError(f"Filter cutoff {cutoff} Hz must be between 0 and the Nyquist frequency {sample_rate/2} Hz")
+        self.filter_type = filter_type
+        self.sos = None
+        self.taps = None
+        if filter_type == "bessel":
+            self.sos = signal.bessel(order, cutoff, btype='low', output='sos', norm='mag', fs=sample_rate)
+        elif filter_type == "butterworth":
+            self.sos = signal.butter(order, cutoff, btype='low', output='sos', fs=sample_rate)
+        else:
+            #Gaussian sigma giving a -3dB point at the cutoff frequency
+            sigma = np.sqrt(np.log(2))/(2*np.pi*cutoff)*sample_rate
+            half_width = max(int(np.ceil(4*sigma)), 1)
+            self.taps = np.exp(-0.5*(np.arange(-half_width, half_width + 1)/sigma)**2)
+            self.taps /= np.sum(self.taps)
+        self.delay = self._get_delay(cutoff, sample_rate)
+        self.reset()
+
+    def _get_delay(self, cutoff: float, sample_rate: float) -> int:
+        """Group delay of the filter in whole samples, measured well inside the passband."""
+        if self.taps is not None:
+            return (len(self.taps) - 1)//2
+        _, gd = signal.group_delay(signal.sos2tf(self.sos), w=[cutoff/100], fs=sample_rate)
+        return int(round(gd[0]))
+
+    def reset(self):
+        """Clears the carried state so the next chunk is treated as the start of a new trace."""
+        self._zi = None
+        self._history = None
+        self._last = None
+
+    def process(self, chunk: np.ndarray) -> np.ndarray:
+        """Filters the next chunk of the trace, returning as many samples as were passed in."""
+        chunk = np.asarray(chunk, dtype=float)
+        if len(chunk) == 0:
+            return chunk
+        if self.sos is not None:
+            if self._zi is None:
+                self._zi = signal.sosfilt_zi(self.sos)*chunk[0]
+            out, self._zi = signal.sosfilt(self.sos, chunk, zi=self._zi)
+        else:
+            #Overlap-save: prepend the tail of the previous chunk and keep only the fully overlapped part of the convolution
+            if self._history is None:
+                self._history = np.full(len(self.taps) - 1, chunk[0])
+            extended = np.concatenate((self._history, chunk))
+            out = signal.fftconvolve(extended, self.taps, mode='valid')
+            self._history = extended[len(extended) - (len(self.taps) - 1):]
+        self._last = chunk[-1]
+        return out
+
+    def flush(self) -> np.ndarray:
+        """Pushes the final delay samples out of the filter by holding the last input value."""
+        if self._last is None or self.delay == 0:
+            return np.array([])
+        return self.process(np.full(self.delay, self._last))
+
+def filter_in_chunks(data: np.ndarray, filt: StreamingFilter, chunk_size: int = 1000000) -> np.ndarray:
+    """Filters a whole trace chunk by chunk and shifts the result back by the filter delay so it lines up with the input."""
+    filt.reset()
+    out = [filt.process(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size)]
+    out.append(filt.flush())
+    return np.concatenate(out)[filt.delay:]
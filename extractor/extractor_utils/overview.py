@@ -0,0 +1,157 @@
+import os
+import numpy as np
+import h5py as h
+
+def summarise_samples(data: np.ndarray, base: int = 256, offset: int = 0) -> np.ndarray:
+    """Level 0 overview bins of some samples as (min, max, mean, count, start) rows, with one bin per base samples and a shorter
+    last bin if needed. start is the index of each bin's first sample plus offset. Consecutive pieces of a file summarised separately
+    give the same bins as the whole file, as long as every piece but the last is a multiple of base long."""
+    full = len(data) - len(data) % base
+    groups = data[:full].reshape(-1, base)
+    bins = np.column_stack((groups.min(axis=1), groups.max(axis=1), groups.mean(axis=1), np.full(len(groups), base), np.arange(0, full, base)))
+    if full < len(data):
+        rest = data[full:]
+        bins = np.vstack((bins, [[rest.min(), rest.max(), rest.mean(), len(rest), full]]))
+    bins[:, 4] += offset
+    return bins
+
+class OverviewWriter():
+    """Builds a min/max/mean pyramid of a whole run as files are appended in order, in an HDF5 overview store. Level 0 has one bin
+    per base samples of each file and each level above combines factor bins of the one below, so any zoom can be drawn from a few
+    thousand bins. Every level stores the global start sample of its bins alongside them, so bins don't need to line up with file
+    boundaries and files can be summarised separately (see summarise_samples) by whichever process reads them.
+    The store also keeps the global start sample of each file and the global boundaries of the events found."""
+    def __init__(self, path: str, sample_rate: float, base: int = 256, factor: int = 8):
+        self.base = base
+        self.factor = factor
+        self.samples = 0
+        self.output = h.File(path, 'w')
+        self.output.attrs["sample_rate"] = sample_rate
+        self.output.attrs["base"] = base
+        self.output.attrs["factor"] = factor
+        self.output.create_dataset("files", shape=(0,), maxshape=(None,),
+                                   dtype=[("file", h.string_dtype()), ("start", np.int64), ("samples", np.int64)])
+        self.output.create_dataset("events", shape=(0, 2), maxshape=(None, 2), dtype=np.int64, chunks=(4096, 2))
+        self._carry = {} #Bins of each level not yet making up a full bin of the level above
+
+    def _level(self, k: int) -> tuple[h.Dataset, h.Dataset]:
+        name = f"level_{k}"
+        if name not in self.output:
+            self.output.create_dataset(name, shape=(0, 3), maxshape=(None, 3), dtype=np.float32, chunks=(8192, 3))
+            self.output.create_dataset(f"{name}_start", shape=(0,), maxshape=(None,), dtype=np.int64, chunks=(8192,))
+            self.output[name].attrs["bin_size"] = self.base*self.factor**k
+        return self.output[name], self.output[f"{name}_start"]
+
+    @staticmethod
+    def _combine(bins: np.ndarray, size: int) -> np.ndarray:
+        """Combines consecutive groups of size (min, max, mean, count, start) rows into one row each."""
+        groups = bins.reshape(-1, size, 5)
+        counts = groups[:, :, 3].sum(axis=1)
+        return np.column_stack((groups[:, :, 0].min(axis=1), groups[:, :, 1].max(axis=1), (groups[:, :, 2]*groups[:, :, 3]).sum(axis=1)/counts,
+                                counts, groups[:, 0, 4]))
+
+    def _push(self, k: int, bins: np.ndarray, final: bool = False):
+        """Adds bins to level k and passes every complete group of factor bins up to level k + 1, which is started as soon as
+        there is one. On the final push partial groups are passed up too, so the last bin of each level covers the end of the run."""
+        level, starts = self._level(k)
+        if len(bins) > 0:
+            level.resize(len(level) + len(bins), axis=0)
+            level[-len(bins):] = bins[:, :3]
+            starts.resize(len(starts) + len(bins), axis=0)
+            starts[-len(bins):] = bins[:, 4]
+        pending = np.concatenate((self._carry.get(k, np.zeros((0, 5))), bins))
+        full = len(pending) - len(pending) % self.factor
+        upper = self._combine(pending[:full], self.factor) if full > 0 else np.zeros((0, 5))
+        rest = pending[full:]
+        has_upper = len(upper) > 0 or f"level_{k + 1}" in self.output
+        if final and has_upper and len(rest) > 0:
+            upper = np.concatenate((upper, self._combine(rest, len(rest))))
+            rest = rest[:0]
+        self._carry[k] = rest
+        if len(upper) > 0 or (final and has_upper):
+            self._push(k + 1, upper, final)
+
+    def append_file(self, name: str, data: np.ndarray, event_boundaries = None):
+        """Appends one file's samples, and its events with boundaries given as sample indices within the file."""
+        self.append_summary(name, len(data), summarise_samples(data, self.base), event_boundaries)
+
+    def append_summary(self, name: str, n_samples: int, bins: np.ndarray, event_boundaries = None):
+        """Appends one file of n_samples from its level 0 bins, made by summarise_samples with starts counted from the start of the file."""
+        files = self.output["files"]
+        files.resize(len(files) + 1, axis=0)
+        files[-1] = (name, self.samples, n_samples)
+        if event_boundaries is not None and len(event_boundaries) > 0:
+            events = self.output["events"]
+            events.resize(len(events) + len(event_boundaries), axis=0)
+            events[-len(event_boundaries):] = np.asarray(event_boundaries, dtype=np.int64).reshape(-1, 2) + self.samples
+        bins = bins.copy()
+        bins[:, 4] += self.samples
+        self.samples += n_samples
+        if len(bins) > 0:
+            self._push(0, bins)
+
+    def close(self):
+        """Writes out the partial bins at the end of the run and closes the store."""
+        if "level_0" in self.output:
+            self._push(0, np.zeros((0, 5)), final=True)
+        self.output.attrs["samples"] = self.samples
+        self.output.attrs["levels"] = len([name for name in self.output if name.startswith("level_") and not name.endswith("_start")])
+        self.output.close()
+
+def _bisect(dataset: h.Dataset, value: int) -> int:
+    """Number of entries of a sorted 1D dataset that are <= value, reading only the entries a binary search visits."""
+    low, high = 0, len(dataset)
+    while low < high:
+        mid = (low + high)//2
+        if dataset[mid] <= value:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+class OverviewReader():
+    """Reads the part of an overview store needed to draw a range of the run at a given width, from the coarsest level that still has
+    at least max_bins bins in the range (or level 0 when zoomed in further), so only a few thousand rows are read whatever the zoom."""
+    def __init__(self, path: str):
+        self.file = h.File(path, 'r')
+        self.sample_rate = float(self.file.attrs["sample_rate"])
+        self.samples = int(self.file.attrs["samples"])
+        self.levels = [self.file[f"level_{k}"] for k in range(int(self.file.attrs["levels"]))]
+        self.level_starts = [self.file[f"level_{k}_start"] for k in range(int(self.file.attrs["levels"]))]
+        self.bin_sizes = [int(level.attrs["bin_size"]) for level in self.levels]
+        files = self.file["files"][:]
+        self.file_names = [name.decode() if isinstance(name, bytes) else name for name in files["file"]]
+        self.file_starts = files["start"]
+        self.events = self.file["events"][:]
+
+    def choose_level(self, start: int, stop: int, max_bins: int = 2000) -> int:
+        for k in reversed(range(len(self.levels))):
+            if (stop - start)/self.bin_sizes[k] >= max_bins:
+                return k
+        return 0
+
+    def read(self, start: int, stop: int, max_bins: int = 2000) -> tuple[np.ndarray, np.ndarray]:
+        """Global sample positions of the middles of the bins covering [start, stop) and their (min, max, mean) rows."""
+        if len(self.levels) == 0:
+            return np.zeros(0), np.zeros((0, 3))
+        k = self.choose_level(start, stop, max_bins)
+        starts = self.level_starts[k]
+        first = max(_bisect(starts, start) - 1, 0)
+        last = _bisect(starts, stop - 1)
+        if last <= first:
+            return np.zeros(0), np.zeros((0, 3))
+        edges = np.append(starts[first:last], starts[last] if last < len(starts) else self.samples)
+        return (edges[:-1] + edges[1:])/2, self.levels[k][first:last]
+
+    def events_in(self, start: int, stop: int) -> np.ndarray:
+        """Global (start, end) of the events overlapping [start, stop)."""
+        if len(self.events) == 0:
+            return self.events
+        return self.events[(self.events[:, 1] >= start) & (self.events[:, 0] < stop)]
+
+    def file_at(self, sample: int) -> str:
+        index = int(np.searchsorted(self.file_starts, sample, side='right') - 1)
+        return os.path.basename(self.file_names[max(index, 0)]) if len(self.file_names) > 0 else ""
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,129 @@
+import numpy as np
+import pandas as pd
+import h5py as h
+from numpy.lib.stride_tricks import sliding_window_view
+
+RMS_BANDS = [1000, 10000, 100000] #Upper edges /Hz of the bands that RMS noise is reported over, as well as the full bandwidth
+
+class WelchAccumulator():
+    """Welch power spectral density estimate built up one chunk at a time, with Hann windowed segments overlapping by half.
+    Gives the same result as scipy.signal.welch on the whole trace, but only ever holds one chunk plus a partial segment."""
+    def __init__(self, sample_rate: float, nperseg: int):
+        self.sample_rate = sample_rate
+        self.nperseg = nperseg
+        self.step = nperseg//2
+        self.window = np.hanning(nperseg + 1)[:-1]
+        self.scale = 1/(sample_rate*np.sum(self.window**2))
+        self.segments = 0
+        self._sum = np.zeros(nperseg//2 + 1)
+        self._buffer = np.array([])
+
+    def update(self, chunk: np.ndarray):
+        data = np.concatenate((self._buffer, chunk))
+        if len(data) < self.nperseg:
+            self._buffer = data
+            return
+        segs = sliding_window_view(data, self.nperseg)[::self.step]
+        segs = (segs - segs.mean(axis=1, keepdims=True))*self.window
+        self._sum += np.sum(np.abs(np.fft.rfft(segs, axis=1))**2, axis=0)
+        self.segments += len(segs)
+        self._buffer = data[len(segs)*self.step:]
+
+    def psd(self) -> tuple[np.ndarray, np.ndarray]:
+        """Frequencies /Hz and one-sided power spectral density /nA^2/Hz of everything seen so far."""
+        freqs = np.fft.rfftfreq(self.nperseg, 1/self.sample_rate)
+        if self.segments == 0:
+            return freqs, np.full(len(freqs), np.nan)
+        psd = self._sum/self.segments*self.scale
+        psd[1:len(psd) - (self.nperseg % 2 == 0)] *= 2
+        return freqs, psd
+
+def band_rms(freqs: np.ndarray, psd: np.ndarray, f_max: float) -> float:
+    """RMS noise /nA between the lowest non-zero frequency and f_max."""
+    if f_max > freqs[-1]:
+        return np.nan
+    band = (freqs > 0) & (freqs <= f_max)
+    return float(np.sqrt(np.sum(psd[band])*(freqs[1] - freqs[0])))
+
+def one_over_f_corner(freqs: np.ndarray, psd: np.ndarray, white_band: tuple[float, float] = (1000, 10000), flicker_max: float = 100,
+                      exclude: list[float] | None = None, min_t: float = 3.0) -> float:
+    """Frequency /Hz where the 1/f (flicker) noise falls to the white noise floor, or NaN if there is no significant 1/f component.
+    The floor is the median density in white_band, so line noise peaks don't pull it. A power law is fitted, as a straight line in
+    log-log, to the density above the floor in the bins up to flicker_max where it is at least twice the floor, leaving out the bins
+    next to any frequencies in exclude (e.g. line noise), and the corner is where it meets the floor. The 1/f component counts as
+    significant if at least 3 bins are fitted and the slope is min_t standard errors below zero. A corner above the start of
+    white_band is NaN too, as the floor there isn't white noise."""
+    white = psd[(freqs >= white_band[0]) & (freqs <= min(white_band[1], freqs[-1]))]
+    if len(white) == 0:
+        return np.nan
+    floor = np.median(white)
+    flicker = (freqs > 0) & (freqs <= flicker_max) & (psd > 2*floor)
+    if exclude is not None and len(freqs) > 1:
+        for freq in exclude:
+            flicker &= np.abs(freqs - freq) > 2*(freqs[1] - freqs[0])
+    if np.count_nonzero(flicker) < 3:
+        return np.nan
+    log_f = np.log10(freqs[flicker])
+    log_excess = np.log10(psd[flicker] - floor)
+    (slope, intercept), residuals, _, _, _ = np.polyfit(log_f, log_excess, 1, full=True)
+    stderr = np.sqrt(residuals[0]/(len(log_f) - 2)/np.sum((log_f - log_f.mean())**2)) if len(residuals) > 0 else 0.0
+    if slope >= -min_t*stderr or slope >= 0:
+        return np.nan
+    corner = 10**((np.log10(floor) - intercept)/slope)
+    return float(corner) if corner < white_band[0] else np.nan
+
+def line_peak_db(freqs: np.ndarray, psd: np.ndarray, freq: float, gap: int = 2, width: int = 10) -> float:
+    """Height /dB of the spectrum at freq above the median of the bins either side of it, skipping gap bins next to the peak.
+    NaN if the spectrum doesn't reach freq or its bins are too coarse to tell the peak apart from the DC bin."""
+    if freq >= freqs[-1] or freqs[1] - freqs[0] > freq:
+        return np.nan
+    idx = int(np.argmin(np.abs(freqs - freq)))
+    peak = np.max(psd[max(idx - gap, 1):idx + gap + 1])
+    neighbours = np.concatenate((psd[max(idx - gap - width, 1):max(idx - gap, 1)], psd[idx + gap + 1:idx + gap + width + 1]))
+    if len(neighbours) == 0:
+        return np.nan
+    return float(10*np.log10(peak/np.median(neighbours)))
+
+def quality_accumulator(sample_rate: float, n_samples: int, resolution: float = 5.0) -> WelchAccumulator | None:
+    """Welch accumulator for a trace of n_samples, with segments long enough to resolve resolution Hz, or the whole trace if it is
+    shorter. None if the trace is too short for a spectrum."""
+    nperseg = int(min(2**np.ceil(np.log2(sample_rate/resolution)), n_samples))
+    if nperseg < 16:
+        return None
+    return WelchAccumulator(sample_rate, nperseg)
+
+def spectrum_metrics(welch: WelchAccumulator, line_freq: float = 50.0, harmonics: int = 3) -> dict:
+    """RMS noise over each of RMS_BANDS and the full bandwidth, the 1/f corner frequency and the height of the line noise peak and
+    its harmonics, from the spectrum accumulated so far."""
+    freqs, psd = welch.psd()
+    metrics = {"psd_resolution_Hz": freqs[1]}
+    for f_max in RMS_BANDS:
+        metrics[f"rms_{f_max//1000}kHz_nA"] = band_rms(freqs, psd, f_max)
+    metrics["rms_full_nA"] = band_rms(freqs, psd, freqs[-1])
+    metrics["one_over_f_corner_Hz"] = one_over_f_corner(freqs, psd, exclude=[n*line_freq for n in range(1, harmonics + 1)])
+    for n in range(1, harmonics + 1):
+        metrics[f"line_{int(n*line_freq)}Hz_dB"] = line_peak_db(freqs, psd, n*line_freq)
+    return metrics
+
+def trace_quality(data: np.ndarray, sample_rate: float, resolution: float = 5.0, chunk_size: int = 1000000,
+                  line_freq: float = 50.0, harmonics: int = 3) -> dict:
+    """Noise spectrum metrics (see spectrum_metrics) of a baseline corrected trace, computed chunk by chunk."""
+    welch = quality_accumulator(sample_rate, len(data), resolution)
+    if welch is None:
+        return {}
+    for i in range(0, len(data), chunk_size):
+        welch.update(data[i:i + chunk_size])
+    return spectrum_metrics(welch, line_freq, harmonics)
+
+def load_trace_quality(paths: list[str]) -> pd.DataFrame:
+    """Gathers the trace_quality tables of several EVENTS.hdf5 files into one dataframe, for screening pores across a campaign."""
+    tables = []
+    for path in paths:
+        with h.File(path, 'r') as f:
+            if "trace_quality" not in f:
+                continue
+            table = pd.DataFrame(f["trace_quality"][:])
+        table["file"] = table["file"].str.decode("utf-8")
+        table.insert(0, "events_file", path)
+        tables.append(table)
+    return pd.concat(tables, ignore_index=True) if len(tables) > 0 else pd.DataFrame()
@@ -0,0 +1,45 @@
+import json
+import datetime
+import numpy as np
+import pandas as pd
+
+def _to_json_value(val):
+    """Converts numpy scalars to plain Python values and NaN to None so every line is valid JSON."""
+    if isinstance(val, np.generic):
+        val = val.item()
+    if isinstance(val, float) and not np.isfinite(val):
+        return None
+    return val
+
+class RunLog():
+    """Append-only structured log with one JSON line per processed file, recording whether it was accepted or why it was rejected
+    along with any other fields given. Lines are buffered and written in batches to avoid touching the disk for every file."""
+    def __init__(self, path: str, flush_every: int = 50):
+        self.path = path
+        self.flush_every = flush_every
+        self._buffer = []
+        self._file = open(self.path, 'a')
+
+    def record(self, file: str, status: str, reason: str | None = None, **fields):
+        entry = {"time": datetime.datetime.now().isoformat(), "file": file, "status": status, "reason": reason}
+        entry.update(fields)
+        self._buffer.append(json.dumps({key: _to_json_value(val) for key, val in entry.items()}))
+        if len(self._buffer) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        if len(self._buffer) == 0:
+            return
+        self._file.write("\n".join(self._buffer) + "\n")
+        self._file.flush()
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+def load_run_log(path: str) -> pd.DataFrame:
+    """Reads a run log into a dataframe with one row per file, e.g. load_run_log(path).query("status == 'rejected'")."""
+    with open(path) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return pd.DataFrame(rows)
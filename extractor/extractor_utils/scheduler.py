@@ -0,0 +1,62 @@
+import os
+import logging
+import nptdms as nt
+from concurrent.futures import Executor, FIRST_COMPLETED, wait
+
+#Peak bytes held per sample while a file is processed whole, measured on synthetic traces with the Bessel detection filter on.
+#Reading, baseline fitting and detection each make several float64 copies of the trace; the adaptive detectors make the most.
+PEAK_BYTES_PER_SAMPLE = {"threshold": 72, "ksigma": 120, "cusum": 176}
+
+def file_samples(path: str) -> int:
+    """Number of samples in a tdms file from its metadata, or estimated from its size on disk if that can't be read."""
+    try:
+        file = nt.TdmsFile.read_metadata(path)
+        return max(len(chan) for grp in file.groups() for chan in grp.channels())
+    except:
+        return os.stat(path).st_size//8
+
+def plan_files(paths: list[str], detector: str = "threshold", memory_budget: float | None = None, max_share: float = 0.5,
+               chunk_size: int = 10000000, overlap: int = 200000) -> list[dict]:
+    """Works out the memory each file needs. A file needing more than max_share of memory_budget /bytes to process whole is
+    streamed through in chunks of chunk_size samples instead, so that at least 1/max_share files can always run together."""
+    per_sample = PEAK_BYTES_PER_SAMPLE.get(detector, max(PEAK_BYTES_PER_SAMPLE.values()))
+    stream_memory = (chunk_size + 2*overlap)*per_sample
+    plan = []
+    for path in paths:
+        samples = file_samples(path)
+        memory = samples*per_sample
+        streaming = memory_budget is not None and memory > max_share*memory_budget and memory > stream_memory
+        if streaming:
+            logging.info(f"{os.path.basename(path)} needs about {memory/1e9:.1f} GB, streaming it in chunks.")
+        plan.append({"path": path, "samples": samples, "streaming": streaming, "memory": stream_memory if streaming else memory})
+    return plan
+
+def run_in_order(plan: list[dict], func, args: tuple = (), pool: Executor | None = None, workers: int = 1,
+                 memory_budget: float | None = None):
+    """Runs func(path, streaming, *args) for every planned file and yields the results in file order. With a pool, files are
+    started in order whenever a worker is free and the memory of the files running plus the next one fits within memory_budget.
+    A file is always started if nothing else is running, so one that is over budget on its own still runs, just by itself.
+    Without a pool the files are run one after another in this process."""
+    if pool is None:
+        for task in plan:
+            yield func(task["path"], task["streaming"], *args)
+        return
+    running = {}
+    done = {}
+    next_task = 0
+    next_result = 0
+    while next_result < len(plan):
+        while next_task < len(plan) and len(running) < workers:
+            memory = plan[next_task]["memory"]
+            in_use = sum(plan[i]["memory"] for i in running.values())
+            if memory_budget is not None and len(running) > 0 and in_use + memory > memory_budget:
+                break
+            running[pool.submit(func, plan[next_task]["path"], plan[next_task]["streaming"], *args)] = next_task
+            next_task += 1
+        if next_result not in done:
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                done[running.pop(future)] = future.result()
+            continue
+        yield done.pop(next_result)
+        next_result += 1
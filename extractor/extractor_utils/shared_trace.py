@@ -0,0 +1,56 @@
+import numpy as np
+from multiprocessing import shared_memory, resource_tracker
+
+class SharedArrays():
+    """Named numpy arrays backed by multiprocessing shared memory blocks, so large traces can be handed between processes
+    without pickling. The producing process calls share_arrays and sends the small descriptor (block names, shapes and dtypes)
+    to the consumer, which maps the same memory with attach_arrays and calls release once it is done with the arrays."""
+    def __init__(self, blocks: dict[str, shared_memory.SharedMemory], descriptor: dict):
+        self.blocks = blocks
+        self.descriptor = descriptor
+        self.arrays = {name: np.ndarray(tuple(desc["shape"]), dtype=np.dtype(desc["dtype"]), buffer=blocks[name].buf)
+                       for name, desc in descriptor.items()}
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.arrays[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.arrays
+
+    def nbytes(self) -> int:
+        return sum(arr.nbytes for arr in self.arrays.values())
+
+    def release(self, unlink: bool = True):
+        """Drops the arrays and frees the blocks. Blocks are unlinked straight away; if something such as a plot still holds a view
+        into one, its memory is freed when that view goes instead of now."""
+        self.arrays = {}
+        for block in self.blocks.values():
+            if unlink:
+                try:
+                    block.unlink()
+                except FileNotFoundError:
+                    pass
+            try:
+                block.close()
+            except BufferError:
+                pass
+        self.blocks = {}
+
+def share_arrays(arrays: dict[str, np.ndarray]) -> SharedArrays:
+    """Copies arrays into new shared memory blocks. Ownership is handed over to whichever process attaches to the descriptor,
+    so the blocks are not removed when this process exits."""
+    blocks = {}
+    descriptor = {}
+    for name, arr in arrays.items():
+        arr = np.ascontiguousarray(arr)
+        block = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+        resource_tracker.unregister(block._name, "shared_memory")
+        blocks[name] = block
+        descriptor[name] = {"block": block.name, "shape": list(arr.shape), "dtype": arr.dtype.str}
+    return SharedArrays(blocks, descriptor)
+
+def attach_arrays(descriptor: dict) -> SharedArrays:
+    """Maps the arrays described by a descriptor from share_arrays without copying them."""
+    blocks = {name: shared_memory.SharedMemory(name=desc["block"]) for name, desc in descriptor.items()}
+    return SharedArrays(blocks, descriptor)
@@ -0,0 +1,64 @@
+import time
+from contextlib import contextmanager
+
+STAGES = ["read", "prescreen", "baseline", "filter", "detect", "quality", "features", "write"]
+
+class StageTimer():
+    """Accumulates wall time, sample counts and event counts for each extractor stage, separately for every file processed."""
+    def __init__(self):
+        self.records = {}
+        self.current_file = None
+
+    def start_file(self, name: str):
+        """Directs subsequent timings to the given file."""
+        self.current_file = name
+        if name not in self.records:
+            self.records[name] = {stage: [0.0, 0, 0] for stage in STAGES}
+
+    @contextmanager
+    def stage(self, name: str, samples: int = 0, events: int = 0):
+        """Times the body of a with block as part of stage name for the current file."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.current_file is not None:
+                record = self.records[self.current_file][name]
+                record[0] += time.perf_counter() - start
+                record[1] += samples
+                record[2] += events
+
+    def count(self, name: str, samples: int = 0, events: int = 0):
+        """Adds samples and events to stage name for the current file, for counts only known once the stage has run."""
+        if self.current_file is not None:
+            self.records[self.current_file][name][1] += samples
+            self.records[self.current_file][name][2] += events
+
+    def file_row(self, name: str) -> dict:
+        """The time, samples and events of every stage for one file."""
+        row = {"file": name}
+        for stage, (elapsed, samples, events) in self.records[name].items():
+            row[f"{stage}_s"] = elapsed
+            row[f"{stage}_samples"] = samples
+            row[f"{stage}_events"] = events
+        return row
+
+    def file_rows(self) -> list[dict]:
+        """One row per file with the time, samples and events of every stage."""
+        return [self.file_row(name) for name in self.records]
+
+    def totals(self) -> dict[str, tuple[float, int, int]]:
+        """Time, samples and events of every stage summed over all files."""
+        totals = {}
+        for stage in STAGES:
+            totals[stage] = tuple(sum(stages[stage][i] for stages in self.records.values()) for i in range(3))
+        return totals
+
+    def summary(self) -> str:
+        """Human readable per-stage summary for the log."""
+        lines = [f"Timings over {len(self.records)} files:"]
+        for stage, (elapsed, samples, events) in self.totals().items():
+            rate = f", {samples/elapsed/1e6:.2f} MS/s" if elapsed > 0 and samples > 0 else ""
+            event_rate = f", {events/elapsed:.1f} events/s" if elapsed > 0 and events > 0 else ""
+            lines.append(f"{stage}: {elapsed:.3f} s{rate}{event_rate}")
+        return "\n".join(lines)
@@ -18,6 +18,30 @@ def dir_contains_ext(dirpath: str, ext: str) -> bool:
     file_list = glob(os.path.join(dirpath, f'*.{ext}'))
     return len(file_list) > 0
 
-def writeline_in(filepath: str, line: str):
-    with open(filepath,'w') as f:
-        f.write(f"{line}{os.linesep}")
\ No newline at end of file
+def read_cfg(path: str) -> dict[str, str]:
+    """Reads 'name=value' settings from a cfg file, skipping comment lines starting with # and blank lines."""
+    settings = {}
+    with open(path) as f:
+        for line in f:
+            if line[0] == "#":
+                continue
+            no_space = "".join(line.split())
+            if no_space == "":
+                continue
+            split = no_space.split('=')
+            if len(split) != 2:
+                raise ValueError("cfg file should have only one setting per line!")
+            settings[split[0]] = split[1]
+    return settings
+
+def parse_setting(text: str):
+    """Converts a setting from text like the GUI setting fields do: a float if it contains '.', otherwise an int, and text if it isn't a number."""
+    try:
+        return float(text) if "." in text else int(text)
+    except ValueError:
+        return text
+
+def default_settings() -> dict:
+    """The default extractor settings from cfg.txt, parsed to numbers where appropriate."""
+    cfg_path = os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'cfg.txt')
+    return {name: parse_setting(val) for name, val in read_cfg(cfg_path).items()}
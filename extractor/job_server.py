@@ -0,0 +1,212 @@
+"""Local extraction job server. One process on the analysis machine accepts extraction jobs (a directory plus settings) from anyone
+on it and runs them on a bounded pool of worker processes, so several users share the machine fairly instead of each running a GUI.
+Jobs are run headless with every event accepted (see batch.py), writing EVENTS.hdf5, props.pkl and run_log.jsonl as usual.
+
+Start the server with:   python job_server.py serve [--workers N] [--memory-gb M] [--port P]
+Submit a job with:       python job_server.py submit <directory> [name=value ...]
+Check on jobs with:      python job_server.py status [job id]
+
+The protocol is one JSON object per line over a localhost TCP socket, with a request like {"cmd": "submit", "dir": ..., "settings": {...},
+"user": ...} answered by a single JSON line. Malformed requests are answered with {"ok": false, "error": ...}. A directory can only
+have one job pending or running at a time; submitting it again is refused until that job finishes."""
+
+import os
+import sys
+import json
+import time
+import getpass
+import asyncio
+import logging
+import argparse
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_PORT = 8765
+
+def run_job(job_id: int, dir_path: str, settings: dict, progress: dict, memory_budget: float | None = None) -> dict:
+    """Runs one job in a worker process, posting (files done, total files, events saved) to the shared progress dict."""
+    from batch import extract_directory
+    def report(done, total, events):
+        progress[job_id] = {"files_done": done, "files_total": total, "events": events}
+    return extract_directory(dir_path, settings, report, memory_budget=memory_budget)
+
+#Fields each command needs and the JSON types they must have
+REQUEST_FIELDS = {"submit": {"dir": str}, "status": {"id": int}, "list": {}, "cancel": {"id": int}}
+OPTIONAL_FIELDS = {"settings": dict, "user": str}
+JSON_TYPE_NAMES = {str: "a string", int: "an integer", dict: "an object"}
+
+def check_request(request) -> None:
+    """Raises ValueError describing what is wrong with a request that isn't a JSON object with a known command and the fields it needs."""
+    if not isinstance(request, dict):
+        raise ValueError(f"Request should be a JSON object, not {type(request).__name__}")
+    cmd = request.get("cmd")
+    if cmd not in REQUEST_FIELDS:
+        raise ValueError(f"Unknown command {cmd}, should be one of {list(REQUEST_FIELDS)}")
+    for name in REQUEST_FIELDS[cmd]:
+        if name not in request:
+            raise ValueError(f"'{cmd}' request is missing '{name}'")
+    for name, field_type in {**OPTIONAL_FIELDS, **REQUEST_FIELDS[cmd]}.items():
+        #bool is a subclass of int, but true/false are never valid job ids
+        if name in request and (not isinstance(request[name], field_type) or isinstance(request[name], bool)):
+            raise ValueError(f"'{name}' should be {JSON_TYPE_NAMES[field_type]}, got {json.dumps(request[name])}")
+
+class JobServer():
+    """Queues submitted jobs and runs at most `workers` at a time. When a worker is free the next job is taken from the user with the
+    fewest jobs running, oldest first, so one user queueing many directories cannot hold up everyone else. memory_budget /bytes is
+    shared equally between the workers, and files too big for a worker's share are streamed through in chunks."""
+    def __init__(self, workers: int | None = None, host: str = "127.0.0.1", port: int = DEFAULT_PORT, memory_budget: float | None = None):
+        self.workers = workers if workers is not None else max(os.cpu_count() - 1, 1)
+        self.memory_budget = memory_budget
+        self.host = host
+        self.port = port
+        self.jobs = {}
+        self.pending = []
+        self.running = {}
+        self._ids = itertools.count(1)
+        self._manager = multiprocessing.Manager()
+        self.progress = self._manager.dict()
+        self.pool = ProcessPoolExecutor(max_workers=self.workers)
+
+    def submit(self, dir_path: str, settings: dict, user: str) -> int:
+        dir_path = os.path.abspath(dir_path)
+        if not os.path.isdir(dir_path):
+            raise ValueError(f"{dir_path} is not a directory")
+        for job_id in self.pending + list(self.running):
+            if self.jobs[job_id]["dir"] == dir_path:
+                raise ValueError(f"{dir_path} is already being extracted by job {job_id} ({self.jobs[job_id]['status']})")
+        job_id = next(self._ids)
+        self.jobs[job_id] = {"id": job_id, "dir": dir_path, "settings": settings, "user": user, "status": "pending",
+                             "submitted": time.time(), "started": None, "finished": None, "result": None, "error": None}
+        self.pending.append(job_id)
+        self._schedule()
+        return job_id
+
+    def cancel(self, job_id: int) -> bool:
+        """Cancels a job that has not started yet. Running jobs are left to finish so their output files are complete."""
+        if job_id not in self.pending:
+            return False
+        self.pending.remove(job_id)
+        self.jobs[job_id]["status"] = "cancelled"
+        return True
+
+    def status(self, job_id: int) -> dict:
+        if job_id not in self.jobs:
+            raise ValueError(f"No job with id {job_id}")
+        job = dict(self.jobs[job_id])
+        job["progress"] = self.progress.get(job_id)
+        if job["status"] == "pending":
+            job["queue_position"] = self.pending.index(job_id) + 1
+        return job
+
+    def _next_job(self) -> int:
+        running_per_user = {}
+        for job_id in self.running:
+            user = self.jobs[job_id]["user"]
+            running_per_user[user] = running_per_user.get(user, 0) + 1
+        return min(self.pending, key=lambda job_id: running_per_user.get(self.jobs[job_id]["user"], 0))
+
+    def _schedule(self):
+        loop = asyncio.get_running_loop()
+        while len(self.pending) > 0 and len(self.running) < self.workers:
+            job_id = self._next_job()
+            self.pending.remove(job_id)
+            job = self.jobs[job_id]
+            job["status"] = "running"
+            job["started"] = time.time()
+            logging.info(f"Starting job {job_id} for {job['user']} on {job['dir']}")
+            job_budget = None if self.memory_budget is None else self.memory_budget/self.workers
+            future = loop.run_in_executor(self.pool, run_job, job_id, job["dir"], job["settings"], self.progress, job_budget)
+            self.running[job_id] = future
+            future.add_done_callback(lambda fut, job_id=job_id: self._finished(job_id, fut))
+
+    def _finished(self, job_id: int, future: asyncio.Future):
+        job = self.jobs[job_id]
+        del self.running[job_id]
+        job["finished"] = time.time()
+        if future.exception() is not None:
+            job["status"] = "failed"
+            job["error"] = repr(future.exception())
+            logging.error(f"Job {job_id} failed: {job['error']}")
+        else:
+            job["status"] = "done"
+            job["result"] = future.result()
+            logging.info(f"Job {job_id} done: {job['result']}")
+        self._schedule()
+
+    def handle_request(self, request: dict) -> dict:
+        check_request(request)
+        cmd = request["cmd"]
+        if cmd == "submit":
+            job_id = self.submit(request["dir"], request.get("settings", {}), request.get("user", "unknown"))
+            return {"ok": True, "id": job_id}
+        if cmd == "status":
+            return {"ok": True, "job": self.status(request["id"])}
+        if cmd == "list":
+            return {"ok": True, "jobs": [self.status(job_id) for job_id in self.jobs]}
+        if cmd == "cancel":
+            return {"ok": self.cancel(request["id"])}
+
+    async def _client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while line := await reader.readline():
+                try:
+                    response = self.handle_request(json.loads(line))
+                except (ValueError, KeyError) as e:
+                    response = {"ok": False, "error": str(e)}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self._client, self.host, self.port)
+        logging.info(f"Serving extraction jobs on {self.host}:{self.port} with {self.workers} workers")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.pool.shutdown(cancel_futures=True)
+            self._manager.shutdown()
+
+def send_request(request: dict, host: str = "127.0.0.1", port: int = DEFAULT_PORT) -> dict:
+    """Sends one request to a running server and returns its response."""
+    async def exchange():
+        reader, writer = await asyncio.open_connection(host, port)
+        writer.write((json.dumps(request) + "\n").encode())
+        await writer.drain()
+        response = json.loads(await reader.readline())
+        writer.close()
+        await writer.wait_closed()
+        return response
+    return asyncio.run(exchange())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local extraction job server.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    subparsers = parser.add_subparsers(dest="cmd", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Run the server")
+    serve_parser.add_argument("--workers", type=int, default=None, help="Jobs run at once, defaults to one less than the number of CPUs")
+    serve_parser.add_argument("--memory-gb", type=float, default=None, help="RAM the jobs may use between them /GB")
+    submit_parser = subparsers.add_parser("submit", help="Queue a directory for extraction")
+    submit_parser.add_argument("dir")
+    submit_parser.add_argument("settings", nargs="*", help="Settings overriding cfg.txt as name=value")
+    status_parser = subparsers.add_parser("status", help="Show one job, or all jobs")
+    status_parser.add_argument("id", nargs="?", type=int)
+    cancel_parser = subparsers.add_parser("cancel", help="Cancel a job that has not started")
+    cancel_parser.add_argument("id", type=int)
+    args = parser.parse_args()
+
+    if args.cmd == "serve":
+        logging.basicConfig(level=logging.INFO)
+        asyncio.run(JobServer(args.workers, port=args.port, memory_budget=None if args.memory_gb is None else args.memory_gb*1e9).serve())
+        sys.exit()
+    if args.cmd == "submit":
+        from extractor_utils.util_funcs import parse_setting
+        settings = {name: parse_setting(val) for name, val in (arg.split("=") for arg in args.settings)}
+        request = {"cmd": "submit", "dir": os.path.abspath(args.dir), "settings": settings, "user": getpass.getuser()}
+    elif args.cmd == "status" and args.id is None:
+        request = {"cmd": "list"}
+    else:
+        request = {"cmd": args.cmd, "id": args.id}
+    print(json.dumps(send_request(request, port=args.port), indent=2))
@@ -9,8 +9,20 @@ import logging
 from itertools import compress
 import platform
 import time
+from collections import OrderedDict
+from concurrent.futures import Executor
 from scipy.ndimage import gaussian_filter1d
 from extractor_utils.adv_baseline_fixing import find_most_persistent_value
+from extractor_utils.filtering import StreamingFilter, filter_in_chunks
+from extractor_utils.detectors import DETECTORS, threshold_boundaries, ksigma_boundaries, cusum_boundaries, prescreen_trace
+from extractor_utils.timing import StageTimer
+from extractor_utils.shared_trace import share_arrays, attach_arrays
+from extractor_utils.quality import trace_quality, quality_accumulator, spectrum_metrics
+from extractor_utils.overview import OverviewWriter, summarise_samples
+from extractor_utils.features import crop_event, event_features, batch_features
+
+#Reason recorded for files skipped by the prescreen, so they can be counted separately from files found empty after a full fit
+PRESCREEN_REASON = "no events (prescreen)"
 
 class BadIndex(Exception):
     def __init__(self, *args):
@@ -113,10 +125,19 @@ def get_persistent_homology(seq):
     # This is optional convenience
     return sorted(peaks, key=lambda p: p.get_height(seq), reverse=True)
 
+def find_data_channel(file: nt.TdmsFile) -> nt.TdmsChannel:
+    """Returns the first non-empty channel in the first group of a TDMS file, which is where the samples are stored."""
+    grp = file.groups()[0]
+    for chan in grp.channels():
+        if len(chan) > 0:
+            return chan
+    raise Exception("Couldn't find data channel.")
+
 class TdmsDir():
     """ Class handling the reading of TDMS files in a directory, so that they can all be accessed with one object."""
-    def __init__(self, root_directory: str):
-        self.file_list = sorted(glob(os.path.join(root_directory, '*.tdms')))
+    def __init__(self, root_directory: str, file_list: list[str] | None = None):
+        """Uses every tdms file in root_directory, or only the given file_list if provided."""
+        self.file_list = sorted(glob(os.path.join(root_directory, '*.tdms'))) if file_list is None else list(file_list)
         self.current_file = None
 
     def load_file_data(self, index: int | None = None):
@@ -131,16 +152,7 @@ class TdmsDir():
             raise BadIndex(f"Index {index} is invalid for TdmsDir of length {len(self.file_list)}")
         else:
             file = nt.TdmsFile.read(self.file_list[index])
-        grp = file.groups()[0]
-        found = False
-        for chan in grp.channels():
-            if len(chan) > 0:
-                dchan = chan
-                found = True
-                break
-        if not found:
-            raise Exception("Couldn't find data channel.")
-        data = dchan[:]
+        data = find_data_channel(file)[:]
         return data
 
     def goto_file(self,index: int):
@@ -172,20 +184,186 @@ class TdmsDir():
     def __len__(self):
         return len(self.file_list)
 
+class VirtualTrace():
+    """Presents the files of a TdmsDir as one continuous sample stream addressed by global sample offsets. Only the file metadata
+    is read up front; samples are streamed from the files overlapping a requested range, so the whole directory never has to be held in memory."""
+    def __init__(self, tdms: TdmsDir, max_open: int = 2):
+        self.tdms = tdms
+        self.max_open = max_open
+        self._open_files = OrderedDict()
+        lengths = []
+        for path in self.tdms.file_list:
+            try:
+                lengths.append(len(find_data_channel(nt.TdmsFile.read_metadata(path))))
+            except:
+                logging.info(f"Problem reading metadata of '{path}', treating it as empty.")
+                lengths.append(0)
+        self.file_lengths = np.array(lengths, dtype=np.int64)
+        self.file_offsets = np.concatenate(([0], np.cumsum(self.file_lengths)))
+
+    def locate(self, index: int) -> tuple[int, int]:
+        """Converts a global sample index into a (file index, sample index within file) pair."""
+        if index < 0 or index >= len(self):
+            raise BadIndex(f"Sample {index} is invalid for VirtualTrace of length {len(self)}")
+        file_index = int(np.searchsorted(self.file_offsets, index, side='right') - 1)
+        return file_index, int(index - self.file_offsets[file_index])
+
+    def file_spans(self, start: int, stop: int) -> list[tuple[int, int, int]]:
+        """Gets (file index, local start, local stop) for every file overlapping the global range [start, stop)."""
+        start = max(start, 0)
+        stop = min(stop, len(self))
+        spans = []
+        if start >= stop:
+            return spans
+        first = int(np.searchsorted(self.file_offsets, start, side='right') - 1)
+        last = int(np.searchsorted(self.file_offsets, stop - 1, side='right') - 1)
+        for file_index in range(first, last + 1):
+            offset = self.file_offsets[file_index]
+            local_start = int(max(start - offset, 0))
+            local_stop = int(min(stop - offset, self.file_lengths[file_index]))
+            if local_stop > local_start:
+                spans.append((file_index, local_start, local_stop))
+        return spans
+
+    def _channel(self, file_index: int) -> nt.TdmsChannel:
+        """Gets the data channel of a file opened in streaming mode, keeping the last few files open for sequential reads."""
+        if file_index in self._open_files:
+            self._open_files.move_to_end(file_index)
+            return self._open_files[file_index][1]
+        file = nt.TdmsFile.open(self.tdms.file_list[file_index])
+        self._open_files[file_index] = (file, find_data_channel(file))
+        while len(self._open_files) > self.max_open:
+            _, (old_file, _) = self._open_files.popitem(last=False)
+            old_file.close()
+        return self._open_files[file_index][1]
+
+    def read(self, start: int, stop: int) -> np.ndarray:
+        """Reads the samples in the global range [start, stop), which may cross any number of file boundaries."""
+        pieces = [self._channel(file_index).read_data(local_start, local_stop - local_start) for file_index, local_start, local_stop in self.file_spans(start, stop)]
+        if len(pieces) == 0:
+            return np.array([])
+        return np.concatenate(pieces)
+
+    def close(self):
+        while len(self._open_files) > 0:
+            _, (file, _) = self._open_files.popitem()
+            file.close()
+
+    def __getitem__(self, subscript: int | slice):
+        if isinstance(subscript, slice):
+            start, stop, step = subscript.indices(len(self))
+            if step < 0:
+                raise ValueError("VirtualTrace can only be sliced forwards")
+            return self.read(start, stop)[::step]
+        file_index, index = self.locate(subscript if subscript >= 0 else len(self) + subscript)
+        return self._channel(file_index).read_data(index, 1)[0]
+
+    def __len__(self):
+        return int(self.file_offsets[-1])
+
+def prepare_file(path: str, settings: dict) -> dict:
+    """Reads, baseline corrects and finds the events of one tdms file, for running in a worker process. The traces and event boundaries
+    are returned as a shared memory descriptor (see Model.load_prepared_file) rather than pickled with the result."""
+    model = Model()
+    model.tdms = TdmsDir(os.path.dirname(path), [path])
+    try:
+        model.next_file()
+    except ReachedEnd:
+        return {"file": path, "readable": False}
+    reason = model.process_current_file(settings)
+    arrays = {"current_data": model.current_data}
+    if model.corrected_data is not None:
+        arrays["corrected_data"] = model.corrected_data
+    if model.event_boundaries is not None:
+        arrays["event_boundaries"] = np.array(model.event_boundaries, dtype=np.int64).reshape(-1, 2)
+    if model.filtered_data is not None:
+        arrays["filtered_data"] = model.filtered_data
+    shared = share_arrays(arrays)
+    shared.release(unlink=False)
+    return {"file": path, "readable": True, "reason": reason, "bsln": model.bsln, "noise": model.noise, "quality": model.quality,
+            "timings": model.timer.records[path], "arrays": shared.descriptor}
+
+def extract_file(path: str, streaming: bool, settings: dict, chunk_size: int = 10000000, overview_base: int = 256) -> dict:
+    """Extracts every event of one tdms file, for running in a worker process. Returns the attributes and data of the events
+    along with everything else the main process records for the file: its run log fields, quality metrics, overview bins and
+    timings. With streaming the file is read a chunk at a time (see Model.stream_events) instead of all at once."""
+    model = Model()
+    model.tdms = TdmsDir(os.path.dirname(path), [path])
+    berth = int(settings["event_berth"])
+    events = []
+    if streaming:
+        model.tdms.next_file()
+        model.timer.start_file(path)
+        try:
+            reason, events, boundaries, bins, samples = model.stream_events(settings, chunk_size, overview_base)
+        except FileError:
+            return {"file": path, "readable": False}
+    else:
+        try:
+            model.next_file()
+        except ReachedEnd:
+            return {"file": path, "readable": False}
+        reason = model.process_current_file(settings)
+        if reason is None:
+            events = model.gen_file_events(berth, float(settings["sample_rate"]))
+        boundaries = model.event_boundaries
+        bins = summarise_samples(model.current_data, overview_base)
+        samples = len(model.current_data)
+    return model.extraction_result(reason, events, boundaries, bins, samples)
+
+def extract_run(dir_path: str, settings: dict, chunk_size: int = 10000000, overview_base: int = 256):
+    """Extracts every event of a directory of tdms files as one continuous recording, so that events straddling the end of one file
+    and the start of the next are found whole. The files are streamed through in chunks over a VirtualTrace of the whole directory
+    (see Model.stream_events), each read with samples from its neighbours either side, and an event belongs to the file it starts in.
+    Yields a result like extract_file's for each file in order."""
+    model = Model()
+    model.open_tdms_dir(dir_path)
+    trace = VirtualTrace(model.tdms)
+    try:
+        for file_index, path in enumerate(model.tdms.file_list):
+            model.tdms.set_file_index(file_index)
+            model.timer.start_file(path)
+            try:
+                reason, events, boundaries, bins, samples = model.stream_events(settings, chunk_size, overview_base, trace=trace)
+            except FileError:
+                yield {"file": path, "readable": False}
+                continue
+            yield model.extraction_result(reason, events, boundaries, bins, samples)
+    finally:
+        trace.close()
+
 class Model():
     def __init__(self):
         self.tdms = None
         self.current_data = None
         self.corrected_data = None
+        self.filtered_data = None
         self.event_boundaries = None
         self.current_event_index = None
         self.event_data = None
         self.output_dt = None
         self.output_df = None
+        self.timer = StageTimer()
+        self.shared = None
+        self._prepared = {}
+        self.quality = None
+        self.quality_rows = []
+        self.overview = None
 
     def open_tdms_dir(self, fpath):
         self.tdms = TdmsDir(fpath)
 
+    def open_overview(self, path: str, sample_rate: float):
+        """Starts an overview store that every file is added to (see add_file_to_overview), for the whole-run timeline viewer."""
+        self.overview = OverviewWriter(path, sample_rate)
+
+    def add_file_to_overview(self):
+        """Appends the raw trace and events of the current file to the overview store, if there is one."""
+        if self.overview is None:
+            return
+        with self.timer.stage("write", samples=len(self.current_data)):
+            self.overview.append_file(self.tdms.get_file_name(), self.current_data, self.event_boundaries)
+
     def check_path_existence(self,path: str):
         return os.path.exists(path)
 
@@ -206,12 +384,64 @@ class Model():
             self.output[grp].attrs[key] = value
 
     def create_dataset(self, grp: str, name: str,  data: np.ndarray, attrs: dict | None = None):
-        self.output[grp].create_dataset(name, data=data, track_order=True)
+        with self.timer.stage("write", samples=len(data), events=1):
+            self.output[grp].create_dataset(name, data=data, track_order=True)
+            if attrs is None:
+                pass
+            else:
+                for key, value in attrs.items():
+                    self.output[grp][name].attrs[key] = value
+
+    def write_table(self, name: str, rows: list[dict], attrs: dict | None = None):
+        """Writes rows of equal keys as a compound dataset at the root of the output file, replacing any existing one."""
+        if len(rows) == 0:
+            return
+        table = pd.DataFrame(rows)
+        dtypes = [(col, h.string_dtype() if table[col].dtype == object else table[col].dtype) for col in table.columns]
+        data = np.array(list(table.itertuples(index=False, name=None)), dtype=dtypes)
+        if name in self.output:
+            del self.output[name]
+        self.output.create_dataset(name, data=data)
         if attrs is None:
-            pass
-        else:
-            for key, value in attrs.items():
-                self.output[grp][name].attrs[key] = value
+            return
+        for key, value in attrs.items():
+            self.output[name].attrs[key] = value
+
+    def save_event(self, name: str, berth: int, sample_rate: float):
+        """Writes the current event to the output file and adds its attributes to the output dataframe."""
+        self.write_event(name, self.gen_event_attrs(name, berth, sample_rate), self.event_data)
+
+    def write_event(self, name: str, attrs: dict, data: np.ndarray):
+        """Writes an event extracted elsewhere (see extract_file) under name."""
+        attrs["name"] = name
+        self.create_dataset('current_data', name, data)
+        self.add_to_df(attrs)
+
+    def add_extracted_file(self, result: dict, first_event: int) -> int:
+        """Records a file extracted by extract_file: writes its events, numbered from first_event, and adds it to the quality table,
+        overview and timings. Returns the number of events written."""
+        self.timer.records[result["file"]] = result["timings"]
+        self.timer.current_file = result["file"]
+        for n, (attrs, data) in enumerate(result["events"]):
+            self.write_event(f"Event_No_{first_event + n}", attrs, data)
+        self.quality = result["quality"]
+        self.quality_rows.append({"file": result["file"], **self.quality})
+        if self.overview is not None:
+            with self.timer.stage("write", samples=result["samples"]):
+                self.overview.append_summary(result["file"], result["samples"], result["overview_bins"], result["event_boundaries"])
+        return len(result["events"])
+
+    def save_outputs(self, dir_path: str):
+        """Writes the stage timings, quality table and props.pkl, then closes the output file and overview store."""
+        self.write_table("extraction_timings", self.timer.file_rows(), attrs = {"machine": platform.node(), "processor": platform.processor(), "platform": platform.platform()})
+        self.write_table("trace_quality", self.quality_rows)
+        if self.output_df is not None:
+            self.output_df.to_pickle(os.path.join(dir_path, "props.pkl"))
+        self.output.close()
+        if self.overview is not None:
+            self.overview.close()
+            self.overview = None
+        self.close_shared()
 
     def add_to_df(self, attrs: dict):
         new_row = pd.DataFrame([pd.Series(attrs, index = list(attrs.keys()))])
@@ -222,15 +452,245 @@ class Model():
         logging.debug("New row successfully added to dataframe.")
         
     def next_file(self):
+        self.release_shared()
         while True:
             self.tdms.next_file()
+            self.timer.start_file(self.tdms.get_file_name())
             try:
-                self.current_data = self.tdms.load_file_data()
+                with self.timer.stage("read"):
+                    self.current_data = self.tdms.load_file_data()
+                self.timer.count("read", samples=len(self.current_data))
                 break
             except FileError:
                 continue
         self.bsln = None
         self.noise = None
+        self.filtered_data = None
+
+    def next_prepared_file(self, pool: Executor, settings: dict) -> str | None:
+        """Does the same as next_file followed by process_current_file, but the work is done by prepare_file in a worker from pool.
+        The file after is submitted at the same time, so that it is usually ready by the time it is needed."""
+        self.release_shared()
+        while True:
+            self.tdms.next_file()
+            path = self.tdms.get_file_name()
+            future = self._prepared.pop(path, None)
+            if future is None:
+                future = pool.submit(prepare_file, path, settings)
+            next_index = self.tdms.current_file + 1
+            if next_index < len(self.tdms) and self.tdms.file_list[next_index] not in self._prepared:
+                self._prepared[self.tdms.file_list[next_index]] = pool.submit(prepare_file, self.tdms.file_list[next_index], settings)
+            prepared = future.result()
+            if not prepared["readable"]:
+                logging.info(f"Problem reading file '{path}', skipping.")
+                continue
+            self.load_prepared_file(prepared)
+            return prepared["reason"]
+
+    def load_prepared_file(self, prepared: dict):
+        """Makes a file processed by prepare_file the current one, mapping its arrays from shared memory without copying them.
+        The blocks stay in use until the next file is loaded."""
+        self.release_shared()
+        self.shared = attach_arrays(prepared["arrays"])
+        self.current_data = self.shared["current_data"]
+        self.corrected_data = self.shared["corrected_data"] if "corrected_data" in self.shared else None
+        self.filtered_data = self.shared["filtered_data"] if "filtered_data" in self.shared else None
+        self.event_boundaries = self.shared["event_boundaries"] if "event_boundaries" in self.shared else None
+        self.current_event_index = None
+        self.bsln = prepared["bsln"]
+        self.noise = prepared["noise"]
+        self.quality = prepared["quality"]
+        self.quality_rows.append({"file": prepared["file"], **self.quality})
+        self.timer.records[prepared["file"]] = prepared["timings"]
+        self.timer.current_file = prepared["file"]
+
+    def release_shared(self):
+        """Drops the arrays of the current file if they are held in shared memory, freeing the blocks."""
+        if self.shared is None:
+            return
+        self.current_data = self.corrected_data = self.filtered_data = self.event_boundaries = self.event_data = None
+        self.shared.release()
+        self.shared = None
+
+    def close_shared(self):
+        """Releases the current file and any files prepared ahead of time, so no shared memory is left behind."""
+        self.release_shared()
+        for future in self._prepared.values():
+            if future.cancel():
+                continue
+            prepared = future.result()
+            if prepared["readable"]:
+                attach_arrays(prepared["arrays"]).release()
+        self._prepared = {}
+
+    def process_current_file(self, settings: dict) -> str | None:
+        """Corrects the baseline of the current file and finds its events using the extractor settings. Returns the reason the
+        file should be skipped, or None if it has events to look at."""
+        self.event_boundaries = None
+        screen = self.prescreen(settings)
+        if screen is not None:
+            logging.debug(f"Prescreen found no events in file {self.tdms.get_file_name()}, moving on...")
+            self.bsln, self.noise = screen["baseline"], screen["noise"]
+            self.event_boundaries = []
+            slope, intercept = screen["line"]
+            self.measure_quality(self.current_data - (slope*np.arange(len(self.current_data)) + intercept), float(settings["sample_rate"]),
+                                 line_freq=float(settings["line_freq"]))
+            return PRESCREEN_REASON
+        logging.debug("Correcting trace slope")
+        try:
+            self.slope_fix_average_run_method(self.current_data)
+        except:
+            logging.info(f"Slope correction and therefore extraction failed on file {self.tdms.get_file_name()}. Skipping.")
+            self.measure_quality(self.current_data - np.mean(self.current_data), float(settings["sample_rate"]), line_freq=float(settings["line_freq"]))
+            return "baseline fit failed"
+        self.filter_corrected_data(settings["filter_type"], float(settings["filter_cutoff"]), float(settings["sample_rate"]))
+        self.update_event_boundaries(float(settings['event_thresh']), int(settings["gap_tol"]), settings["detector"],
+                                     int(settings["detector_window"]), float(settings["detector_k"]))
+        self.measure_quality(self.corrected_data, float(settings["sample_rate"]), self.event_boundaries, float(settings["line_freq"]))
+        if len(self.event_boundaries) == 0:
+            logging.debug(f"No events in file {self.tdms.get_file_name()}, moving on...")
+            return "no events found"
+        return None
+
+    def prescreen(self, settings: dict) -> dict | None:
+        """Checks whether the current data is clear of events without fitting its baseline (see prescreen_trace), if the settings
+        ask for it: only the threshold detector can be prescreened, and a prescreen_margin of 0 turns it off. Returns the prescreen
+        result if the data can be skipped, otherwise None."""
+        margin = float(settings.get("prescreen_margin", 0))
+        if settings["detector"] != "threshold" or margin <= 0:
+            return None
+        with self.timer.stage("prescreen", samples=len(self.current_data)):
+            screen = prescreen_trace(self.current_data, float(settings["event_thresh"]), margin)
+        return screen if screen["clear"] else None
+
+    def stream_events(self, settings: dict, chunk_size: int, overview_base: int = 256, overlap: int = 200000,
+                      trace: VirtualTrace | None = None, max_overrun: int | None = None) -> tuple:
+        """Finds and cuts out every event of the current file a chunk at a time, for files too big to process whole. Each chunk is
+        read with overlap samples either side so that events crossing its edges are whole, and an event is kept only by the chunk
+        it starts in. If one of its events is still going at the end of what was read, the chunk is read again with twice as many
+        samples after it, up to max_overrun (chunk_size by default) samples past its end; events running on further than that
+        are dropped and logged. Each chunk gets its own baseline fit, unless the prescreen shows it has no events; the baseline and
+        noise for the file are averages over the chunks. Given a VirtualTrace over more files than the current one, the chunks at
+        either end of the file are read with samples from the files next to it, so events crossing into the next file are found whole.
+        Returns the reason to skip the file (or None), the events' (attrs, data), their boundaries, the overview bins and the file length."""
+        berth = int(settings["event_berth"])
+        sample_rate = float(settings["sample_rate"])
+        chunk_size = max(chunk_size//overview_base, 1)*overview_base
+        overlap = max(overlap, 2*berth)
+        max_overrun = max(chunk_size if max_overrun is None else max_overrun, overlap)
+        own_trace = trace is None
+        if own_trace:
+            trace = VirtualTrace(self.tdms, max_open=1)
+        file_start = int(trace.file_offsets[self.tdms.current_file])
+        file_stop = int(trace.file_offsets[self.tdms.current_file + 1])
+        if file_stop == file_start:
+            raise FileError(f"Could not load file '{self.tdms.get_file_name()}'")
+        welch = quality_accumulator(sample_rate, file_stop - file_start)
+        events, boundaries, bins, bslns, noises = [], [], [], [], []
+        found = 0
+        screened = 0
+        for own_start in range(file_start, file_stop, chunk_size):
+            own_stop = min(own_start + chunk_size, file_stop)
+            read_start = max(own_start - overlap, 0)
+            read_stop = min(own_stop + overlap, len(trace))
+            lo, hi = own_start - read_start, own_stop - read_start
+            fitted = False
+            while True:
+                with self.timer.stage("read"):
+                    self.current_data = trace.read(read_start, read_stop)
+                screen = self.prescreen(settings)
+                if screen is not None:
+                    break
+                try:
+                    self.slope_fix_average_run_method(self.current_data)
+                except:
+                    fitted = False
+                    break
+                fitted = True
+                self.filter_corrected_data(settings["filter_type"], float(settings["filter_cutoff"]), sample_rate)
+                self.update_event_boundaries(float(settings['event_thresh']), int(settings["gap_tol"]), settings["detector"],
+                                             int(settings["detector_window"]), float(settings["detector_k"]))
+                still_open = any(lo <= left < hi and right + berth > len(self.current_data) for left, right in self.event_boundaries)
+                if not still_open or read_stop == len(trace) or read_stop - own_stop >= max_overrun:
+                    break
+                read_stop = min(own_stop + min(2*(read_stop - own_stop), max_overrun), len(trace))
+            self.timer.count("read", samples=own_stop - own_start)
+            bins.append(summarise_samples(self.current_data[lo:hi], overview_base, own_start - file_start))
+            if screen is not None:
+                screened += 1
+                bslns.append(screen["baseline"])
+                noises.append(screen["noise"])
+                if welch is not None:
+                    with self.timer.stage("quality", samples=hi - lo):
+                        slope, intercept = screen["line"]
+                        welch.update(self.current_data[lo:hi] - (slope*np.arange(lo, hi) + intercept))
+                continue
+            if not fitted:
+                logging.info(f"Slope correction failed on samples {own_start - file_start} to {own_stop - file_start} of {self.tdms.get_file_name()}, skipping them.")
+                continue
+            bslns.append(self.bsln)
+            noises.append(self.noise)
+            own_events = [(left, right) for left, right in self.event_boundaries if lo <= left < hi and left >= berth]
+            cut_off = [(left, right) for left, right in own_events if right + berth > len(self.current_data)]
+            if len(cut_off) > 0:
+                logging.warning(f"Dropped {len(cut_off)} events starting in samples {own_start - file_start} to {own_stop - file_start} of "
+                                f"{self.tdms.get_file_name()} as they were still going {read_stop - own_stop} samples past the chunk, "
+                                f"where reading stopped.")
+                own_events = [event for event in own_events if event not in cut_off]
+            found += len(own_events)
+            if welch is not None:
+                with self.timer.stage("quality", samples=hi - lo):
+                    baseline = self.corrected_data[lo:hi].copy()
+                    for left, right in self.event_boundaries:
+                        baseline[max(left - lo, 0):max(right + 1 - lo, 0)] = 0
+                    welch.update(baseline)
+            self.event_boundaries = own_events
+            events += self.gen_file_events(berth, sample_rate)
+            boundaries += [(left + read_start - file_start, right + read_start - file_start) for left, right in own_events]
+        if own_trace:
+            trace.close()
+        samples = file_stop - file_start
+        self.current_data = self.corrected_data = self.filtered_data = None
+        self.event_boundaries = boundaries
+        self.quality = spectrum_metrics(welch, float(settings["line_freq"])) if welch is not None else {}
+        self.quality_rows.append({"file": self.tdms.get_file_name(), **self.quality})
+        if len(bslns) == 0:
+            self.bsln = self.noise = None
+            return "baseline fit failed", events, boundaries, np.vstack(bins), samples
+        self.bsln = float(np.mean(bslns))
+        self.noise = float(np.mean(noises))
+        if found == 0:
+            reason = PRESCREEN_REASON if screened == len(bslns) else "no events found"
+            return reason, events, boundaries, np.vstack(bins), samples
+        return None, events, boundaries, np.vstack(bins), samples
+
+    def extraction_result(self, reason: str | None, events: list, boundaries, bins: np.ndarray, samples: int) -> dict:
+        """Everything the main process records for the current file once its events are extracted (see add_extracted_file)."""
+        path = self.tdms.get_file_name()
+        return {"file": path, "readable": True, "reason": reason, "events": events, "event_boundaries": boundaries, "samples": samples,
+                "overview_bins": bins, "quality": self.quality, "log_fields": self.file_log_fields(len(events), 0),
+                "timings": self.timer.records[path]}
+
+    def measure_quality(self, data: np.ndarray, sample_rate: float, boundaries: list | None = None, line_freq: float = 50.0):
+        """Works out noise spectrum metrics for the current file (see trace_quality) and adds them to the trace_quality table.
+        Any event regions given are set to the baseline first, so events don't count as noise. line_freq /Hz is the mains frequency."""
+        with self.timer.stage("quality", samples=len(data)):
+            if boundaries is not None and len(boundaries) > 0:
+                data = data.copy()
+                for left, right in boundaries:
+                    data[left:right + 1] = 0
+            self.quality = trace_quality(data, sample_rate, line_freq=line_freq)
+        self.quality_rows.append({"file": self.tdms.get_file_name(), **self.quality})
+
+    def file_log_fields(self, accepted: int, rejected: int) -> dict:
+        """Baseline, noise, event counts and stage timings of the current file for its run log entry."""
+        file_name = self.tdms.get_file_name()
+        fields = {"baseline_nA": self.bsln, "noise_nA": self.noise}
+        if self.event_boundaries is not None:
+            fields.update({"events_found": len(self.event_boundaries), "events_accepted": accepted, "events_rejected": rejected})
+        if file_name in self.timer.records:
+            fields.update({key: val for key, val in self.timer.file_row(file_name).items() if key.endswith("_s")})
+        return fields
 
     def slope_fix_hist_method(self, data):
         def line(x, a, b):
@@ -257,40 +717,54 @@ class Model():
         def line(x, a, b):
             return a*x + b
         dt = self.current_data
-        dt_x = np.arange(len(dt))
-        lims, persistence, peaks, mids, spacing = find_most_persistent_value(dt,area_thresh=0,n_bins=100)
-        bsln_range = lims[np.argmax(persistence)]
-        bsln_peak = peaks[np.argmax(persistence)]
-        peak_val = mids[int(bsln_peak)]
-        bsln_mask = np.abs(dt - peak_val) < 2*spacing
-        bsln_x = np.arange(len(dt))[bsln_mask]
-        bsln_y = dt[bsln_mask]
-        popt, _ = curve_fit(line, bsln_x, bsln_y)
-
-        self.corrected_data = dt - line(dt_x, *popt)
-        self.bsln = np.mean(bsln_y)
-        self.noise = np.std(bsln_y)
+        with self.timer.stage("baseline", samples=len(dt)):
+            dt_x = np.arange(len(dt))
+            lims, persistence, peaks, mids, spacing = find_most_persistent_value(dt,area_thresh=0,n_bins=100)
+            bsln_range = lims[np.argmax(persistence)]
+            bsln_peak = peaks[np.argmax(persistence)]
+            peak_val = mids[int(bsln_peak)]
+            bsln_mask = np.abs(dt - peak_val) < 2*spacing
+            bsln_x = np.arange(len(dt))[bsln_mask]
+            bsln_y = dt[bsln_mask]
+            popt, _ = curve_fit(line, bsln_x, bsln_y)
+
+            self.corrected_data = dt - line(dt_x, *popt)
+            self.bsln = np.mean(bsln_y)
+            self.noise = np.std(bsln_y)
+
+    def filter_corrected_data(self, filter_type: str, cutoff: float, sample_rate: float):
+        """Low-pass filters the corrected data for event detection only; events are still cut from the unfiltered corrected data."""
+        if filter_type == "none":
+            self.filtered_data = None
+            return
+        with self.timer.stage("filter", samples=len(self.corrected_data)):
+            self.filtered_data = filter_in_chunks(self.corrected_data, StreamingFilter(filter_type, cutoff, sample_rate))
 
     def gen_event_attrs(self, name: str, berth: int, sample_rate: float) -> dict:
-        cropped_event = self.event_data[berth:-(berth-1)]
+        with self.timer.stage("features", samples=len(self.event_data), events=1):
+            cropped_event = crop_event(self.event_data, berth)
+            return self._event_attrs(name, cropped_event, event_features(cropped_event, sample_rate))
+
+    def gen_file_events(self, berth: int, sample_rate: float) -> list[tuple[dict, np.ndarray]]:
+        """Cuts out every remaining event of the current data and works out their attributes in one batch (see batch_features),
+        for extracting a whole file without looking at each event. Returns the events' (attrs, data), unnamed."""
+        event_data = []
+        while True:
+            try:
+                self.next_event(berth)
+            except EventError:
+                break
+            event_data.append(self.event_data)
+        with self.timer.stage("features", samples=sum(len(data) for data in event_data), events=len(event_data)):
+            cropped_events = [crop_event(data, berth) for data in event_data]
+            features = batch_features(cropped_events, sample_rate)
+            return [(self._event_attrs(None, cropped_event, values), data) for cropped_event, values, data in zip(cropped_events, features, event_data)]
+
+    def _event_attrs(self, name: str, cropped_event: np.ndarray, features: dict) -> dict:
         logging.debug(f"Generating event attrs for cropped event of length {len(cropped_event)}")
-        c_e_l = len(cropped_event)
-        c_e_a = np.trapz(cropped_event)
-        try:
-            peak = np.min(cropped_event)
-        except:
-            peak = 0
-            logging.debug("Peak could not be found for event.")
         attrs = {
             'name':name,
-            "samples":c_e_l,
-            "duration_s":c_e_l/sample_rate,
-            "peak":peak,
-            "ecd":c_e_a/sample_rate,
-            "mean":np.mean(cropped_event),
-            "ffap":np.trapz(cropped_event[:(c_e_l)//5])/c_e_a,
-            "lfap":np.trapz(cropped_event[(-(c_e_l)//5):])/c_e_a,
-            "skew":np.trapz(cropped_event*np.linspace(0,1,len(cropped_event)))/np.trapz(cropped_event*np.linspace(1,0,len(cropped_event))),
+            **features,
             "event_timestamp_s":int(os.path.getmtime(self.tdms.get_file_name())),
             "trace_baseline_nA":self.bsln,
             "trace_noise_nA":self.noise
@@ -306,48 +780,20 @@ class Model():
     def correct_slope(self):
         self.current_data = self.slope_fix(self.current_data)[0]
 
-    def update_event_boundaries(self, thresh: float, tol: int):
-        def get_lims(hits):
-            runs = np.diff(hits)
-            lims = np.where(runs > 1)[0]
-            limits = []
-            for i in np.arange(len(lims) + 1):
-                if i == 0:
-                    left = hits[0]
-                try:
-                    right = hits[lims[i]]
-                    limits.append([left, right])
-                    left = hits[lims[i]+1]
-                except IndexError:
-                    right = hits[-1]
-                    limits.append([left, right])
-            return limits
-        def merge(list, dist = 100):
-            pairs = list.copy()
-            space = np.array([pairs[i+1][0] - pairs[i][1] for i in np.arange(len(pairs) - 1)])
-            merge_locs = np.where(space > dist)[0].astype(int)
-            if len(merge_locs) == 0:
-                return pairs
-            new_list = []
-            for i, loc in enumerate(merge_locs):
-                if i == 0:
-                    left = pairs[0][0]
-                try:
-                    right = pairs[loc][1]
-                    new_list.append([left, right])
-                    left = pairs[loc + 1][0]
-                except IndexError:
-                    right = pairs[-1][1]
-                    new_list.append([left, right])
-            return new_list
-        hits = np.where(self.corrected_data < thresh)[0]
-        if len(hits) == 0:
-            self.event_boundaries = []
-            self.current_event_index = None
-            return
-        lims = get_lims(hits)
-        logging.debug(f"Lims are: {lims}")
-        merged = merge(lims, tol)
+    def update_event_boundaries(self, thresh: float, tol: int, detector: str = "threshold", window: int = 100000, k: float = 5.0):
+        """Finds event boundaries in the corrected (or filtered, if available) data. The 'threshold' detector uses the single fixed
+        threshold thresh, the 'ksigma' and 'cusum' detectors instead track the local baseline and noise over window samples and use k sigma."""
+        detection_data = self.corrected_data if self.filtered_data is None else self.filtered_data
+        with self.timer.stage("detect", samples=len(detection_data)):
+            if detector == "threshold":
+                merged = threshold_boundaries(detection_data, thresh, tol)
+            elif detector == "ksigma":
+                merged = ksigma_boundaries(detection_data, window, k, tol)
+            elif detector == "cusum":
+                merged = cusum_boundaries(detection_data, window, k, tol)
+            else:
+                raise ValueError(f"Invalid detector '{detector}', should be one of {DETECTORS}")
+        self.timer.count("detect", events=len(merged))
         logging.debug(f"Merged lims are: {merged}")
         self.event_boundaries = merged
         self.current_event_index = None
@@ -376,6 +822,8 @@ class Model():
 
     def fix_event_baseline(self, berth: int):
         edata = self.event_data
+        if len(edata) == 0:
+            return edata
         ebsln = np.mean([edata[:berth//2],edata[-berth//2:]])
         return edata - ebsln
 
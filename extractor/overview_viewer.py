@@ -0,0 +1,73 @@
+"""Whole-run timeline viewer. Shows every file extracted from a directory as one continuous trace, drawn from the OVERVIEW.hdf5 store
+written during extraction, with extracted events marked in red and file boundaries as dashed grey lines. Zooming and panning with the
+toolbar only reads the pyramid level matching the zoom, so it stays quick however long the run is.
+Run from this directory with: python overview_viewer.py [directory or OVERVIEW.hdf5 file]"""
+
+import os
+import sys
+import numpy as np
+from PyQt6.QtWidgets import QApplication, QMainWindow, QFileDialog
+from view import PlotWithToolbar, ErrorDialog
+from extractor_utils.overview import OverviewReader
+
+class OverviewWindow(QMainWindow):
+    def __init__(self, path: str, max_bins: int = 2000, max_markers: int = 2000):
+        super().__init__()
+        self.reader = OverviewReader(path)
+        self.max_bins = max_bins
+        self.max_markers = max_markers
+        self.artists = []
+        self.setWindowTitle(f"Overview: {os.path.dirname(os.path.abspath(path))}")
+        self.plot = PlotWithToolbar(autoscale = False)
+        self.setCentralWidget(self.plot)
+        self.axes = self.plot.canvas.axes
+        self.plot.label_x("Time /s")
+        self.plot.label_y("Current /nA")
+        self.axes.set_xlim(0, self.reader.samples/self.reader.sample_rate)
+        self.axes.callbacks.connect('xlim_changed', self.redraw)
+        self.redraw(self.axes)
+        self.show()
+
+    def _markers(self, positions: np.ndarray, **kwargs):
+        """Draws vertical lines at sample positions, thinned out evenly if there are too many to see individually."""
+        if len(positions) > self.max_markers:
+            positions = positions[::int(np.ceil(len(positions)/self.max_markers))]
+        if len(positions) > 0:
+            self.artists.append(self.axes.vlines(positions/self.reader.sample_rate, 0, 1, transform=self.axes.get_xaxis_transform(), **kwargs))
+
+    def redraw(self, axes):
+        """Redraws the visible range from the pyramid level that gives about max_bins bins across it."""
+        sample_rate = self.reader.sample_rate
+        left, right = axes.get_xlim()
+        start = int(max(left, 0)*sample_rate)
+        stop = int(min(right*sample_rate, self.reader.samples))
+        for artist in self.artists:
+            artist.remove()
+        self.artists = []
+        x, rows = self.reader.read(start, stop, self.max_bins)
+        if len(x) > 0:
+            self.artists.append(axes.fill_between(x/sample_rate, rows[:, 0], rows[:, 1], color='C0', alpha=0.4, lw=0))
+            self.artists += axes.plot(x/sample_rate, rows[:, 2], c='C0', lw=0.8)
+            pad = 0.05*(np.max(rows[:, 1]) - np.min(rows[:, 0]) + 1e-12)
+            axes.set_ylim(np.min(rows[:, 0]) - pad, np.max(rows[:, 1]) + pad)
+        starts = self.reader.file_starts
+        self._markers(starts[(starts > start) & (starts < stop)], colors='grey', linestyles='dashed', lw=0.8)
+        events = self.reader.events_in(start, stop)
+        self._markers(events[:, 0], colors='r', lw=0.5, alpha=0.6)
+        level = self.reader.choose_level(start, stop, self.max_bins)
+        axes.set_title(f"{self.reader.file_at((start + stop)//2)}; {len(events)} events in view; {self.reader.bin_sizes[level]} samples per bin")
+        self.plot.canvas.draw_idle()
+
+    def closeEvent(self, _):
+        self.reader.close()
+
+if __name__ == "__main__":
+    app = QApplication(sys.argv)
+    path = sys.argv[1] if len(sys.argv) > 1 else QFileDialog.getExistingDirectory(None, 'Select Directory Containing OVERVIEW.hdf5')
+    if os.path.isdir(path):
+        path = os.path.join(path, "OVERVIEW.hdf5")
+    if not os.path.exists(path):
+        ErrorDialog(f"No overview found at {path}; run the extractor on the directory first.")
+        sys.exit()
+    w = OverviewWindow(path)
+    app.exec()
@@ -1,9 +1,11 @@
-from PyQt6.QtWidgets import QMainWindow, QLineEdit, QPushButton, QVBoxLayout, QHBoxLayout, QGridLayout, QWidget, QLabel, QFrame, QCheckBox, QMessageBox, QPlainTextEdit
+from PyQt6.QtWidgets import QMainWindow, QLineEdit, QPushButton, QVBoxLayout, QHBoxLayout, QGridLayout, QWidget, QLabel, QFrame, QCheckBox, QComboBox, QMessageBox, QPlainTextEdit
 from PyQt6.QtCore import pyqtSignal
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT
 from matplotlib.figure import Figure
 import numpy as np
 import logging
+from extractor_utils.filtering import FILTER_TYPES
+from extractor_utils.detectors import DETECTORS
 
 from PyQt6 import QtCore, QtGui, QtWidgets
 import sys
@@ -165,6 +167,13 @@ class MainWindow(QMainWindow):
         self.eventThresholdSetting = SettingField("Event Threshold /nA:")
         self.eventBerthSetting = SettingField("Event Berth (Gap Each Side) /samples:")
         self.gapTolSetting = SettingField("Gap Tolerance (Max No. of Samples Below Threshold in Event):")
+        self.filterTypeSetting = SettingField("Detection Low-Pass Filter:", field_type='combo', options=FILTER_TYPES)
+        self.filterCutoffSetting = SettingField("Filter Cutoff Frequency /Hz:")
+        self.detectorSetting = SettingField("Event Detector:", field_type='combo', options=DETECTORS)
+        self.detectorWindowSetting = SettingField("Adaptive Detector Window /samples:")
+        self.detectorKSetting = SettingField("Adaptive Detector k /sigma:")
+        self.prescreenMarginSetting = SettingField("Prescreen Margin (0 = off):")
+        self.lineFreqSetting = SettingField("Mains Line Frequency /Hz:")
         #CONTROLS
         self.acceptButton = QPushButton(text="Accept Event")
         self.rejectButton = QPushButton(text="Reject Event")
@@ -184,6 +193,13 @@ class MainWindow(QMainWindow):
         StartUpSettingsLayout.addWidget(self.eventThresholdSetting)
         StartUpSettingsLayout.addWidget(self.eventBerthSetting)
         StartUpSettingsLayout.addWidget(self.gapTolSetting)
+        StartUpSettingsLayout.addWidget(self.filterTypeSetting)
+        StartUpSettingsLayout.addWidget(self.filterCutoffSetting)
+        StartUpSettingsLayout.addWidget(self.detectorSetting)
+        StartUpSettingsLayout.addWidget(self.detectorWindowSetting)
+        StartUpSettingsLayout.addWidget(self.detectorKSetting)
+        StartUpSettingsLayout.addWidget(self.prescreenMarginSetting)
+        StartUpSettingsLayout.addWidget(self.lineFreqSetting)
         StartUpSettingsLayout.addStretch()
         #PACK CONTROLS
         ControlsLayout.addWidget(self.controlsLabel,0,0,1,2)
@@ -207,8 +223,8 @@ class MainWindow(QMainWindow):
         PanelLayout.addLayout(ControlsLayout)
         self.mainLayout.addLayout(PanelLayout)
         #PACKAGE SETTINGS INTO LIST FOR EASY READING
-        self.settings = [self.sampleRateSetting,self.eventThresholdSetting, self.eventBerthSetting, self.gapTolSetting, self.loopDelaySetting]
-        self.setting_names = ["sample_rate", "event_thresh", "event_berth", "gap_tol", "loop_delay"]
+        self.settings = [self.sampleRateSetting,self.eventThresholdSetting, self.eventBerthSetting, self.gapTolSetting, self.filterTypeSetting, self.filterCutoffSetting, self.detectorSetting, self.detectorWindowSetting, self.detectorKSetting, self.prescreenMarginSetting, self.lineFreqSetting, self.loopDelaySetting]
+        self.setting_names = ["sample_rate", "event_thresh", "event_berth", "gap_tol", "filter_type", "filter_cutoff", "detector", "detector_window", "detector_k", "prescreen_margin", "line_freq", "loop_delay"]
         self.settings_dict = dict(zip(self.setting_names,self.settings))
         #PACKAGE CONTROLS INTO LIST FOR EASY HANDLING
         self.controls = [self.acceptButton, self.rejectButton,self.keepAcceptingButton,self.keepRejectingButton,self.finishButton,self.skipButton, self.pauseButton, self.turboMode]
@@ -284,7 +300,7 @@ class VSeparator(QFrame):
 
 class SettingField(QWidget):
     """A widget comprised of a label/field pair."""
-    def __init__(self, label: str, field_type: str = 'line'):
+    def __init__(self, label: str, field_type: str = 'line', options: list[str] | None = None):
         super().__init__()
         self.widget_layout = QHBoxLayout()
         self.setLayout(self.widget_layout)
@@ -294,8 +310,11 @@ class SettingField(QWidget):
             self.field = QLineEdit()
         elif field_type == "check":
             self.field = QCheckBox()
+        elif field_type == "combo":
+            self.field = QComboBox()
+            self.field.addItems(options if options is not None else [])
         else:
-            raise ValueError(f"Invalid argument, field type should be 'line' or 'check', not {field_type}")
+            raise ValueError(f"Invalid argument, field type should be 'line', 'check' or 'combo', not {field_type}")
 
         self.widget_layout.addWidget(self.label)
         self.widget_layout.addWidget(self.field)
@@ -310,6 +329,8 @@ class SettingField(QWidget):
             return val
         elif self.type == 'check':
             return self.field.isChecked()
+        elif self.type == 'combo':
+            return self.field.currentText()
 
     def set_val(self, val):
         """Set value of field"""
@@ -317,6 +338,10 @@ class SettingField(QWidget):
             self.field.setText(str(val))
         elif self.type == 'check':
             self.field.setChecked(val)
+        elif self.type == 'combo':
+            if self.field.findText(str(val)) < 0:
+                raise ValueError(f"'{val}' is not one of the options for {self.field_name()}")
+            self.field.setCurrentText(str(val))
 
     def lock_field(self):
         if self.type == 'line':
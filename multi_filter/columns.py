@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+class ColumnStore():
+    """Read-only float copies of the numeric columns of a dataframe, made once when it's loaded, with the finite values of each
+    marked. Event features worked out on demand are added as columns here only, not to the dataframe. The range of the finite
+    values of a column over the kept rows is worked out the first time it's asked for and then updated as rows are removed or
+    put back, only going over the column again if a removed row held its minimum or maximum."""
+    def __init__(self, frame: pd.DataFrame):
+        self.columns = {}
+        self.finite = {}
+        self.ranges = {}
+        for name in frame.columns:
+            if pd.api.types.is_numeric_dtype(frame[name]):
+                self.add(name, frame[name])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def add(self, name: str, values: pd.Series):
+        values = values.to_numpy(dtype=float, copy=True)
+        values.flags.writeable = False
+        self.columns[name] = values
+        self.finite[name] = np.isfinite(values)
+        self.ranges.pop(name, None)
+
+    def get(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def kept_range(self, name: str, kept: np.ndarray) -> tuple[float, float] | None:
+        """Minimum and maximum finite value of a column over the kept rows, or None if none of them are finite."""
+        if name not in self.ranges:
+            self.ranges[name] = self._range(self.columns[name][kept & self.finite[name]])
+        return self.ranges[name]
+
+    def _range(self, values: np.ndarray) -> tuple[float, float] | None:
+        if len(values) == 0:
+            return None
+        return (float(values.min()), float(values.max()))
+
+    def update_kept(self, before: np.ndarray, after: np.ndarray):
+        """Updates the cached ranges after the kept rows change from before to after."""
+        removed = before & ~after
+        added = after & ~before
+        for name, bounds in list(self.ranges.items()):
+            values = self.columns[name]
+            finite = self.finite[name]
+            gone = self._range(values[removed & finite])
+            if bounds is not None and gone is not None and (gone[0] <= bounds[0] or gone[1] >= bounds[1]):
+                self.ranges[name] = self._range(values[after & finite])
+                continue
+            new = self._range(values[added & finite])
+            if new is not None:
+                self.ranges[name] = new if bounds is None else (min(bounds[0], new[0]), max(bounds[1], new[1]))
@@ -1,13 +1,12 @@
 from PyQt6.QtWidgets import QFileDialog
 from PyQt6.QtCore import Qt
-from model import Model, check_path_existence, get_file_ext, Point, get_line, straight_line, remove_bad_values, isbelow, diff_dfs, union_dfs
-from view import MainWindow, ErrorDialog
+from model import Model, check_path_existence, get_file_ext, Point, get_line, straight_line, isbelow
+from view import MainWindow, ErrorDialog, ScatterMatrixWindow, ScatterPanel
 import numpy as np
 import logging
+import itertools
 import matplotlib as mpl
 from matplotlib.widgets import Lasso
-from matplotlib import path
-import pandas as pd
 
 #TODO In this module there's a lot of logic (specifically pertaining to the selection of split points)
 #that I feel should be moved to the Model. This would make resetting things easier, since currently they all have to be reset manually by assignment.
@@ -34,6 +33,9 @@ class Controller():
     split_point2_artist = None
     split_line_artist = None
     shade_artist = None
+    scatter_panel = None
+    matrix = None
+    matrix_panels: dict = {}
     x_parameter: str | None
     y_parameter: str | None
     def __init__(self, version = "Default"):
@@ -47,6 +49,7 @@ class Controller():
     #Initialisation
 
     def reset_model(self):
+        self.model.close()
         self.model = Model()
 
     def reset_view_state(self):
@@ -79,6 +82,8 @@ class Controller():
         self.split_point2_artist = None
         self.split_line_artist = None
         self._reset_shading()
+        self.scatter_panel = None
+        self._close_matrix()
         self.x_parameter = None
         self.y_parameter = None
         
@@ -90,13 +95,18 @@ class Controller():
         self.view.newButton.clicked.connect(self.new)
         self.view.lockNameButton.clicked.connect(self.lock_names)
         self.view.updatePlotButton.clicked.connect(self.update_scatter_plot)
+        self.view.densityBox.toggled.connect(self.update_scatter_plot)
         self.scatter_cid = self.view.scatterPlot.canvas.mpl_connect('button_press_event', self.select_event)
         self.view.splitLineButton.clicked.connect(self.choose_first)
         self.view.lassoButton.clicked.connect(self.lasso_start)
         self.view.resetAllButton.clicked.connect(self.reset_selections)
         self.view.saveSelectionButton.clicked.connect(self.save_selection)
+        self.view.saveFilterButton.clicked.connect(self.save_filter)
+        self.view.matrixButton.clicked.connect(self.open_matrix)
         self.view.deletePoints.clicked.connect(self.rm_selected_points)
         self.view.keepPoints.clicked.connect(self.rm_unselected_points)
+        self.view.undoButton.clicked.connect(self.undo)
+        self.view.redoButton.clicked.connect(self.redo)
         self.view.keyPressed.connect(self.key_press_control)
 
     def start(self):
@@ -149,11 +159,12 @@ class Controller():
         
     def lock_names(self):
         index = self.view.nameBox.currentIndex()
+        self.model.name_column_index = index
         self.view.lockNameButton.setEnabled(False)
         self.view.nameBox.setEnabled(False)
 
         #Populate Control Comboboxes
-        other_cols = self.model.get_df_cols(exclude = index)
+        other_cols = self.model.get_df_cols(exclude = index) + self.model.get_feature_cols()
         self.view.xBox.addItems(other_cols)
         self.view.xBox.setEnabled(True)
         self.view.yBox.addItems(other_cols)
@@ -165,6 +176,7 @@ class Controller():
         #Check selected parameters
         self.x_parameter = self.view.xBox.currentText()
         self.y_parameter = self.view.yBox.currentText()
+        self.model.ensure_columns((self.x_parameter, self.y_parameter))
 
         #Reset plots
         self.view.scatterPlot.clear_axes()
@@ -175,32 +187,16 @@ class Controller():
         self.event_point = None
         self._reset_shading()
 
-        #Separate data into selected and unselected and plot in different colours
-        all_x_data = np.array(self.model.df[self.x_parameter])
-        all_y_data = np.array(self.model.df[self.y_parameter])
-        logging.info(f"Plotting {len(self.model.df)} points...")
-        if self.model.selection is not None:
-            selected_x_data = np.array(self.model.selection[self.x_parameter])
-            selected_y_data = np.array(self.model.selection[self.y_parameter])
-            self.view.scatterPlot.scatter(selected_x_data,selected_y_data,alpha=0.1, c='r')
-            unselected_df = diff_dfs(self.model.df,self.model.selection)
-        else:
-            unselected_df = self.model.df
-
-        unsel_x_data = np.array(unselected_df[self.x_parameter])
-        unsel_y_data = np.array(unselected_df[self.y_parameter])
-        self.view.scatterPlot.scatter(unsel_x_data,unsel_y_data, alpha=0.1, c='b')
+        #Plot kept points, with the selected ones in a different colour. The artists are kept and updated by refresh_scatter_plot
+        #when the selection or the kept points change; density mode draws images of point density, redrawn for the visible range
+        #on zoom, with markers only when few points are in view
+        logging.info(f"Plotting {self.model.n_kept()} points...")
+        self.scatter_panel = self.view.scatterPlot.scatter_panel(self.model.values(self.x_parameter), self.model.values(self.y_parameter),
+                                                                 density=self.view.densityBox.isChecked())
+        self.scatter_panel.show(self.model.kept, self.model.selected)
+        self._fit_scatter_lims()
         logging.info("Done plotting.")
 
-        #Set lims
-        x_wo_bad_vals = remove_bad_values(all_x_data)
-        x_range = np.ptp(x_wo_bad_vals)
-        x_lims = (np.min(x_wo_bad_vals) - 0.05*x_range,np.max(x_wo_bad_vals) + 0.05*x_range)
-        y_wo_bad_vals = remove_bad_values(all_y_data)
-        y_range = np.ptp(y_wo_bad_vals)
-        y_lims = (np.max(y_wo_bad_vals) + 0.05*y_range, np.min(y_wo_bad_vals) - 0.05*y_range)
-        self.view.scatterPlot.set_lims(*y_lims, *x_lims)
-
         #Label axes
         self.view.scatterPlot.label_x(self.x_parameter)
         self.view.scatterPlot.label_y(self.y_parameter)
@@ -216,6 +212,103 @@ class Controller():
         #Enable free select
         self.free_select = True
 
+    def refresh_scatter_plot(self):
+        """Updates the scatter plot after the selection or the kept points change, without plotting everything again."""
+        if self.scatter_panel is None:
+            self.update_scatter_plot()
+            return None
+        self._switch_controls(True)
+        if self.scatter_panel.show(self.model.kept, self.model.selected):
+            self._fit_scatter_lims()
+
+        #The clicked event is forgotten whenever points are removed or the selection is reset
+        if self.model.current is None and self.event_point is not None:
+            self.event_point.remove()
+            self.event_point = None
+            self._clear_event_plot()
+            self.view.eventPlot.update()
+
+        self.view.scatterPlot.reset_title()
+        self.view.scatterPlot.update_idle()
+        self.refresh_matrix()
+
+    def _padded_lims(self, x_param: str, y_param: str) -> tuple | None:
+        #Lims around the kept points, unless every point has been removed (which can be undone)
+        x_bounds = self.model.kept_range(x_param)
+        y_bounds = self.model.kept_range(y_param)
+        if x_bounds is None or y_bounds is None:
+            return None
+        x_range = x_bounds[1] - x_bounds[0]
+        x_lims = (x_bounds[0] - 0.05*x_range,x_bounds[1] + 0.05*x_range)
+        y_range = y_bounds[1] - y_bounds[0]
+        y_lims = (y_bounds[1] + 0.05*y_range, y_bounds[0] - 0.05*y_range)
+        return x_lims, y_lims
+
+    def _fit_scatter_lims(self):
+        lims = self._padded_lims(self.x_parameter, self.y_parameter)
+        if lims is not None:
+            self.view.scatterPlot.set_lims(*lims[1], *lims[0])
+
+    #Scatter matrix
+
+    def open_matrix(self):
+        if self.matrix is not None:
+            self.matrix.raise_()
+            return None
+        self.matrix = ScatterMatrixWindow(self.model.get_df_cols(exclude = self.model.name_column_index) + self.model.get_feature_cols())
+        self.matrix.plotButton.clicked.connect(self.update_matrix)
+        self.matrix.closed.connect(self._forget_matrix)
+        self.matrix.canvas.mpl_connect('button_press_event', self._matrix_lasso)
+
+    def _forget_matrix(self):
+        self.matrix = None
+        self.matrix_panels = {}
+
+    def _close_matrix(self):
+        if self.matrix is not None:
+            self.matrix.close()
+        self._forget_matrix()
+
+    def update_matrix(self):
+        """Plots every pair of the parameters chosen in the scatter matrix window. The panels share the model's kept and selected
+        masks, so a lasso in any of them selects the same events in all of them and in the main scatter plot."""
+        params = self.matrix.chosen_params()
+        if len(params) < 2 or len(params) > 5:
+            ErrorDialog("Choose between 2 and 5 parameters for the scatter matrix.")
+            return None
+        self.model.ensure_columns(params)
+        pairs = list(itertools.combinations(params, 2))
+        logging.info(f"Plotting {len(pairs)} pairs of parameters...")
+        self.matrix_panels = {}
+        for ax, pair in zip(self.matrix.set_pairs(pairs), pairs):
+            panel = ScatterPanel(ax, self.model.values(pair[0]), self.model.values(pair[1]), density=self.view.densityBox.isChecked())
+            self.matrix_panels[ax] = (pair, panel)
+        self.refresh_matrix()
+
+    def refresh_matrix(self):
+        if self.matrix is None:
+            return None
+        for ax, (pair, panel) in self.matrix_panels.items():
+            if panel.show(self.model.kept, self.model.selected):
+                lims = self._padded_lims(*pair)
+                if lims is not None:
+                    ax.set_xlim(*lims[0])
+                    ax.set_ylim(lims[1][1], lims[1][0])
+        self.matrix.update()
+
+    def _matrix_lasso(self, event):
+        #Any press in a panel starts a lasso, unless the toolbar is panning or zooming or the main window is partway through a selection
+        if event.inaxes not in self.matrix_panels or self.matrix.toolbar.mode or not self.view.lassoButton.isEnabled():
+            return None
+        ax = event.inaxes
+        self.matrix_lasso = Lasso(ax, (event.xdata, event.ydata), lambda verts: self._matrix_lasso_selection(ax, verts))
+
+    def _matrix_lasso_selection(self, ax, verts):
+        pair = self.matrix_panels[ax][0]
+        self.model.select_lasso(verts, pair)
+        logging.info(f"Lasso in {pair[0]} vs {pair[1]} selected {np.count_nonzero(self.model.selected)} points.")
+        self.refresh_scatter_plot()
+
     def plot_event(self, name):
         event_data = self.model.get_event_data(name)
         t_data = np.arange(len(event_data))/self.model.get_sample_rate()
@@ -257,10 +350,10 @@ class Controller():
         click = Point(event.xdata, event.ydata)
 
         #Picking nearest event (if there is one)
-        picked = self.model.choose_event(click, (self.x_parameter, self.y_parameter))
+        row = self.model.choose_event(click, (self.x_parameter, self.y_parameter))
 
         #Check whether any event was found
-        if picked is None:
+        if row is None:
             logging.info("No valid events in vicinity of click.")
             self.model.current = None
             if self.event_point is not None:
@@ -271,9 +364,9 @@ class Controller():
             self.view.eventPlot.update_toolbar()
             return None
         else:
+            picked = self.model.get_row(row).to_dict()
             logging.info(f"Event named '{picked[self.view.nameBox.currentText()]}' selected, fetching data...")
-            self.model.current = pd.DataFrame([picked])
-            picked = picked.to_dict()
+            self.model.current = row
 
         #Plot event
         event_name = picked[self.view.nameBox.currentText()]
@@ -283,6 +376,9 @@ class Controller():
         if "peak_start" in picked and "peak_end" in picked:
             self.plot_peak(event_name, picked["peak_start"],picked["peak_end"])
 
+        #Read the events around this one while the user looks at it
+        self.model.prefetch_neighbours(row, (self.x_parameter, self.y_parameter))
+
         #Remove any old points
         if self.event_point is not None:
             self.event_point.remove()
@@ -349,8 +445,11 @@ class Controller():
             self.split_line_artist.remove()
         if self.split_point1 is not None and self.split_point2 is not None:
             logging.info("Two split points selected, trying to draw line...")
-            x_data = np.array(self.model.df[self.x_parameter])
-            x_range = np.linspace(np.nanmin(x_data),np.nanmax(x_data), 100)
+            x_bounds = self.model.kept_range(self.x_parameter)
+            if x_bounds is None:
+                logging.info("No points left to draw split line over.")
+                return None
+            x_range = np.linspace(*x_bounds, 100)
             line_vars = get_line(self.split_point1, self.split_point2)
             self.split_line_artist, = self.view.scatterPlot.plot(x_range, straight_line(x_range, *line_vars), c = 'g')
 
@@ -361,18 +460,16 @@ class Controller():
         
         self.model.region_point = Point(event.xdata,event.ydata)
         
-        x_data = np.array(self.model.df[self.x_parameter])
-        x_range = np.linspace(np.nanmin(x_data),np.nanmax(x_data), 100)
-
-        y_data = np.array(self.model.df[self.y_parameter])
+        x_range = np.linspace(*self.model.kept_range(self.x_parameter), 100)
+        y_bounds = self.model.kept_range(self.y_parameter)
 
         line_vars = get_line(self.split_point1, self.split_point2)
 
         if isbelow(self.model.region_point, line_vars):
-            self.shade_artist = self.view.scatterPlot.fill_between(x_range, np.nanmin(y_data), straight_line(x_range, *line_vars), alpha = 0.1, fc = 'g')
+            self.shade_artist = self.view.scatterPlot.fill_between(x_range, y_bounds[0], straight_line(x_range, *line_vars), alpha = 0.1, fc = 'g')
             logging.info(f"Click detected at {event.xdata}, {event.ydata}, shading below split line.")
         else:
-            self.shade_artist = self.view.scatterPlot.fill_between(x_range, straight_line(x_range, *line_vars), np.nanmax(y_data), alpha = 0.1, fc = 'g')
+            self.shade_artist = self.view.scatterPlot.fill_between(x_range, straight_line(x_range, *line_vars), y_bounds[1], alpha = 0.1, fc = 'g')
             logging.info(f"Click detected at {event.xdata}, {event.ydata}, shading above split line.")
 
         #Connect enter press signal to slot for confirmation
@@ -384,17 +481,15 @@ class Controller():
     def confirm(self,key):
         if key == Qt.Key.Key_Return:
             line_vars = get_line(self.split_point1, self.split_point2)
-            subDf = self.model.get_sub_df(self.model.region_point, (self.x_parameter, self.y_parameter), line_vars)
+            self.model.select_split(self.model.region_point, (self.x_parameter, self.y_parameter), line_vars)
             self.reset_splitline_params()
             self._reset_shading()
-            self.model.selection = subDf
-            logging.info(f"Split selected {len(subDf)} points.")
+            logging.info(f"Split selected {np.count_nonzero(self.model.selected)} points.")
             self.view.keyPressed.disconnect()
             self.view.keyPressed.connect(self.key_press_control)
             self.view.scatterPlot.canvas.mpl_disconnect(self.scatter_cid)
             self.scatter_cid = self.view.scatterPlot.canvas.mpl_connect('button_press_event',self.select_event)
-            self._switch_controls(True)
-            self.update_scatter_plot()
+            self.refresh_scatter_plot()
 
     def key_press_control(self,key):
         if key == Qt.Key.Key_D:
@@ -403,6 +498,10 @@ class Controller():
             self.rm_unselected_points()
         elif key == Qt.Key.Key_S:
             self.save_selection()
+        elif key == Qt.Key.Key_Z:
+            self.undo()
+        elif key == Qt.Key.Key_Y:
+            self.redo()
 
     def _reset_shading(self):
         if self.shade_artist is not None:
@@ -417,9 +516,14 @@ class Controller():
         self.view.lassoButton.setEnabled(state)
         self.view.resetAllButton.setEnabled(state)
         self.view.saveSelectionButton.setEnabled(state)
+        self.view.saveFilterButton.setEnabled(state)
+        self.view.matrixButton.setEnabled(state)
         self.view.deletePoints.setEnabled(state)
         self.view.keepPoints.setEnabled(state)
+        self.view.undoButton.setEnabled(state)
+        self.view.redoButton.setEnabled(state)
         self.view.updatePlotButton.setEnabled(state)
+        self.view.densityBox.setEnabled(state)
         self.view.xBox.setEnabled(state)
         self.view.yBox.setEnabled(state)
 
@@ -440,8 +544,8 @@ class Controller():
         self.split_line_artist = None
 
     def reset_selections(self):
-        self.model.selection = None
-        self.update_scatter_plot()
+        self.model.clear_selection()
+        self.refresh_scatter_plot()
 
 
     def lasso_start(self):
@@ -458,38 +562,46 @@ class Controller():
         self.scatter_cid = self.view.scatterPlot.canvas.mpl_connect('button_press_event', self.select_event)
 
     def rm_selected_points(self):
-        full_selection = union_dfs(self.model.selection, self.model.current)
-        self.model.df = diff_dfs(self.model.df,full_selection)
-        self.model.selection=None
-        self.model.current=None
-        self.update_scatter_plot()
+        self.model.remove_selected()
+        self.refresh_scatter_plot()
 
     def rm_unselected_points(self):
-        full_selection = union_dfs(self.model.selection, self.model.current)
-        self.model.df = full_selection
-        self.model.selection=None
-        self.model.current=None
-        self.update_scatter_plot()
+        self.model.keep_selected()
+        self.refresh_scatter_plot()
+
+    def undo(self):
+        if self.model.undo():
+            logging.info(f"Undone, {self.model.n_kept()} points remaining.")
+            self.refresh_scatter_plot()
+        else:
+            logging.info("Nothing to undo.")
+
+    def redo(self):
+        if self.model.redo():
+            logging.info(f"Redone, {self.model.n_kept()} points remaining.")
+            self.refresh_scatter_plot()
+        else:
+            logging.info("Nothing to redo.")
 
     def _lasso_selection(self, verts):
         try:
-            x_data = np.array(self.model.df[self.x_parameter])
-            y_data = np.array(self.model.df[self.y_parameter])
+            self.model.select_lasso(verts, (self.x_parameter, self.y_parameter))
         except KeyError:
             logging.info(f"Failed to fetch data for parameters {self.x_parameter}, {self.y_parameter}...")
             return None
-        inlasso = path.Path(verts).contains_points(np.column_stack((x_data,y_data)))
         self.view.scatterPlot.canvas.draw_idle()
-        subDf = self.model.df[inlasso]
-        self.model.selection = subDf
-        logging.info(f"Lasso selected {len(subDf)} points.")
-        self._switch_controls(True)
-        self.update_scatter_plot()
+        logging.info(f"Lasso selected {np.count_nonzero(self.model.selected)} points.")
+        self.refresh_scatter_plot()
 
     def save_selection(self):
         fname = save_dialog(self.view.dataframeLocation.text(), "PKL File (*.pkl)")
-        self.model.df.to_pickle(fname)
+        self.model.kept_df().to_pickle(fname)
         logging.info("Selection saved!")
             
 
-
+    def save_filter(self):
+        fname = save_dialog(self.view.dataframeLocation.text(), "JSON File (*.json)")
+        if fname == "":
+            return None
+        self.model.pipeline.save(fname)
+        logging.info(f"Filter with {len(self.model.pipeline.steps)} steps saved!")
@@ -0,0 +1,74 @@
+import numpy as np
+from matplotlib.image import AxesImage
+from matplotlib.colors import LinearSegmentedColormap, LogNorm, to_rgb
+
+def density_grid(x_data: np.ndarray, y_data: np.ndarray, x_lims: tuple[float,float], y_lims: tuple[float,float], shape: tuple[int,int]) -> np.ndarray:
+    """Number of points in each cell of a (rows, columns) grid spanning x_lims and y_lims, with row 0 at the bottom. Points outside
+    the limits aren't counted. Much faster than np.histogram2d for millions of points as the bins are all the same size."""
+    n_rows, n_cols = shape
+    inside = (x_data >= x_lims[0]) & (x_data <= x_lims[1]) & (y_data >= y_lims[0]) & (y_data <= y_lims[1])
+    cols = ((x_data[inside] - x_lims[0])*(n_cols/(x_lims[1] - x_lims[0]))).astype(np.int64)
+    rows = ((y_data[inside] - y_lims[0])*(n_rows/(y_lims[1] - y_lims[0]))).astype(np.int64)
+    np.minimum(cols, n_cols - 1, out=cols)
+    np.minimum(rows, n_rows - 1, out=rows)
+    return np.bincount(rows*n_cols + cols, minlength=n_rows*n_cols).reshape(shape)
+
+class DensityScatter(AxesImage):
+    """Scatter plot drawn as an image of how many points fall in each screen pixel (or block of pixels_per_bin pixels), coloured
+    from faint to solid colour on a log scale. The image is worked out again for the visible range whenever the axes are drawn
+    after a zoom, pan or resize, so it always shows full detail. When no more than max_markers points are in view they are drawn
+    as normal scatter markers instead, which are clearer when there are few of them."""
+    def __init__(self, axes, x_data: np.ndarray, y_data: np.ndarray, colour = 'b', alpha: float = 0.1, max_markers: int = 20000,
+                 pixels_per_bin: int = 2, zorder: float = 1):
+        rgb = to_rgb(colour)
+        cmap = LinearSegmentedColormap.from_list(f"density_{colour}", [(*rgb, 0.25), (*rgb, 1)])
+        cmap.set_bad(alpha=0)
+        super().__init__(axes, cmap=cmap, norm=LogNorm(), interpolation='nearest', origin='lower', zorder=zorder)
+        self.max_markers = max_markers
+        self.pixels_per_bin = pixels_per_bin
+        axes.add_image(self)
+        #Only ever covers the axes, and has no extent until first drawn, so is left out when laying out the figure
+        self.set_in_layout(False)
+        self.markers = axes.scatter([], [], alpha=alpha, c=colour, zorder=zorder)
+        self.markers.set_visible(False)
+        self.set_points(x_data, y_data)
+
+    def set_points(self, x_data: np.ndarray, y_data: np.ndarray):
+        finite = np.isfinite(x_data) & np.isfinite(y_data)
+        self.x_data = np.asarray(x_data, dtype=float)[finite]
+        self.y_data = np.asarray(y_data, dtype=float)[finite]
+        self.view_key = None
+        self.stale = True
+
+    def remove(self):
+        self.markers.remove()
+        super().remove()
+
+    def _update_view(self, renderer):
+        x_lims = tuple(sorted(self.axes.get_xlim()))
+        y_lims = tuple(sorted(self.axes.get_ylim()))
+        box = self.axes.get_window_extent(renderer)
+        shape = (max(int(box.height/self.pixels_per_bin), 1), max(int(box.width/self.pixels_per_bin), 1))
+        key = (x_lims, y_lims, shape)
+        if key == self.view_key:
+            return
+        self.view_key = key
+        in_view = (self.x_data >= x_lims[0]) & (self.x_data <= x_lims[1]) & (self.y_data >= y_lims[0]) & (self.y_data <= y_lims[1])
+        self.n_visible = int(np.count_nonzero(in_view))
+        if self.n_visible <= self.max_markers:
+            self.markers.set_offsets(np.column_stack((self.x_data[in_view], self.y_data[in_view])))
+            self.markers.set_visible(True)
+            return
+        self.markers.set_visible(False)
+        counts = density_grid(self.x_data, self.y_data, x_lims, y_lims, shape)
+        self.set_data(np.ma.masked_equal(counts, 0))
+        self.norm.vmin, self.norm.vmax = 1, max(counts.max(), 2)
+        self.set_extent((*x_lims, *y_lims))
+
+    def draw(self, renderer):
+        #Drawn just before the markers, which share its zorder but were added to the axes after it, so they can be switched on here
+        if not self.get_visible() or self.axes.get_xlim()[0] == self.axes.get_xlim()[1] or self.axes.get_ylim()[0] == self.axes.get_ylim()[1]:
+            return
+        self._update_view(renderer)
+        if not self.markers.get_visible():
+            super().draw(renderer)
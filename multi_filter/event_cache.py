@@ -0,0 +1,74 @@
+import logging
+import threading
+import numpy as np
+import h5py
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class EventCache():
+    """Least recently used cache of event data read from the 'current_data' group of an EVENTS.hdf5 file, holding at most
+    max_bytes of it. prefetch reads events into the cache on a background thread, e.g. the neighbours of a clicked point, which are
+    likely to be clicked next. Each call to prefetch drops whatever was left of the previous one. Arrays are returned read-only as
+    they are shared by everyone asking for the same event."""
+    def __init__(self, data: h5py.File, max_bytes: int = 256*2**20):
+        self.data = data
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.events = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.pool = ThreadPoolExecutor(max_workers=1)
+
+    def __contains__(self, name: str) -> bool:
+        with self.lock:
+            return name in self.events
+
+    def _read(self, name: str) -> np.ndarray:
+        event_data = self.data['current_data'][name][:]
+        event_data.flags.writeable = False
+        return event_data
+
+    def _add(self, name: str, event_data: np.ndarray):
+        if event_data.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if name in self.events:
+                return
+            self.events[name] = event_data
+            self.nbytes += event_data.nbytes
+            while self.nbytes > self.max_bytes:
+                _, dropped = self.events.popitem(last=False)
+                self.nbytes -= dropped.nbytes
+
+    def get(self, name: str) -> np.ndarray:
+        with self.lock:
+            if name in self.events:
+                self.events.move_to_end(name)
+                return self.events[name]
+        event_data = self._read(name)
+        self._add(name, event_data)
+        return event_data
+
+    def prefetch(self, names: list[str]):
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+        self.pool.submit(self._prefetch, names, generation)
+
+    def _prefetch(self, names: list[str], generation: int):
+        for name in names:
+            if self.generation != generation:
+                return
+            if name in self:
+                continue
+            try:
+                self._add(name, self._read(name))
+            except (KeyError, OSError, ValueError) as e:
+                logging.info(f"Failed to prefetch event '{name}': {e}")
+                return
+
+    def stop(self):
+        """Stops prefetching, waiting for any event being read, so the file can be closed."""
+        with self.lock:
+            self.generation += 1
+        self.pool.shutdown(wait=True, cancel_futures=True)
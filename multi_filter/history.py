@@ -0,0 +1,64 @@
+import numpy as np
+
+class MaskDelta():
+    """The rows that differ between two boolean masks, stored as whichever is smaller: the row numbers or the bit-packed XOR of the
+    masks. Applying a delta to either mask gives the other, so the same delta serves to undo and redo a step."""
+    def __init__(self, before: np.ndarray, after: np.ndarray):
+        changed = before ^ after
+        self.n_rows = len(changed)
+        rows = np.flatnonzero(changed)
+        if rows.nbytes < (self.n_rows + 7)//8:
+            self.rows, self.bits = rows.astype(np.int64 if self.n_rows > np.iinfo(np.int32).max else np.int32), None
+        else:
+            self.rows, self.bits = None, np.packbits(changed)
+
+    def nbytes(self) -> int:
+        return self.rows.nbytes if self.rows is not None else self.bits.nbytes
+
+    def apply(self, mask: np.ndarray) -> np.ndarray:
+        mask = mask.copy()
+        if self.rows is not None:
+            mask[self.rows] ^= True
+        else:
+            mask ^= np.unpackbits(self.bits, count=self.n_rows).astype(bool)
+        return mask
+
+class MaskHistory():
+    """Undo/redo stack for a boolean mask over the rows of a dataframe, e.g. the events kept by multi_filter. Each step only stores
+    the rows it changed (see MaskDelta), so hundreds of steps on millions of rows take little memory. Making a new step after
+    undoing throws away the steps that could have been redone."""
+    def __init__(self, max_steps: int = 1000):
+        self.max_steps = max_steps
+        self.undo_steps = []
+        self.redo_steps = []
+
+    def push(self, before: np.ndarray, after: np.ndarray) -> bool:
+        """Records a step that changed the mask from before to after. Returns False, recording nothing, if the mask didn't change."""
+        if not np.any(before ^ after):
+            return False
+        self.undo_steps.append(MaskDelta(before, after))
+        if len(self.undo_steps) > self.max_steps:
+            self.undo_steps.pop(0)
+        self.redo_steps = []
+        return True
+
+    def can_undo(self) -> bool:
+        return len(self.undo_steps) > 0
+
+    def can_redo(self) -> bool:
+        return len(self.redo_steps) > 0
+
+    def undo(self, mask: np.ndarray) -> np.ndarray:
+        """The mask as it was before the last step, given the mask now."""
+        step = self.undo_steps.pop()
+        self.redo_steps.append(step)
+        return step.apply(mask)
+
+    def redo(self, mask: np.ndarray) -> np.ndarray:
+        """The mask after the last undone step, given the mask now."""
+        step = self.redo_steps.pop()
+        self.undo_steps.append(step)
+        return step.apply(mask)
+
+    def nbytes(self) -> int:
+        return sum(step.nbytes() for step in self.undo_steps + self.redo_steps)
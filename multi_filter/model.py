@@ -1,29 +1,25 @@
 import pandas as pd
 import h5py
 import os
+import sys
 import logging
 import numpy as np
 
+#Appended rather than inserted so that this program's own model and view modules are found before the extractor's
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "extractor"))
+from extractor_utils.features import FeatureStore
+from spatial import PickIndex, GridIndex
+from history import MaskHistory
+from columns import ColumnStore
+from event_cache import EventCache
+from pipeline import FilterPipeline, lasso_selection, line_selection
+
 class BadIndex(Exception):
     pass
 
 def check_path_existence(path: str) -> bool:
     return os.path.exists(path)
 
-def diff_dfs(df1,df2):
-    if df1 is None:
-        return df2
-    elif df2 is None:
-        return df1
-    return pd.concat([df1,df2]).drop_duplicates(keep=False)
-
-def union_dfs(df1,df2):
-    if df1 is None:
-        return df2
-    elif df2 is None:
-        return df1
-    return pd.concat([df1,df2]).drop_duplicates(keep='first')
-
 def remove_bad_values(array: np.ndarray) -> np.ndarray:
     return array[np.isfinite(array)]
 
@@ -36,25 +32,6 @@ def get_line(point1: 'Point', point2: 'Point') -> tuple[float, float]:
     intercept = point1.y - point1.x * grad
     return (grad, intercept)
 
-def get_distance(pt1: 'Point', pt2: 'Point') -> float:
-    return np.sqrt((pt2.x-pt1.x)**2 + (pt2.y-pt1.y)**2)
-
-def get_nearest(df: pd.DataFrame, params: tuple[str,str], pt: 'Point') -> pd.DataFrame:
-    for i, row in enumerate(df.iterrows()):
-        rowPt = Point(float(row[1][params[0]]), float(row[1][params[1]]))
-        dist = get_distance(pt, rowPt)
-
-        if i == 0:
-            closest = i
-            closest_dist = dist
-            continue
-
-        if dist < closest_dist:
-            closest = i
-            closest_dist = dist
-    
-    return df.iloc[closest,:]
-
 def straight_line(x, b, a):
     return b*x + a
 
@@ -71,73 +48,224 @@ class Point():
         self.y = y
 
 class Model():
-    df: pd.DataFrame | None = None
-    selection: pd.DataFrame | None = None
-    current: pd.DataFrame | None = None
+    """Holds the loaded dataframe unchanged as frame, with the events still in the dataset, the selected events and the clicked
+    event kept as boolean masks over its rows (current is a row number), so filtering never copies the frame."""
+    frame: pd.DataFrame | None = None
+    columns: ColumnStore | None = None
+    kept: np.ndarray | None = None
+    selected: np.ndarray | None = None
+    selection_spec: dict | None = None
+    current: int | None = None
     data: h5py.File | None = None
+    events: EventCache | None = None
+    features: FeatureStore | None = None
+    pick_index: PickIndex | None = None
+    pick_key: tuple | None = None
+    pick_rows: np.ndarray | None = None
+    grid_index: GridIndex | None = None
+    grid_key: tuple | None = None
     name_column_index: int | None = None
     def __init__(self):
         self.point1 = Point()
         self.point2 = Point()
         self.region_point = Point()
+        self.kept_version = 0 #Bumped whenever the kept events change, so indexes over them are rebuilt
+        self.history = MaskHistory()
+        self.pipeline = FilterPipeline()
 
     def open_hdf5(self, file_name: str):
         self.data = h5py.File(file_name, 'r')
+        self.events = EventCache(self.data)
+        try:
+            self.features = FeatureStore(file_name)
+        except (ValueError, KeyError) as e:
+            logging.info(f"Event features can't be computed for this file: {e}")
+            self.features = None
 
     def open_df(self, file_name: str):
-        self.df = pd.read_pickle(file_name)
+        self.frame = pd.read_pickle(file_name)
+        self.columns = ColumnStore(self.frame)
+        self.kept = np.ones(len(self.frame), dtype=bool)
+        self.selected = np.zeros(len(self.frame), dtype=bool)
+        self.current = None
+        self.history = MaskHistory()
+        self.pipeline = FilterPipeline()
 
     def get_sample_rate(self) -> int:
         return self.data['current_data'].attrs['sample_rate']
     
+    def close(self):
+        if self.events is not None:
+            self.events.stop()
+        if self.data is not None:
+            self.data.close()
+
     def get_event_data(self, name: str) -> np.ndarray:
-        return self.data['current_data'][name][:]
+        """Data of the named event, from the event cache if it's been read before. Read-only, as the cache shares it."""
+        return self.events.get(name)
     
     def get_df_cols(self, exclude: int | None = None) -> list[str]:
         if exclude is None:
-            return list(self.df.columns)
+            return list(self.frame.columns)
         else:
-            return list(self.df.iloc[:,:exclude].columns) + list(self.df.iloc[:,(exclude + 1):].columns)
-        
-    def choose_event(self, click_loc: Point, params: tuple[str,str], tol = 0.02) -> dict | None:
-            #Condition data by removing non-finite values
-            x_data = np.array(self.df[params[0]])
-            x_data_wo_bad_values = remove_bad_values(x_data)
-            y_data = np.array(self.df[params[1]])
-            y_data_wo_bad_values = remove_bad_values(y_data)
-
-            #Work out range of values eligible for shortlist
-            full_param_ranges = (np.ptp(x_data_wo_bad_values), np.ptp(y_data_wo_bad_values))
-            param_ranges = ((click_loc.x - tol*full_param_ranges[0], click_loc.x + tol*full_param_ranges[0]),
-                            (click_loc.y - tol*full_param_ranges[1], click_loc.y + tol*full_param_ranges[1]))
-            
-            #First deal with nans
-            dfInfToNan = self.df.replace([np.inf, -np.inf], np.nan, inplace=False).infer_objects(copy=False)
-            conditionedDf = dfInfToNan.dropna(subset = [params[0],params[1]], how = 'all')
-
-            #Then select shortlist
-            subDf1 = conditionedDf.query(f"`{params[0]}` > {param_ranges[0][0]} & `{params[0]}` < {param_ranges[0][1]}")
-            subDf2 = subDf1.query(f"`{params[1]}` > {param_ranges[1][0]} & `{params[1]}` < {param_ranges[1][1]}")
-
-            if len(subDf2) == 0:
-                return None
-            
-            event_props = get_nearest(subDf2, params, click_loc)
-            return event_props
-    def get_sub_df(self, click_loc: Point, params: tuple[str,str], line_vars = tuple[float,float]):
-
-        #First deal with nans
-        dfInfToNan = self.df.replace([np.inf, -np.inf], np.nan, inplace=False)
-        conditionedDf = dfInfToNan.dropna(subset = [params[0],params[1]], how = 'all')
+            return list(self.frame.iloc[:,:exclude].columns) + list(self.frame.iloc[:,(exclude + 1):].columns)
 
-        if isbelow(click_loc, line_vars):
-            subDf = conditionedDf.query(f"{params[1]} < ({params[0]}*{line_vars[0]} + {line_vars[1]})")
-            logging.info("Returning sub-df for points below split line.")
-            return subDf
-        else:
-            subDf = conditionedDf.query(f"{params[1]} > ({params[0]}*{line_vars[0]} + {line_vars[1]})")
-            logging.info("Returning sub-df for points below split line.")
-            return subDf
-        
+    def get_feature_cols(self) -> list[str]:
+        """Registered event features that aren't in the dataframe but can be computed from the events on demand."""
+        if self.features is None:
+            return []
+        return [name for name in self.features.registry.features if name not in self.frame.columns]
+
+    def ensure_columns(self, params: tuple[str,str]):
+        """Adds any of params that are registered features missing from the dataframe to the column store, computing them (or
+        reading them from the feature cache next to the HDF5 file) for every event and matching them to rows by the name column.
+        The dataframe itself is left as loaded, so saved subsets have its columns only, like those saved by pipeline.py."""
+        missing = [param for param in params if param not in self.columns and param in self.get_feature_cols()]
+        if len(missing) == 0:
+            return
+        name_column = self.frame.columns[self.name_column_index]
+        values = self.features.get(missing)
+        for param in missing:
+            self.columns.add(param, self.frame[name_column].map(pd.Series(values[param], index=self.features.names)))
+            logging.info(f"Added feature '{param}' to the column store.")
+
+    def values(self, param: str) -> np.ndarray:
+        """Values of a column for every row of the frame, whether kept or not, as floats. Numeric columns come from the column
+        store without copying, so mustn't be changed."""
+        if param in self.columns:
+            return self.columns.get(param)
+        return self.frame[param].to_numpy(dtype=float)
+
+    def kept_values(self, param: str) -> np.ndarray:
+        return self.values(param)[self.kept]
+
+    def kept_range(self, param: str) -> tuple[float, float] | None:
+        """Minimum and maximum finite value of a column over the kept rows, or None if there aren't any."""
+        if param in self.columns:
+            return self.columns.kept_range(param, self.kept)
+        values = remove_bad_values(self.kept_values(param))
+        return (float(values.min()), float(values.max())) if len(values) > 0 else None
+
+    def n_kept(self) -> int:
+        return int(np.count_nonzero(self.kept))
+
+    def kept_df(self) -> pd.DataFrame:
+        return self.frame[self.kept]
 
+    def get_row(self, row: int) -> pd.Series:
+        return self.frame.iloc[row]
 
+    def has_selection(self) -> bool:
+        return bool(np.any(self.selected)) or self.current is not None
+
+    def full_selection(self) -> np.ndarray:
+        """The selected events plus the clicked one, if any."""
+        selection = self.selected & self.kept
+        if self.current is not None:
+            selection[self.current] = True
+        return selection
+
+    def select(self, mask: np.ndarray, spec: dict | None = None):
+        """Makes the kept events in mask the selection. spec describes how it was made (see pipeline.py) for the filter pipeline."""
+        self.selected = mask & self.kept
+        self.selection_spec = spec
+
+    def select_lasso(self, verts, params: tuple[str,str]):
+        self.select(self.get_lasso_mask(verts, params), lasso_selection(params, verts))
+
+    def select_split(self, click_loc: Point, params: tuple[str,str], line_vars: tuple[float,float]):
+        """Selects the kept events on the same side of the split line as the click."""
+        self.select(self.get_sub_mask(click_loc, params, line_vars), line_selection(params, line_vars, above=not isbelow(click_loc, line_vars)))
+
+    def clear_selection(self):
+        self.selected = np.zeros(len(self.frame), dtype=bool)
+        self.selection_spec = None
+        self.current = None
+
+    def remove_selected(self):
+        """Removes the selected events (and the clicked one) from the dataset."""
+        self._set_kept(self.kept & ~self.full_selection(), action="delete")
+
+    def keep_selected(self):
+        """Removes every event except the selected ones (and the clicked one) from the dataset. Does nothing if nothing is selected."""
+        if not self.has_selection():
+            logging.info("Nothing selected to keep.")
+            return
+        self._set_kept(self.full_selection(), action="keep")
+
+    def _set_kept(self, kept: np.ndarray, action: str | None = None):
+        """Changes the kept events and clears the selection. action is the delete or keep that made the change, which is recorded in
+        the undo history and the filter pipeline if anything changed; undo and redo don't give one."""
+        if action is not None and self.history.push(self.kept, kept):
+            name_column = self.frame.columns[self.name_column_index]
+            self.pipeline.name_column = name_column
+            clicked = [self.frame[name_column].iloc[self.current]] if self.current is not None else []
+            self.pipeline.add(action, self.selection_spec, clicked)
+        self.columns.update_kept(self.kept, kept)
+        self.kept = kept
+        self.kept_version += 1
+        self.clear_selection()
+
+    def undo(self) -> bool:
+        """Puts back the events removed by the last delete or keep. Returns False if there is nothing to undo."""
+        if not self.history.can_undo():
+            return False
+        self._set_kept(self.history.undo(self.kept))
+        self.pipeline.undo()
+        return True
+
+    def redo(self) -> bool:
+        """Repeats the last undone delete or keep. Returns False if there is nothing to redo."""
+        if not self.history.can_redo():
+            return False
+        self._set_kept(self.history.redo(self.kept))
+        self.pipeline.redo()
+        return True
+
+    def _pick_index(self, params: tuple[str,str]) -> PickIndex:
+        """KD-tree over the kept points in the scatter plot of params (see PickIndex), built the first time a pair of parameters
+        is clicked on and again whenever events are removed. pick_rows maps its positions to rows."""
+        key = (params, self.kept_version)
+        if self.pick_index is None or self.pick_key != key:
+            self.pick_index = PickIndex(self.kept_values(params[0]), self.kept_values(params[1]))
+            self.pick_rows = np.flatnonzero(self.kept)
+            self.pick_key = key
+        return self.pick_index
+
+    def choose_event(self, click_loc: Point, params: tuple[str,str], tol = 0.02) -> int | None:
+        """Row number of the kept event nearest the click in the scatter plot of params, or None if there isn't one within tol of
+        the plot ranges."""
+        position = self._pick_index(params).nearest(click_loc.x, click_loc.y, tol)
+        if position is None:
+            return None
+        return int(self.pick_rows[position])
+
+    def prefetch_neighbours(self, row: int, params: tuple[str,str], k: int = 20):
+        """Starts reading the k kept events nearest row in the scatter plot of params into the event cache in the background, as
+        they're the most likely to be clicked next."""
+        pick_index = self._pick_index(params)
+        position = np.searchsorted(self.pick_rows, row)
+        if position >= len(self.pick_rows) or self.pick_rows[position] != row:
+            return
+        rows = self.pick_rows[pick_index.neighbours(position, k)]
+        names = self.frame.iloc[:, self.name_column_index].to_numpy()[rows]
+        self.events.prefetch(names.tolist())
+
+    def _grid(self, params: tuple[str,str]) -> GridIndex:
+        """Grid over every row in the scatter plot of params (see GridIndex), built the first time a pair is selected from."""
+        if self.grid_index is None or self.grid_key != params:
+            self.grid_index = GridIndex(self.values(params[0]), self.values(params[1]))
+            self.grid_key = params
+        return self.grid_index
+
+    def get_lasso_mask(self, verts, params: tuple[str,str]) -> np.ndarray:
+        """Mask of the kept events inside the lasso verts in the scatter plot of params."""
+        return self.kept & self._grid(params).in_polygon(verts)
+
+    def get_sub_mask(self, click_loc: Point, params: tuple[str,str], line_vars = tuple[float,float]) -> np.ndarray:
+        """Mask of the kept events on the same side of the split line as the click. Events with a non-finite value aren't on either side."""
+        if isbelow(click_loc, line_vars):
+            logging.info("Returning events below split line.")
+            return self.kept & self._grid(params).on_side(line_vars, above=False)
+        logging.info("Returning events above split line.")
+        return self.kept & self._grid(params).on_side(line_vars, above=True)
@@ -0,0 +1,169 @@
+"""
+Filter pipelines record the deletes and keeps made in multi_filter as a list of steps that can be saved to a JSON file and applied
+again, without the GUI, to any number of props.pkl files, e.g. to repeat the same cleanup on every run of an experiment. Each
+step is a delete or keep of a selection, which is a lasso (polygon vertices) or the side of a split line (gradient and intercept)
+in the scatter plot of a pair of parameters, plus any events clicked on, which are matched by name. Run this file to apply a saved
+pipeline to props files, which are filtered in parallel:
+
+    python pipeline.py cleanup.json run1/props.pkl run2/props.pkl --suffix _filtered
+
+Parameters that are registered event features but missing from a props file are worked out from the EVENTS.hdf5 file next to it.
+A keep step whose selection matches none of a file's events is skipped, with a warning, as keeping nothing is in the GUI.
+"""
+
+import os
+import sys
+import json
+import logging
+import argparse
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "extractor"))
+from extractor_utils.features import FeatureStore
+from spatial import GridIndex
+
+PIPELINE_VERSION = 1
+
+def lasso_selection(params: tuple[str,str], verts) -> dict:
+    return {"params": list(params), "lasso": np.asarray(verts, dtype=float).tolist()}
+
+def line_selection(params: tuple[str,str], line_vars: tuple[float,float], above: bool) -> dict:
+    return {"params": list(params), "line": [float(line_vars[0]), float(line_vars[1])], "side": "above" if above else "below"}
+
+def selection_mask(selection: dict, x_data: np.ndarray, y_data: np.ndarray) -> np.ndarray:
+    """Mask of the rows with values x_data, y_data in a lasso or line selection. Rows with a non-finite value are never selected."""
+    if "lasso" in selection:
+        return GridIndex(x_data, y_data).in_polygon(selection["lasso"])
+    grad, intercept = selection["line"]
+    finite = np.isfinite(x_data) & np.isfinite(y_data)
+    with np.errstate(invalid='ignore'):
+        if selection["side"] == "above":
+            return finite & (y_data > x_data*grad + intercept)
+        return finite & (y_data < x_data*grad + intercept)
+
+class FilterPipeline():
+    """The delete and keep steps of a multi_filter session. A step is {"action": "delete" or "keep", "selection": a lasso or line
+    selection or None, "events": names of events clicked on}. Undone steps are moved to redo_steps so the pipeline always matches
+    the events kept in the GUI."""
+    def __init__(self, name_column: str | None = None, steps: list[dict] | None = None):
+        self.name_column = name_column
+        self.steps = [] if steps is None else steps
+        self.redo_steps = []
+
+    def add(self, action: str, selection: dict | None, events: list[str]):
+        if action not in ("delete", "keep"):
+            raise ValueError(f"Unknown filter action '{action}', should be 'delete' or 'keep'")
+        self.steps.append({"action": action, "selection": selection, "events": list(events)})
+        self.redo_steps = []
+
+    def undo(self):
+        self.redo_steps.append(self.steps.pop())
+
+    def redo(self):
+        self.steps.append(self.redo_steps.pop())
+
+    def params(self) -> list[str]:
+        """Every parameter a selection is made in."""
+        params = []
+        for step in self.steps:
+            if step["selection"] is not None:
+                params += [param for param in step["selection"]["params"] if param not in params]
+        return params
+
+    def to_dict(self) -> dict:
+        return {"version": PIPELINE_VERSION, "name_column": self.name_column, "steps": self.steps}
+
+    @classmethod
+    def from_dict(cls, spec: dict) -> 'FilterPipeline':
+        if spec.get("version") != PIPELINE_VERSION:
+            raise ValueError(f"Filter pipeline version {spec.get('version')} not supported, should be {PIPELINE_VERSION}")
+        return cls(spec["name_column"], [dict(step) for step in spec["steps"]])
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> 'FilterPipeline':
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
+
+    def apply(self, frame: pd.DataFrame) -> tuple[np.ndarray, list[int]]:
+        """Mask of the rows of frame left after every step, and the indices of the keep steps whose selection matched none of the
+        rows left. As in the GUI, where keeping an empty selection does nothing, those steps are skipped rather than removing every
+        row, with a warning. Each selection is worked out with vectorised masks over the whole frame."""
+        kept = np.ones(len(frame), dtype=bool)
+        skipped = []
+        values = {param: frame[param].to_numpy(dtype=float) for param in self.params()}
+        names = frame[self.name_column] if self.name_column is not None else None
+        for i, step in enumerate(self.steps):
+            selected = np.zeros(len(frame), dtype=bool)
+            if step["selection"] is not None:
+                x_param, y_param = step["selection"]["params"]
+                selected = selection_mask(step["selection"], values[x_param], values[y_param])
+            if len(step["events"]) > 0:
+                if names is None:
+                    raise ValueError("Filter pipeline has clicked events but no name column to match them by")
+                selected |= names.isin(step["events"]).to_numpy()
+            selected &= kept
+            if step["action"] == "delete":
+                kept &= ~selected
+            elif np.any(selected):
+                kept = selected
+            else:
+                params = step["selection"]["params"] if step["selection"] is not None else "clicked events"
+                logging.warning(f"Keep step {i} (in {params}) matched no events, so was skipped rather than removing them all")
+                skipped.append(i)
+        return kept, skipped
+
+def add_missing_features(frame: pd.DataFrame, params: list[str], name_column: str, events_path: str) -> pd.DataFrame:
+    """Adds the parameters missing from frame, working them out as registered features of the events in events_path."""
+    missing = [param for param in params if param not in frame.columns]
+    if len(missing) == 0:
+        return frame
+    if not os.path.exists(events_path):
+        raise ValueError(f"Parameters {missing} aren't in the dataframe and there's no {events_path} to work them out from")
+    store = FeatureStore(events_path)
+    values = store.get(missing)
+    frame = frame.copy()
+    for param in missing:
+        frame[param] = frame[name_column].map(pd.Series(values[param], index=store.names))
+    return frame
+
+def apply_to_file(spec: dict, props_path: str, output_path: str, events_path: str | None = None) -> tuple[int, int, list[int]]:
+    """Filters the dataframe at props_path with a pipeline and saves the kept rows (with its original columns) to output_path.
+    Returns the number of rows before and after and the keep steps skipped as they matched nothing, for running in a worker process."""
+    pipeline = FilterPipeline.from_dict(spec)
+    frame = pd.read_pickle(props_path)
+    if events_path is None:
+        events_path = os.path.join(os.path.dirname(os.path.abspath(props_path)), "EVENTS.hdf5")
+    kept, skipped = pipeline.apply(add_missing_features(frame, pipeline.params(), pipeline.name_column, events_path))
+    frame[kept].to_pickle(output_path)
+    return len(frame), int(np.count_nonzero(kept)), skipped
+
+def apply_to_files(pipeline: FilterPipeline, props_paths: list[str], output_paths: list[str], workers: int | None = None) -> list[tuple[int, int, list[int]]]:
+    """Applies a pipeline to many props files at once, one per worker process."""
+    spec = pipeline.to_dict()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(apply_to_file, [spec]*len(props_paths), props_paths, output_paths))
+
+def output_path(props_path: str, suffix: str) -> str:
+    root, ext = os.path.splitext(props_path)
+    return root + suffix + ext
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Apply a filter pipeline saved from multi_filter to props files.")
+    parser.add_argument("pipeline", help="Path to the saved pipeline (.json)")
+    parser.add_argument("props", nargs="+", help="Dataframes to filter")
+    parser.add_argument("--suffix", default="_filtered", help="Added to each dataframe's name to give where its filtered copy is saved")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    outputs = [output_path(props_path, args.suffix) for props_path in args.props]
+    results = apply_to_files(FilterPipeline.load(args.pipeline), args.props, outputs, args.workers)
+    for props_path, output, (before, after, skipped) in zip(args.props, outputs, results):
+        print(f"{props_path}: kept {after} of {before} events, saved to {output}")
+        if len(skipped) > 0:
+            print(f"  skipped keep steps {skipped} as they matched no events")
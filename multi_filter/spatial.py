@@ -0,0 +1,125 @@
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.ndimage import label
+from matplotlib.path import Path
+
+class PickIndex():
+    """KD-tree over the points of a scatter plot for picking the event nearest a click. Both axes are scaled by the range of their
+    finite values, so 'near' means near on screen whatever the units, and rows with a non-finite value are left out. Build one per
+    pair of plotted parameters and build a new one when points are removed."""
+    def __init__(self, x_data: np.ndarray, y_data: np.ndarray):
+        x_data = np.asarray(x_data, dtype=float)
+        y_data = np.asarray(y_data, dtype=float)
+        finite = np.isfinite(x_data) & np.isfinite(y_data)
+        self.rows = np.flatnonzero(finite)
+        if len(self.rows) == 0:
+            self.tree = None
+            return
+        points = np.column_stack((x_data[finite], y_data[finite]))
+        self.offset = points.min(axis=0)
+        self.scale = np.ptp(points, axis=0)
+        self.scale[self.scale == 0] = 1
+        self.tree = cKDTree((points - self.offset)/self.scale)
+
+    def nearest(self, x: float, y: float, tol: float = 0.02) -> int | None:
+        """Position (row number) of the point nearest (x, y) of those within tol of either axis range of it, or None if there are none."""
+        if self.tree is None or x is None or y is None:
+            return None
+        click = (np.array([x, y]) - self.offset)/self.scale
+        candidates = np.array(self.tree.query_ball_point(click, tol, p=np.inf), dtype=int)
+        candidates = candidates[np.max(np.abs(self.tree.data[candidates] - click), axis=1) < tol]
+        if len(candidates) == 0:
+            return None
+        index = candidates[np.argmin(np.sum((self.tree.data[candidates] - click)**2, axis=1))]
+        return int(self.rows[index])
+
+    def neighbours(self, position: int, k: int) -> np.ndarray:
+        """Positions of the (up to) k points nearest the point at position, not including it."""
+        index = np.searchsorted(self.rows, position)
+        if self.tree is None or index >= len(self.rows) or self.rows[index] != position:
+            return np.zeros(0, dtype=int)
+        _, found = self.tree.query(self.tree.data[index], k=min(k + 1, len(self.rows)))
+        found = np.atleast_1d(found)
+        return self.rows[found[found != index][:k]]
+
+class GridIndex():
+    """Uniform grid over the points of a scatter plot, for selecting the points inside a lasso or on one side of a split line.
+    Cells wholly inside or outside the selection are taken or left as a whole, so the exact test only runs on the points in the
+    cells the lasso or line passes through. Rows with a non-finite value are never selected. The grid covers every row, so unlike
+    PickIndex it doesn't need rebuilding when points are removed; mask the result with the kept rows instead."""
+    def __init__(self, x_data: np.ndarray, y_data: np.ndarray, points_per_cell: int = 16, max_side: int = 512):
+        self.x_data = np.asarray(x_data, dtype=float)
+        self.y_data = np.asarray(y_data, dtype=float)
+        finite = np.isfinite(self.x_data) & np.isfinite(self.y_data)
+        n_finite = np.count_nonzero(finite)
+        side = int(np.clip(np.sqrt(n_finite/points_per_cell), 1, max_side))
+        self.shape = (side, side)
+        if n_finite > 0:
+            self.lows = np.array([self.x_data[finite].min(), self.y_data[finite].min()])
+            spans = np.array([np.ptp(self.x_data[finite]), np.ptp(self.y_data[finite])])
+        else:
+            self.lows, spans = np.zeros(2), np.ones(2)
+        spans[spans == 0] = 1
+        self.cell_size = spans/side
+        #Cell of each row, numbered along rows of the grid from the bottom left. Non-finite rows get an extra cell past the end
+        #that is never selected
+        self.cell = np.full(len(self.x_data), side*side, dtype=np.int64)
+        cols = np.minimum(((self.x_data[finite] - self.lows[0])/self.cell_size[0]).astype(np.int64), side - 1)
+        rows = np.minimum(((self.y_data[finite] - self.lows[1])/self.cell_size[1]).astype(np.int64), side - 1)
+        self.cell[finite] = rows*side + cols
+
+    def _edges(self) -> tuple[np.ndarray, np.ndarray]:
+        return (self.lows[0] + np.arange(self.shape[1] + 1)*self.cell_size[0], self.lows[1] + np.arange(self.shape[0] + 1)*self.cell_size[1])
+
+    def _select(self, inside: np.ndarray, boundary: np.ndarray, exact) -> np.ndarray:
+        """Mask of the rows in inside cells or, for rows in boundary cells, for which exact(x, y) is true."""
+        mask = np.append(inside.ravel(), False)[self.cell]
+        rows = np.flatnonzero(np.append(boundary.ravel(), False)[self.cell])
+        mask[rows] = exact(self.x_data[rows], self.y_data[rows])
+        return mask
+
+    def _crossed_cells(self, verts: np.ndarray) -> np.ndarray:
+        """Cells the closed polygon verts passes through. Each side is stepped along less than a cell at a time, so consecutive
+        steps are in the same or neighbouring cells; where they're in diagonal neighbours, both cells between are included."""
+        points = (np.vstack((verts, verts[:1])) - self.lows)/self.cell_size
+        starts, steps = points[:-1], np.diff(points, axis=0)
+        n_steps = np.ceil(2*np.max(np.abs(steps), axis=1)).astype(np.int64) + 1
+        side_of_step = np.repeat(np.arange(len(steps)), n_steps)
+        fraction = (np.arange(n_steps.sum()) - np.repeat(np.cumsum(n_steps) - n_steps, n_steps))/np.repeat(n_steps, n_steps)
+        samples = np.floor(np.vstack((starts[side_of_step] + fraction[:, None]*steps[side_of_step], points[:1]))).astype(np.int64)
+        cols = np.concatenate((samples[:, 0], samples[1:, 0], samples[:-1, 0]))
+        rows = np.concatenate((samples[:, 1], samples[:-1, 1], samples[1:, 1]))
+        on_grid = (cols >= 0) & (cols < self.shape[1]) & (rows >= 0) & (rows < self.shape[0])
+        crossed = np.zeros(self.shape, dtype=bool)
+        crossed[rows[on_grid], cols[on_grid]] = True
+        return crossed
+
+    def in_polygon(self, verts) -> np.ndarray:
+        """Mask of the rows inside the polygon verts (e.g. a lasso), as matplotlib's Path.contains_points would give."""
+        verts = np.asarray(verts, dtype=float)
+        polygon = Path(verts)
+        boundary = self._crossed_cells(verts)
+        #The polygon doesn't cross the cells between its sides, so each connected patch of them is all inside or all outside
+        #and testing one cell's centre decides the patch
+        patches, n_patches = label(~boundary)
+        firsts = np.unique(patches.ravel(), return_index=True)[1][-n_patches:] if n_patches > 0 else np.zeros(0, dtype=np.int64)
+        centres = self.lows + (np.column_stack(np.unravel_index(firsts, self.shape))[:, ::-1] + 0.5)*self.cell_size
+        inside = np.append(False, polygon.contains_points(centres))[patches]
+        return self._select(inside, boundary, lambda x, y: polygon.contains_points(np.column_stack((x, y))))
+
+    def on_side(self, line_vars: tuple[float,float], above: bool) -> np.ndarray:
+        """Mask of the rows strictly above (or below) the line y = line_vars[0]*x + line_vars[1]."""
+        grad, intercept = line_vars
+        x_edges, y_edges = self._edges()
+        with np.errstate(invalid='ignore'):
+            heights = y_edges[:, None] - (x_edges[None, :]*grad + intercept)
+            corners = np.stack((heights[:-1, :-1], heights[:-1, 1:], heights[1:, :-1], heights[1:, 1:]))
+            #Cells are only taken whole if they're clear of the line by more than rounding error, as rows can sit a hair outside their cell
+            tol = 1e-9*(abs(grad)*self.cell_size[0] + self.cell_size[1])
+            if above:
+                inside = corners.min(axis=0) > tol
+                boundary = ~inside & ~(corners.max(axis=0) < -tol)
+                return self._select(inside, boundary, lambda x, y: y > x*grad + intercept)
+            inside = corners.max(axis=0) < -tol
+            boundary = ~inside & ~(corners.min(axis=0) > tol)
+            return self._select(inside, boundary, lambda x, y: y < x*grad + intercept)
@@ -1,8 +1,10 @@
-from PyQt6.QtWidgets import QMainWindow, QLineEdit, QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QLabel, QFrame, QComboBox, QMessageBox
+from PyQt6.QtWidgets import QMainWindow, QLineEdit, QPushButton, QVBoxLayout, QHBoxLayout, QWidget, QLabel, QFrame, QComboBox, QMessageBox, QCheckBox, QListWidget, QAbstractItemView
 from PyQt6.QtCore import pyqtSignal
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg, NavigationToolbar2QT
 from matplotlib.figure import Figure
+import numpy as np
 from model import Point
+from density import DensityScatter
 
 class MplCanvas(FigureCanvasQTAgg):
     """MPL/QT Canvas with some default characteristics and some axes."""
@@ -52,6 +54,9 @@ class PlotWithToolbar(QWidget):
         self.canvas.draw()
         return artist
 
+    def scatter_panel(self, x_data, y_data, density = True):
+        return ScatterPanel(self.canvas.axes, x_data, y_data, density)
+
     def plot_point(self, point: Point, **kwargs):
         artist = self.canvas.axes.plot(point.x, point.y, **kwargs)
         self.canvas.draw()
@@ -81,6 +86,50 @@ class PlotWithToolbar(QWidget):
     def update(self):
         self.canvas.draw()
 
+    def update_idle(self):
+        self.canvas.draw_idle()
+
+class ScatterPanel():
+    """The artists of a scatter plot of the kept events with the selected ones in red, given the x and y values of every row of
+    the dataframe. Rather than the axes being cleared and everything plotted again, show updates the artists in place for new
+    masks, and only the ones affected. In density mode the blue layer is every kept event, so a new selection only recomputes the
+    red layer on top of it. Otherwise the points are split between a blue and a red PathCollection whose offsets are reset; each
+    keeps a single colour, as per-point colours make matplotlib draw every marker separately, which is far slower."""
+    def __init__(self, axes, x_data, y_data, density = True):
+        self.x_data = np.asarray(x_data, dtype=float)
+        self.y_data = np.asarray(y_data, dtype=float)
+        self.finite = np.isfinite(self.x_data) & np.isfinite(self.y_data)
+        self.density = density
+        self.kept = None
+        self.selected = None
+        if density:
+            self.layer = DensityScatter(axes, np.zeros(0), np.zeros(0), colour='b', zorder=1)
+            self.selection_layer = DensityScatter(axes, np.zeros(0), np.zeros(0), colour='r', zorder=1.5)
+        else:
+            self.layer = axes.scatter([], [], alpha=0.1, c='b', zorder=1)
+            self.selection_layer = axes.scatter([], [], alpha=0.1, c='r', zorder=1.5)
+
+    def _offsets(self, mask):
+        mask = mask & self.finite
+        return np.column_stack((self.x_data[mask], self.y_data[mask]))
+
+    def show(self, kept, selected) -> bool:
+        """Updates the artists for the given masks over the rows of the dataframe. Returns whether the kept points changed."""
+        selected = selected & kept
+        kept_changed = self.kept is None or not np.array_equal(kept, self.kept)
+        selection_changed = kept_changed or not np.array_equal(selected, self.selected)
+        if self.density:
+            if kept_changed:
+                self.layer.set_points(self.x_data[kept], self.y_data[kept])
+            if selection_changed:
+                self.selection_layer.set_points(self.x_data[selected], self.y_data[selected])
+        elif selection_changed:
+            self.layer.set_offsets(self._offsets(kept & ~selected))
+            self.selection_layer.set_offsets(self._offsets(selected))
+        self.kept = kept.copy()
+        self.selected = selected
+        return kept_changed
+
 class HSeparator(QFrame):
     """Horizontal line separator"""
     def __init__(self):
@@ -171,9 +220,16 @@ class MainWindow(QMainWindow):
         self.lassoButton = QPushButton("Select Points with Lasso")
         self.deletePoints = QPushButton("Delete Selected Points (D)")
         self.keepPoints = QPushButton("Keep Only Selected Points (K)")
+        self.undoButton = QPushButton("Undo (Z)")
+        self.redoButton = QPushButton("Redo (Y)")
         self.resetAllButton = QPushButton("Reset Selection")
         self.saveSelectionButton = QPushButton("Save Subset to Dataframe (S)")
+        self.saveFilterButton = QPushButton("Save Filter Steps")
+        self.matrixButton = QPushButton("Scatter Matrix")
         self.updatePlotButton = QPushButton("Update Plot")
+        #Checkboxes
+        self.densityBox = QCheckBox("Density Plot")
+        self.densityBox.setChecked(True)
         #Labels
         xLabel = QLabel("x-Axis Parameter")
         yLabel = QLabel("y-Axis Parameter")
@@ -185,19 +241,79 @@ class MainWindow(QMainWindow):
         self.controlsLayout.addWidget(self.xBox)
         self.controlsLayout.addWidget(yLabel)
         self.controlsLayout.addWidget(self.yBox)
+        self.controlsLayout.addWidget(self.densityBox)
         self.controlsLayout.addWidget(self.updatePlotButton)
+        self.controlsLayout.addWidget(self.matrixButton)
         self.controlsLayout.addWidget(VSeparator())
         self.controlsLayout.addWidget(self.splitLineButton)
         self.controlsLayout.addWidget(self.lassoButton)
         self.controlsLayout.addWidget(VSeparator())
         self.controlsLayout.addWidget(self.deletePoints)
         self.controlsLayout.addWidget(self.keepPoints)
+        self.controlsLayout.addWidget(self.undoButton)
+        self.controlsLayout.addWidget(self.redoButton)
         self.controlsLayout.addWidget(VSeparator())
         self.controlsLayout.addWidget(self.resetAllButton)
         self.controlsLayout.addWidget(self.saveSelectionButton)
+        self.controlsLayout.addWidget(self.saveFilterButton)
 
         self.mainLayout.addLayout(self.controlsLayout)
 
+class ScatterMatrixWindow(QWidget):
+    """Separate window of small scatter plots, one for each pair of the parameters chosen from the list on its left."""
+    closed = pyqtSignal()
+    def __init__(self, params: list[str]):
+        super().__init__()
+        self.setWindowTitle("Scatter Matrix")
+        self.wLayout = QHBoxLayout()
+        self.controlsLayout = QVBoxLayout()
+        self.plotLayout = QVBoxLayout()
+        #Parameter list
+        self.paramList = QListWidget()
+        self.paramList.setSelectionMode(QAbstractItemView.SelectionMode.MultiSelection)
+        self.paramList.addItems(params)
+        self.plotButton = QPushButton("Plot Pairs")
+        #Canvas
+        self.canvas = FigureCanvasQTAgg(Figure(figsize=(8, 8), dpi=100, layout='constrained'))
+        self.toolbar = NavigationToolbar2QT(self.canvas, self)
+        #Layout
+        self.controlsLayout.addWidget(QLabel("Parameters (2 to 5)"))
+        self.controlsLayout.addWidget(self.paramList)
+        self.controlsLayout.addWidget(self.plotButton)
+        self.plotLayout.addWidget(self.canvas)
+        self.plotLayout.addWidget(self.toolbar)
+        self.wLayout.addLayout(self.controlsLayout)
+        self.wLayout.addLayout(self.plotLayout, stretch=1)
+        self.setLayout(self.wLayout)
+
+        self.show()
+
+    def closeEvent(self, event):
+        self.closed.emit()
+        super().closeEvent(event)
+
+    def chosen_params(self) -> list[str]:
+        return [item.text() for item in self.paramList.selectedItems()]
+
+    def set_pairs(self, pairs: list[tuple[str,str]]) -> list:
+        """Clears the figure and makes a labelled axes for each pair, returning them in the same order."""
+        figure = self.canvas.figure
+        figure.clear()
+        n_cols = int(np.ceil(np.sqrt(len(pairs))))
+        n_rows = int(np.ceil(len(pairs)/n_cols)) if len(pairs) > 0 else 0
+        axes = []
+        for i, (x_param, y_param) in enumerate(pairs):
+            ax = figure.add_subplot(n_rows, n_cols, i + 1)
+            ax.autoscale(False)
+            ax.set_xlabel(x_param, fontsize='small')
+            ax.set_ylabel(y_param, fontsize='small')
+            ax.tick_params(labelsize='small')
+            axes.append(ax)
+        return axes
+
+    def update(self):
+        self.canvas.draw_idle()
+
 class ErrorDialog(QMessageBox):
     def __init__(self, msg: str):
         super().__init__()
@@ -0,0 +1,121 @@
+"""
+Use this script to benchmark the extractor pipeline on synthetic data (see synthetic_trace.py), or on an existing directory of TDMS files.
+Every file is put through the same stages as in the extractor GUI with every event accepted: reading with TdmsDir, baseline fitting,
+detection, feature generation and writing to HDF5. Samples per second are reported for each stage, and events per second for feature
+generation. If the directory has a ground_truth.pkl the detected events are also scored against it.
+"""
+
+import os
+import sys
+import logging
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "extractor"))
+from model import Model, EventError, ReachedEnd
+from synthetic_trace import generate_dir
+
+def score_events(found: pd.DataFrame, truth: pd.DataFrame) -> dict:
+    """Matches detected events to true events in the same file by overlap and summarises recall, precision and boundary errors."""
+    matched_true = 0
+    matched_found = 0
+    start_errors = []
+    end_errors = []
+    for fname, true_events in truth.groupby("file"):
+        found_events = found[found["file"] == fname]
+        if len(found_events) == 0:
+            continue
+        f_starts = found_events["start"].to_numpy()
+        f_ends = found_events["end"].to_numpy()
+        used = np.zeros(len(found_events), dtype=bool)
+        for start, end in zip(true_events["start"], true_events["end"]):
+            overlaps = np.flatnonzero((f_starts <= end) & (f_ends >= start))
+            if len(overlaps) == 0:
+                continue
+            matched_true += 1
+            used[overlaps] = True
+            start_errors.append(f_starts[overlaps[0]] - start)
+            end_errors.append(f_ends[overlaps[-1]] - end)
+        matched_found += np.count_nonzero(used)
+    return {"true_events": len(truth), "found_events": len(found),
+            "recall": matched_true/len(truth) if len(truth) > 0 else np.nan,
+            "precision": matched_found/len(found) if len(found) > 0 else np.nan,
+            "median_start_error_samples": np.median(start_errors) if len(start_errors) > 0 else np.nan,
+            "median_end_error_samples": np.median(end_errors) if len(end_errors) > 0 else np.nan}
+
+def run_benchmark(dir_path: str, settings: dict, output_path: str) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Runs every file in dir_path through the pipeline, returning per-stage throughput and the detected events."""
+    found = []
+    events = 0
+    model = Model()
+    model.open_tdms_dir(dir_path)
+    model.make_output_file(output_path)
+    model.add_group('current_data', attrs = {"sample_rate": settings["sample_rate"], "event_berth": settings["event_berth"]})
+    while True:
+        try:
+            model.next_file()
+        except ReachedEnd:
+            break
+        try:
+            model.slope_fix_average_run_method(0)
+        except:
+            logging.info(f"Baseline fit failed on {model.tdms.get_file_name()}, skipping.")
+            continue
+        model.filter_corrected_data(settings["filter_type"], settings["filter_cutoff"], settings["sample_rate"])
+        model.update_event_boundaries(settings["event_thresh"], settings["gap_tol"], settings["detector"], settings["detector_window"], settings["detector_k"])
+        fname = os.path.basename(model.tdms.get_file_name())
+        found += [{"file": fname, "start": left, "end": right} for left, right in model.event_boundaries]
+        while True:
+            try:
+                model.next_event(settings["event_berth"])
+            except EventError:
+                break
+            events += 1
+            ename = f"Event_No_{events}"
+            model.add_to_df(model.gen_event_attrs(ename, settings["event_berth"], settings["sample_rate"]))
+            model.create_dataset('current_data', ename, model.event_data)
+    model.output.close()
+    totals = model.timer.totals()
+    samples = totals["read"][1]
+    #Only the features stage handles events one at a time, so events per second is only reported for it
+    rows = [{"stage": stage, "time_s": elapsed,
+             "samples_per_s": samples/elapsed if elapsed > 0 else np.nan,
+             "events_per_s": events/elapsed if stage == "features" and elapsed > 0 else np.nan} for stage, (elapsed, _, _) in totals.items()]
+    total_time = sum(elapsed for elapsed, _, _ in totals.values())
+    rows.append({"stage": "total", "time_s": total_time, "samples_per_s": samples/total_time if total_time > 0 else np.nan, "events_per_s": np.nan})
+    return pd.DataFrame(rows), pd.DataFrame(found, columns=["file", "start", "end"])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the extractor stages on synthetic or real TDMS data.")
+    parser.add_argument("--dir", default=None, help="Directory of TDMS files; a synthetic one is generated if not given")
+    parser.add_argument("--files", type=int, default=5, help="Number of synthetic files")
+    parser.add_argument("--samples", type=int, default=2000000, help="Samples per synthetic file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sample-rate", type=int, default=1000000)
+    parser.add_argument("--event-thresh", type=float, default=-0.05)
+    parser.add_argument("--event-berth", type=int, default=500)
+    parser.add_argument("--gap-tol", type=int, default=1000)
+    parser.add_argument("--filter-type", default="none")
+    parser.add_argument("--filter-cutoff", type=float, default=100000)
+    parser.add_argument("--detector", default="threshold")
+    parser.add_argument("--detector-window", type=int, default=100000)
+    parser.add_argument("--detector-k", type=float, default=5.0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    settings = {"sample_rate": args.sample_rate, "event_thresh": args.event_thresh, "event_berth": args.event_berth, "gap_tol": args.gap_tol,
+                "filter_type": args.filter_type, "filter_cutoff": args.filter_cutoff, "detector": args.detector,
+                "detector_window": args.detector_window, "detector_k": args.detector_k}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dir_path = args.dir
+        if dir_path is None:
+            dir_path = os.path.join(tmp, "synthetic")
+            generate_dir(dir_path, args.files, args.samples, args.sample_rate, args.seed)
+        throughput, found = run_benchmark(dir_path, settings, os.path.join(tmp, "EVENTS.hdf5"))
+        print(throughput.to_string(index=False))
+        truth_path = os.path.join(dir_path, "ground_truth.pkl")
+        if os.path.exists(truth_path):
+            for key, value in score_events(found, pd.read_pickle(truth_path)).items():
+                print(f"{key}: {value}")
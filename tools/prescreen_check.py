@@ -0,0 +1,58 @@
+"""
+Use this script to check that the prescreen (see prescreen_trace in extractor/extractor_utils/detectors.py) skips files without events
+at the default settings. Synthetic traces without any events (see synthetic_trace.py) are run through the extractor twice with the
+settings from cfg.txt, once with the prescreen and once without it, and the files the full baseline fit and detection find empty are
+compared with those the prescreen skips. The noise defaults to 0.008 nA, a little under synthetic_trace's default: at 0.01 nA the
+default threshold of -0.05 nA is only 5 times the noise, and the full detection finds noise spikes below it in most two second traces
+even though they have no events. The prescreen must not skip those, so there would be almost nothing to check.
+
+    python prescreen_check.py [--files N] [--samples N] [--noise NOISE] [name=value ...]
+
+Exits with status 1 if the prescreen skips a file the full detection finds events in, or if it skips none of the empty files.
+"""
+
+import os
+import sys
+import argparse
+import logging
+import tempfile
+from glob import glob
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "extractor"))
+from model import Model, TdmsDir, PRESCREEN_REASON
+from extractor_utils.util_funcs import default_settings, parse_setting
+from synthetic_trace import generate_dir
+
+def check_file(path: str, settings: dict) -> tuple[bool, bool]:
+    """Whether the prescreen skips a file, and whether the full pipeline finds no events in it."""
+    model = Model()
+    model.tdms = TdmsDir(os.path.dirname(path), [path])
+    model.next_file()
+    skipped = model.process_current_file(settings) == PRESCREEN_REASON
+    empty = model.process_current_file({**settings, "prescreen_margin": 0}) == "no events found"
+    return skipped, empty
+
+def run_check(dir_path: str, settings: dict) -> dict:
+    results = [check_file(path, settings) for path in sorted(glob(os.path.join(dir_path, "*.tdms")))]
+    return {"files": len(results), "empty": sum(empty for _, empty in results), "skipped": sum(skipped and empty for skipped, empty in results),
+            "skipped_with_events": sum(skipped and not empty for skipped, empty in results)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the prescreen skips files without events at the default settings.")
+    parser.add_argument("settings", nargs="*", help="Settings overriding cfg.txt as name=value")
+    parser.add_argument("--files", type=int, default=20, help="Number of synthetic files")
+    parser.add_argument("--samples", type=int, default=2000000, help="Samples per synthetic file")
+    parser.add_argument("--noise", type=float, default=0.008, help="RMS white noise /nA")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    settings = default_settings()
+    settings.update({name: parse_setting(val) for name, val in (arg.split("=") for arg in args.settings)})
+
+    with tempfile.TemporaryDirectory() as tmp:
+        generate_dir(tmp, args.files, args.samples, float(settings["sample_rate"]), args.seed, noise=args.noise, event_rate=0)
+        result = run_check(tmp, settings)
+    print(f"{result['files']} files without events, at threshold {settings['event_thresh']} nA and noise {args.noise} nA:")
+    print(f"  full detection finds no events in {result['empty']}, the prescreen skips {result['skipped']} of them")
+    print(f"  the prescreen skips {result['skipped_with_events']} files the full detection finds events in")
+    sys.exit(1 if result["skipped_with_events"] > 0 or (result["empty"] > 0 and result["skipped"] == 0) else 0)
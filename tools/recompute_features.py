@@ -0,0 +1,74 @@
+"""
+Use this script to recompute event features from an existing EVENTS.hdf5, e.g. after adding or fixing a feature in the registry in
+extractor/extractor_utils/features.py, without re-extracting from the TDMS files. Events are read in batches by a pool of worker
+processes. The results are merged into props.pkl by the name column: recomputed columns are replaced, new ones added and every
+other column (e.g. event_timestamp_s, which needs the raw file) is kept. If there is no props.pkl, one is made from every event.
+Only the events named in an existing props.pkl are recomputed, so a filtered dataframe stays filtered.
+"""
+
+import os
+import sys
+import argparse
+import pandas as pd
+import h5py as h
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "extractor"))
+from extractor_utils.features import REGISTRY, EventBatch, crop_event
+
+def event_names(events_path: str) -> list[str]:
+    with h.File(events_path, 'r') as f:
+        return list(f["current_data"].keys())
+
+def compute_batch(events_path: str, names: list[str], berth: int, sample_rate: float, features: list[str]) -> list[dict]:
+    """Reads one batch of events and works out their features all at once, for running in a worker process."""
+    with h.File(events_path, 'r') as f:
+        group = f["current_data"]
+        batch = EventBatch([crop_event(group[name][:], berth) for name in names])
+    values = REGISTRY.compute(batch, features, sample_rate)
+    return [{"name": name, **{feature: values[feature][i] for feature in features}} for i, name in enumerate(names)]
+
+def recompute_features(events_path: str, props_path: str | None = None, features: list[str] | None = None, berth: int | None = None,
+                       workers: int | None = None, batch_size: int = 500) -> pd.DataFrame:
+    """Recomputes the given registry features (the ones the extractor saves by default) for the events in events_path and merges them into the dataframe
+    at props_path if it exists, returning the result. berth is read from the file unless given."""
+    features = REGISTRY.defaults() if features is None else features
+    unknown = set(features) - set(REGISTRY.features)
+    if len(unknown) > 0:
+        raise ValueError(f"Unknown features {unknown}, should be from {list(REGISTRY.features)}")
+    with h.File(events_path, 'r') as f:
+        attrs = f["current_data"].attrs
+        sample_rate = float(attrs["sample_rate"])
+        if berth is None:
+            if "event_berth" not in attrs:
+                raise ValueError(f"{events_path} doesn't record the event berth, give it with --berth")
+            berth = int(attrs["event_berth"])
+    props = pd.read_pickle(props_path) if props_path is not None and os.path.exists(props_path) else None
+    names = event_names(events_path) if props is None else list(props["name"])
+    batches = [names[i:i + batch_size] for i in range(0, len(names), batch_size)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(compute_batch, [events_path]*len(batches), batches, [berth]*len(batches), [sample_rate]*len(batches), [features]*len(batches))
+        new = pd.DataFrame([row for rows in results for row in rows], columns=["name", *features])
+    if props is None:
+        return new
+    props = props.copy()
+    new = new.set_index("name").loc[props["name"]]
+    for feature in features:
+        props[feature] = new[feature].to_numpy()
+    return props
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute event features from an EVENTS.hdf5 file and update its props.pkl.")
+    parser.add_argument("events", help="Path to EVENTS.hdf5")
+    parser.add_argument("--props", default=None, help="Dataframe to update, defaults to props.pkl next to the events file")
+    parser.add_argument("--output", default=None, help="Where to save the result, defaults to overwriting the dataframe")
+    parser.add_argument("--features", nargs="*", default=None, help=f"Features to recompute, from {list(REGISTRY.features)}; the extractor's by default")
+    parser.add_argument("--berth", type=int, default=None, help="Event berth, for files that don't record it")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=500, help="Events read by a worker at a time")
+    args = parser.parse_args()
+    props_path = args.props if args.props is not None else os.path.join(os.path.dirname(os.path.abspath(args.events)), "props.pkl")
+    df = recompute_features(args.events, props_path, args.features, args.berth, args.workers, args.batch_size)
+    output = args.output if args.output is not None else props_path
+    df.to_pickle(output)
+    print(f"Saved {len(df)} events with {len(args.features) if args.features is not None else len(REGISTRY.defaults())} features recomputed to {output}")
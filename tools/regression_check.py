@@ -0,0 +1,235 @@
+"""
+Use this script to check that a change to the extractor (e.g. speeding up hist_bin, get_persistent_homology or update_event_boundaries)
+doesn't change what it extracts, and to measure whether it is faster. A fixed set of synthetic traces (see synthetic_trace.py), plus any
+real TDMS directories given, is run through the extraction of a reference and a candidate copy of the extractor, and the event
+boundaries, event attributes and baseline and noise of every file are compared within tolerances. Stage timings are recorded as well.
+
+A reference copy of the extractor can be made from any commit with git, e.g. 'git worktree add ../reference HEAD', and then:
+
+    python regression_check.py check ../reference/extractor ../extractor [--traces DIR ...] [--repeats N]
+
+Each side can also be run on its own to keep its results, and results compared later:
+
+    python regression_check.py run <extractor dir> <results.hdf5> [--traces DIR ...]
+    python regression_check.py compare <reference.hdf5> <candidate.hdf5>
+
+compare and check exit with status 1 if anything differs.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+import pandas as pd
+import h5py as h
+from glob import glob
+
+#Settings used by both sides; real traces will usually need sample_rate and event_thresh overriding with name=value arguments
+HARNESS_SETTINGS = {"sample_rate": 1000000, "event_thresh": -0.05, "event_berth": 500, "gap_tol": 1000, "filter_type": "none",
+                    "filter_cutoff": 100000, "detector": "threshold", "detector_window": 100000, "detector_k": 5.0, "line_freq": 50}
+
+#Synthetic trace sets (synthetic_trace.make_trace arguments), each written as two files of one million samples with a fixed seed
+SYNTHETIC_SETS = {"clean": {}, "line_noise": {"line_noise": 0.02}, "busy": {"event_rate": 200}, "drift": {"drift": 0.2},
+                  "deep_subpeaks": {"subpeak_depth": 0.3, "n_subpeaks": 6}}
+
+STAGES = ["read", "baseline_detect", "events"]
+
+def make_synthetic(cache_dir: str) -> list[str]:
+    """Writes the synthetic trace sets into cache_dir (unless they are already there) and returns their directories."""
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from synthetic_trace import generate_dir
+    dirs = []
+    for seed, (name, kwargs) in enumerate(SYNTHETIC_SETS.items()):
+        dir_path = os.path.join(cache_dir, name)
+        if not os.path.exists(os.path.join(dir_path, "ground_truth.pkl")):
+            generate_dir(dir_path, 2, 1000000, HARNESS_SETTINGS["sample_rate"], seed, **kwargs)
+        dirs.append(dir_path)
+    return dirs
+
+def trace_files(dirs: list[str]) -> list[tuple[str, str]]:
+    """(key, path) of every tdms file in dirs, keyed by directory and file name so both sides agree on them."""
+    return [(f"{os.path.basename(os.path.normpath(d))}/{os.path.basename(path)}", path) for d in dirs for path in sorted(glob(os.path.join(d, "*.tdms")))]
+
+def extract_trace(path: str, settings: dict) -> dict:
+    """Runs one file through the extractor imported from sys.path, timing each stage. Uses only Model methods that older copies of
+    the extractor have too, so any commit can be the reference."""
+    from model import Model, TdmsDir, EventError, ReachedEnd
+    berth = int(settings["event_berth"])
+    timings = {}
+    model = Model()
+    model.tdms = TdmsDir(os.path.dirname(path))
+    model.tdms.file_list = [path]
+    start = time.perf_counter()
+    try:
+        model.next_file()
+    except ReachedEnd:
+        return {"reason": "unreadable", "timings": {"read": time.perf_counter() - start}}
+    timings["read"] = time.perf_counter() - start
+    start = time.perf_counter()
+    if hasattr(model, "process_current_file"):
+        reason = model.process_current_file(settings)
+    else:
+        try:
+            model.slope_fix_average_run_method(model.current_data)
+            model.update_event_boundaries(float(settings["event_thresh"]), int(settings["gap_tol"]))
+            reason = None if len(model.event_boundaries) > 0 else "no events found"
+        except Exception:
+            reason = "baseline fit failed"
+    timings["baseline_detect"] = time.perf_counter() - start
+    start = time.perf_counter()
+    attrs = []
+    if hasattr(model, "gen_file_events"):
+        if reason is None:
+            attrs = [event_attrs for event_attrs, _ in model.gen_file_events(berth, float(settings["sample_rate"]))]
+        for n, event_attrs in enumerate(attrs):
+            event_attrs["name"] = f"Event_No_{n + 1}"
+    else:
+        while reason is None:
+            try:
+                model.next_event(berth)
+            except EventError:
+                break
+            attrs.append(model.gen_event_attrs(f"Event_No_{len(attrs) + 1}", berth, float(settings["sample_rate"])))
+    timings["events"] = time.perf_counter() - start
+    boundaries = np.array(model.event_boundaries if model.event_boundaries is not None else [], dtype=np.int64).reshape(-1, 2)
+    return {"reason": reason or "", "baseline_nA": getattr(model, "bsln", np.nan), "noise_nA": getattr(model, "noise", np.nan),
+            "boundaries": boundaries, "attrs": pd.DataFrame(attrs), "timings": timings}
+
+def run(extractor_dir: str, output_path: str, trace_dirs: list[str], settings: dict, repeats: int = 1):
+    """Extracts every trace with the extractor in extractor_dir and saves the results, keeping the fastest time of each stage over
+    repeats runs."""
+    sys.path.insert(0, os.path.abspath(extractor_dir))
+    with h.File(output_path, 'w') as out:
+        out.attrs["extractor"] = os.path.abspath(extractor_dir)
+        out.attrs["settings"] = json.dumps(settings)
+        try:
+            out.attrs["commit"] = subprocess.run(["git", "rev-parse", "HEAD"], cwd=extractor_dir, capture_output=True, text=True).stdout.strip()
+        except OSError:
+            out.attrs["commit"] = ""
+        for key, path in trace_files(trace_dirs):
+            result = extract_trace(path, settings)
+            for _ in range(repeats - 1):
+                for stage, elapsed in extract_trace(path, settings)["timings"].items():
+                    result["timings"][stage] = min(result["timings"][stage], elapsed)
+            group = out.create_group(key)
+            group.attrs["reason"] = result["reason"]
+            group.attrs["baseline_nA"] = result.get("baseline_nA", np.nan)
+            group.attrs["noise_nA"] = result.get("noise_nA", np.nan)
+            group.create_dataset("boundaries", data=result.get("boundaries", np.zeros((0, 2), dtype=np.int64)))
+            attrs = group.create_group("attrs")
+            for column, values in result.get("attrs", pd.DataFrame()).items():
+                if pd.api.types.is_numeric_dtype(values):
+                    attrs.create_dataset(column, data=values.to_numpy(dtype=float))
+            for stage, elapsed in result["timings"].items():
+                group.attrs[f"{stage}_s"] = elapsed
+            print(f"{key}: {len(group['boundaries'])} events, {sum(result['timings'].values()):.2f} s")
+
+def load_results(path: str) -> dict:
+    results = {}
+    with h.File(path, 'r') as f:
+        def visit(name, obj):
+            if isinstance(obj, h.Group) and "boundaries" in obj:
+                results[name] = {"reason": obj.attrs["reason"], "baseline_nA": obj.attrs["baseline_nA"], "noise_nA": obj.attrs["noise_nA"],
+                                 "boundaries": obj["boundaries"][:], "attrs": {col: obj["attrs"][col][:] for col in obj["attrs"]},
+                                 "timings": {stage: obj.attrs[f"{stage}_s"] for stage in STAGES if f"{stage}_s" in obj.attrs}}
+        f.visititems(visit)
+    return results
+
+def compare(reference_path: str, candidate_path: str, rtol: float = 1e-9, atol: float = 1e-12, boundary_tol: int = 0) -> tuple[list[str], pd.DataFrame]:
+    """Compares two sets of results, returning a description of every difference beyond the tolerances and a table of the time
+    each side spent in each stage over all the traces."""
+    reference = load_results(reference_path)
+    candidate = load_results(candidate_path)
+    problems = [f"{key}: missing from the candidate" for key in reference if key not in candidate]
+    problems += [f"{key}: missing from the reference" for key in candidate if key not in reference]
+    for key in [key for key in reference if key in candidate]:
+        ref, cand = reference[key], candidate[key]
+        if ref["reason"] != cand["reason"]:
+            problems.append(f"{key}: skipped for '{ref['reason']}' in the reference but '{cand['reason']}' in the candidate")
+        for value in ("baseline_nA", "noise_nA"):
+            if not np.isclose(ref[value], cand[value], rtol=rtol, atol=atol, equal_nan=True):
+                problems.append(f"{key}: {value} {ref[value]} in the reference but {cand[value]} in the candidate")
+        if len(ref["boundaries"]) != len(cand["boundaries"]):
+            problems.append(f"{key}: {len(ref['boundaries'])} events in the reference but {len(cand['boundaries'])} in the candidate")
+            continue
+        moved = np.flatnonzero(np.any(np.abs(ref["boundaries"] - cand["boundaries"]) > boundary_tol, axis=1))
+        if len(moved) > 0:
+            problems.append(f"{key}: boundaries of {len(moved)} events differ by more than {boundary_tol} samples, first is event "
+                            f"{moved[0] + 1} at {ref['boundaries'][moved[0]].tolist()} vs {cand['boundaries'][moved[0]].tolist()}")
+        for column in ref["attrs"].keys() & cand["attrs"].keys():
+            differ = ~np.isclose(ref["attrs"][column], cand["attrs"][column], rtol=rtol, atol=atol, equal_nan=True)
+            if np.any(differ):
+                first = np.flatnonzero(differ)[0]
+                problems.append(f"{key}: {column} differs for {np.count_nonzero(differ)} events, first is event {first + 1} with "
+                                f"{ref['attrs'][column][first]} vs {cand['attrs'][column][first]}")
+    rows = []
+    for stage in STAGES:
+        ref_time = sum(result["timings"].get(stage, 0) for result in reference.values())
+        cand_time = sum(result["timings"].get(stage, 0) for result in candidate.values())
+        rows.append({"stage": stage, "reference_s": ref_time, "candidate_s": cand_time, "speedup": ref_time/cand_time if cand_time > 0 else np.nan})
+    timings = pd.DataFrame(rows)
+    total = timings[["reference_s", "candidate_s"]].sum()
+    timings.loc[len(timings)] = {"stage": "total", "reference_s": total["reference_s"], "candidate_s": total["candidate_s"],
+                                 "speedup": total["reference_s"]/total["candidate_s"] if total["candidate_s"] > 0 else np.nan}
+    return problems, timings
+
+def report(reference_path: str, candidate_path: str, **tolerances) -> bool:
+    problems, timings = compare(reference_path, candidate_path, **tolerances)
+    print(timings.to_string(index=False))
+    if len(problems) == 0:
+        print("Candidate output matches the reference.")
+        return True
+    print(f"{len(problems)} differences from the reference:")
+    for problem in problems:
+        print(f"  {problem}")
+    return False
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Golden-output regression and performance check for the extractor.")
+    subparsers = parser.add_subparsers(dest="cmd", required=True)
+    run_parser = subparsers.add_parser("run", help="Extract the traces with one copy of the extractor and save the results")
+    run_parser.add_argument("extractor", help="Extractor directory (the one containing model.py)")
+    run_parser.add_argument("output", help="Results file to write")
+    check_parser = subparsers.add_parser("check", help="Run a reference and a candidate extractor and compare them")
+    check_parser.add_argument("reference", help="Reference extractor directory")
+    check_parser.add_argument("candidate", help="Candidate extractor directory")
+    for sub in (run_parser, check_parser):
+        sub.add_argument("--traces", nargs="*", default=[], help="Directories of real tdms files to include")
+        sub.add_argument("--cache", default=os.path.join(tempfile.gettempdir(), "extractor_regression_traces"),
+                         help="Where the synthetic traces are kept between runs")
+        sub.add_argument("--no-synthetic", action="store_true", help="Only use the traces given")
+        sub.add_argument("--repeats", type=int, default=1, help="Runs per trace, keeping the fastest time of each stage")
+        sub.add_argument("settings", nargs="*", help="Settings overriding the harness defaults as name=value")
+    compare_parser = subparsers.add_parser("compare", help="Compare two results files")
+    compare_parser.add_argument("reference")
+    compare_parser.add_argument("candidate")
+    for sub in (check_parser, compare_parser):
+        sub.add_argument("--rtol", type=float, default=1e-9, help="Relative tolerance for attributes, baseline and noise")
+        sub.add_argument("--atol", type=float, default=1e-12, help="Absolute tolerance for attributes, baseline and noise")
+        sub.add_argument("--boundary-tol", type=int, default=0, help="Samples an event boundary may move by")
+    args = parser.parse_args()
+
+    if args.cmd == "compare":
+        sys.exit(0 if report(args.reference, args.candidate, rtol=args.rtol, atol=args.atol, boundary_tol=args.boundary_tol) else 1)
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "extractor"))
+    from extractor_utils.util_funcs import parse_setting
+    settings = {**HARNESS_SETTINGS, **{name: parse_setting(val) for name, val in (arg.split("=") for arg in args.settings)}}
+    trace_dirs = ([] if args.no_synthetic else make_synthetic(args.cache)) + args.traces
+    if args.cmd == "run":
+        run(args.extractor, args.output, trace_dirs, settings, args.repeats)
+        sys.exit()
+    with tempfile.TemporaryDirectory() as tmp:
+        outputs = []
+        for name, extractor_dir in (("reference", args.reference), ("candidate", args.candidate)):
+            print(f"Running the {name} extractor in {extractor_dir}...")
+            output = os.path.join(tmp, f"{name}.hdf5")
+            #Each side runs in its own process so the two copies of the extractor's modules don't mix
+            command = [sys.executable, os.path.abspath(__file__), "run", extractor_dir, output, *[f"{name}={val}" for name, val in settings.items()],
+                       "--no-synthetic", "--repeats", str(args.repeats), "--traces", *trace_dirs]
+            subprocess.run(command, check=True)
+            outputs.append(output)
+        sys.exit(0 if report(*outputs, rtol=args.rtol, atol=args.atol, boundary_tol=args.boundary_tol) else 1)
@@ -0,0 +1,92 @@
+"""
+Use this script to generate synthetic nanopore traces as TDMS files, for testing and benchmarking the extractor without real data.
+Each trace has a drifting baseline, white noise and optional mains pickup, with events (current drops) arriving at random. Events
+can carry barcode sub-peaks, i.e. short extra drops within the event. The ground truth for every event is saved as ground_truth.pkl in the output directory.
+"""
+
+import os
+import argparse
+import numpy as np
+import pandas as pd
+from scipy.signal import lfilter
+from nptdms import TdmsWriter, ChannelObject
+
+def make_trace(n_samples: int, sample_rate: float, rng: np.random.Generator, baseline: float = 1.0, drift: float = 0.02, noise: float = 0.01,
+               line_noise: float = 0.0, event_rate: float = 20, dwell_mean: float = 1e-3, depth: float = 0.2, n_subpeaks: int = 3,
+               subpeak_depth: float = 0.1, subpeak_width: float = 5e-5, rise_time: float = 5e-6) -> tuple[np.ndarray, pd.DataFrame]:
+    """Makes one trace and a dataframe describing its events. Rates and times are in Hz and seconds, currents in nA, and depths
+    are positive numbers giving the drop below baseline. An event_rate of 0 gives a trace without any events."""
+    t = np.arange(n_samples)/sample_rate
+    duration = n_samples/sample_rate
+    data = baseline + drift*(t/duration + 0.5*np.sin(2*np.pi*t/duration))
+    if line_noise > 0:
+        data += line_noise*np.sin(2*np.pi*50*t + rng.uniform(0, 2*np.pi))
+
+    #Events arrive as a Poisson process, each starting after the previous one has finished
+    drop = np.zeros(n_samples)
+    rows = []
+    min_dwell = max(int(4*subpeak_width*sample_rate), 10)
+    position = int(rng.exponential(sample_rate/event_rate)) if event_rate > 0 else n_samples
+    while True:
+        dwell = max(int(rng.exponential(dwell_mean*sample_rate)), min_dwell)
+        if position + dwell >= n_samples:
+            break
+        drop[position:position + dwell] += depth
+        sub_width = max(int(subpeak_width*sample_rate), 1)
+        sub_locs = np.sort(rng.uniform(0.1, 0.9, n_subpeaks))
+        for loc in sub_locs:
+            sub_start = position + int(loc*dwell) - sub_width//2
+            drop[sub_start:sub_start + sub_width] += subpeak_depth
+        rows.append({"start": position, "end": position + dwell - 1, "dwell_s": dwell/sample_rate, "depth_nA": depth,
+                     "subpeak_locs": sub_locs, "subpeak_depth_nA": subpeak_depth})
+        position += dwell + int(rng.exponential(sample_rate/event_rate))
+
+    #Finite rise time from a single-pole low-pass response applied to the event drops only
+    if rise_time > 0:
+        alpha = 1 - np.exp(-1/(rise_time*sample_rate))
+        drop = lfilter([alpha], [1, alpha - 1], drop)
+    data = data - drop + rng.normal(0, noise, n_samples)
+    return data, pd.DataFrame(rows, columns=["start", "end", "dwell_s", "depth_nA", "subpeak_locs", "subpeak_depth_nA"])
+
+def write_tdms(path: str, data: np.ndarray, sample_rate: float, segment_size: int = 1000000):
+    """Writes a trace to a TDMS file in several segments, like an acquisition that appends as it goes."""
+    with TdmsWriter(path) as writer:
+        for i in range(0, len(data), segment_size):
+            props = {"wf_increment": 1/sample_rate} if i == 0 else {}
+            writer.write_segment([ChannelObject("Data", "Current", data[i:i + segment_size], properties=props)])
+
+def generate_dir(out_dir: str, n_files: int = 5, samples_per_file: int = 2000000, sample_rate: float = 1e6, seed: int = 0, **trace_kwargs) -> pd.DataFrame:
+    """Writes n_files consecutive synthetic traces into out_dir and returns (and saves) the combined ground truth."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    truth = []
+    for n in range(n_files):
+        name = f"synthetic_{n:04d}.tdms"
+        data, events = make_trace(samples_per_file, sample_rate, rng, **trace_kwargs)
+        write_tdms(os.path.join(out_dir, name), data, sample_rate)
+        events.insert(0, "file", name)
+        truth.append(events)
+    truth = pd.concat(truth, ignore_index=True)
+    truth.to_pickle(os.path.join(out_dir, "ground_truth.pkl"))
+    return truth
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic nanopore TDMS traces with ground truth.")
+    parser.add_argument("out_dir")
+    parser.add_argument("--files", type=int, default=5)
+    parser.add_argument("--samples", type=int, default=2000000, help="Samples per file")
+    parser.add_argument("--sample-rate", type=float, default=1e6)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--drift", type=float, default=0.02, help="Baseline drift over each file /nA")
+    parser.add_argument("--noise", type=float, default=0.01, help="RMS white noise /nA")
+    parser.add_argument("--line-noise", type=float, default=0.0, help="50 Hz pickup amplitude /nA")
+    parser.add_argument("--event-rate", type=float, default=20, help="Mean events per second")
+    parser.add_argument("--dwell", type=float, default=1e-3, help="Mean event dwell time /s")
+    parser.add_argument("--depth", type=float, default=0.2, help="Event depth /nA")
+    parser.add_argument("--subpeaks", type=int, default=3, help="Barcode sub-peaks per event")
+    parser.add_argument("--subpeak-depth", type=float, default=0.1, help="Extra depth of each sub-peak /nA")
+    args = parser.parse_args()
+    truth = generate_dir(args.out_dir, args.files, args.samples, args.sample_rate, args.seed, drift=args.drift, noise=args.noise,
+                         line_noise=args.line_noise, event_rate=args.event_rate, dwell_mean=args.dwell, depth=args.depth,
+                         n_subpeaks=args.subpeaks, subpeak_depth=args.subpeak_depth)
+    print(f"Wrote {args.files} files with {len(truth)} events to {args.out_dir}")